@@ -33,6 +33,7 @@ setup(name='tinys3',
 
       package_dir={'': '.'},
       install_requires=install_requires,
+      extras_require={'async': ['aiohttp']},
       tests_require=['nose', 'flexmock'],
       test_suite='tinys3.tests'
 )
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import sys
 
 from .connection import Connection
 from .pool import Pool
@@ -12,3 +13,8 @@ __version__ = '0.1.12'
 __author__ = 'Shlomi Atar'
 __license__ = 'Apache 2.0'
 __all__ = ["Connection", "Conn", "Pool", "MultipartUpload"]
+
+# The asyncio connection relies on async generators (Python 3.6+)
+if sys.version_info >= (3, 6):
+    from .async_connection import AsyncConnection
+    __all__.append("AsyncConnection")
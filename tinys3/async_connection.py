@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+tinys3.async_connection
+~~~~~~~~~~~~~~~~~~~~~~~
+
+An asyncio implementation of the S3 connection, backed by aiohttp
+
+"""
+
+import os
+
+from requests.utils import requote_uri
+
+from .auth import SignableRequest
+from .connection import Base
+from .multipart_upload import MultipartUpload
+from .request_factory import (UploadRequest, UpdateMetadataRequest,
+                              CopyRequest, DeleteRequest, GetRequest,
+                              ListRequest, ListMultipartUploadRequest,
+                              ListPartsRequest, HeadRequest,
+                              InitiateMultipartUploadRequest,
+                              UploadPartRequest, CompleteUploadRequest,
+                              CancelUploadRequest)
+from .util import LenWrapperStream
+
+# The coroutines offered by AsyncConnection
+SUPPORTED_METHODS = ('get', 'list', 'upload', 'copy', 'update_metadata',
+                     'delete', 'head_bucket', 'head_object',
+                     'list_multipart_uploads', 'get_all_multipart_uploads',
+                     'initiate_multipart_upload', 'close')
+
+
+def _not_supported(name):
+    """
+    Returns a method failing clearly, for the methods of Connection that
+    AsyncConnection doesn't offer (yet)
+    """
+    def method(self, *args, **kwargs):
+        raise NotImplementedError(
+            "AsyncConnection doesn't support {0}, its coroutines are: "
+            "{1}".format(name, ', '.join(SUPPORTED_METHODS)))
+    method.__name__ = name
+    method.__doc__ = "Not supported by AsyncConnection"
+    return method
+
+
+class AsyncConnection(Base):
+    """
+    An asyncio implementation of an S3 connection.
+
+    Offers the basic methods of Connection as coroutines: get, list,
+    upload, copy, update_metadata, delete, head_bucket, head_object,
+    list_multipart_uploads, get_all_multipart_uploads and
+    initiate_multipart_upload. The list methods (list,
+    list_multipart_uploads) return async iterators. The other methods of
+    Connection (batches, downloads, parallel listings, etc.) raise
+    NotImplementedError.
+
+    The connection must be closed with `await conn.close()`, or used with
+    `async with`.
+
+    Requests are signed exactly like the ones issued by Connection and Pool,
+    and sent using a non-blocking aiohttp session, so thousands of requests
+    can be in flight without a thread for each of them.
+
+    Usage:
+
+    >>> async with AsyncConnection(access_key, secret_key) as conn:
+    >>>     r = await conn.get('my_awesome_key.zip', 'sample_bucket')
+    >>>     async for f in conn.list('rep/', 'sample_bucket'):
+    >>>         print(f['key'])
+    """
+
+    def __init__(self, access_key, secret_key, default_bucket=None, tls=False,
+                 endpoint="s3.amazonaws.com", pool_size=100):
+        """
+        Creates a new asyncio S3 connection
+
+        Params:
+            - access_key        AWS access key
+            - secret_key        AWS secret key
+            - default_bucket    (Optional) Sets the default bucket, so requests
+              inside this connection won't have to specify the bucket every
+              time.
+            - tls               (Optional) Make the requests using secure
+              connection (Defaults to False)
+            - endpoint          (Optional) Sets the s3 endpoint.
+            - pool_size         (Optional) The maximum number of simultaneous
+              connections (Defaults to 100)
+        """
+        super(AsyncConnection, self).__init__(access_key, secret_key,
+                                              default_bucket=default_bucket,
+                                              tls=tls, endpoint=endpoint,
+                                              pool_size=pool_size)
+
+    def _create_session(self, pool_size):
+        """
+        aiohttp sessions must be created inside a running event loop, so the
+        session is created lazily, by the adapter method.
+        """
+        return None
+
+    def adapter(self):
+        """
+        Returns the aiohttp session used to issue the requests.
+        useful for testing
+        """
+        if self.session is None:
+            try:
+                import aiohttp
+            except ImportError:
+                raise ImportError("AsyncConnection requires the aiohttp "
+                                  "package")
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size))
+        return self.session
+
+    async def _request(self, method, url, params=None, headers=None,
+                       data=None):
+        """
+        Signs and sends a request, and reads its response
+
+        Params:
+            - method    The HTTP method of the request
+            - url       The url of the request, as generated by
+                        S3Request.bucket_url
+            - params    (Optional) A dict of query string params. Params
+                        with a None value are skipped, like requests does.
+            - headers   (Optional) A dict of headers
+            - data      (Optional) The body of the request
+
+        Returns:
+            A (response, body) tuple. The body was read to its end, which
+            releases the connection to the session, and stays readable with
+            `await response.read()`.
+        """
+        headers = dict((k, str(v)) for k, v in (headers or {}).items())
+        if (data is not None or method in ('PUT', 'POST')) and \
+                not any(k.lower() == 'content-type' for k in headers):
+            # aiohttp adds a Content-Type to the requests with a body (and
+            # to all the PUT and POST requests) after they're signed, so the
+            # signature wouldn't match
+            headers['Content-Type'] = 'application/octet-stream'
+        # Sign the same url requests would have sent
+        url = requote_uri(url)
+        self.auth(SignableRequest(method, url, headers))
+        if params is not None:
+            params = dict((k, v) for k, v in params.items() if v is not None)
+        resp = await self.adapter().request(method, url, params=params,
+                                            headers=headers, data=data)
+        # Closes the response if the body can't be read. An explicitly
+        # released response can't be read again, so it's not released.
+        body = await resp.read()
+        resp.raise_for_status()
+        return resp, body
+
+    async def get(self, key, bucket=None, headers=None):
+        """
+        Get a key from a bucket, see Connection.get
+        """
+        r = GetRequest(self, key, self.bucket(bucket), headers=headers)
+        resp, body = await self._request('GET',
+                                         r.bucket_url(r.key, r.bucket),
+                                         headers=r.headers)
+        return resp
+
+    async def list(self, prefix='', bucket=None):
+        """
+        List files, see Connection.list
+
+        Returns:
+            - An async iterator over the files
+        """
+        r = ListRequest(self, prefix, self.bucket(bucket))
+        url = r.bucket_url('', r.bucket)
+        marker = ''
+        more = True
+        while more:
+            resp, body = await self._request('GET', url, params={
+                'prefix': r.prefix,
+                'marker': marker,
+            })
+            files, more = r._parse_page(body)
+            for p in files:
+                yield p
+            if more:
+                marker = p['key']
+
+    async def upload(self, key, local_file,
+                     bucket=None, expires=None, content_type=None,
+                     public=True, headers=None, rewind=True, close=False):
+        """
+        Upload a file and store it under a key, see Connection.upload
+        """
+        r = UploadRequest(self, key, local_file, self.bucket(bucket),
+                          expires=expires, content_type=content_type,
+                          public=public, extra_headers=headers, rewind=rewind,
+                          close=close)
+        headers = r._build_headers()
+        if rewind and hasattr(local_file, 'seek'):
+            local_file.seek(0, os.SEEK_SET)
+        try:
+            # S3 doesn't support chunked transfer, so the length is always set
+            headers['Content-Length'] = len(LenWrapperStream(local_file))
+            resp, body = await self._request(
+                'PUT', r.bucket_url(r.key, r.bucket), headers=headers,
+                data=local_file)
+            return resp
+        finally:
+            if close and hasattr(local_file, 'close'):
+                local_file.close()
+
+    async def copy(self, from_key, from_bucket, to_key, to_bucket=None,
+                   metadata=None, public=True):
+        """
+        Copy a key contents to another key/bucket, see Connection.copy
+        """
+        to_bucket = self.bucket(to_bucket or from_bucket)
+        r = CopyRequest(self, from_key, from_bucket, to_key, to_bucket,
+                        metadata=metadata, public=public)
+        resp, body = await self._request('PUT',
+                                         r.bucket_url(r.to_key, r.to_bucket),
+                                         headers=r._build_headers())
+        return resp
+
+    async def update_metadata(self, key, metadata=None, bucket=None,
+                              public=True):
+        """
+        Updates the metadata information for a file, see
+        Connection.update_metadata
+        """
+        r = UpdateMetadataRequest(self, key, self.bucket(bucket), metadata,
+                                  public)
+        resp, body = await self._request('PUT',
+                                         r.bucket_url(r.to_key, r.to_bucket),
+                                         headers=r._build_headers())
+        return resp
+
+    async def delete(self, key, bucket=None):
+        """
+        Delete a key from a bucket, see Connection.delete
+        """
+        r = DeleteRequest(self, key, self.bucket(bucket))
+        resp, body = await self._request('DELETE',
+                                         r.bucket_url(r.key, r.bucket))
+        return resp
+
+    async def head_bucket(self, bucket=None):
+        r = HeadRequest(self, self.bucket(bucket))
+        resp, body = await self._request('HEAD',
+                                         r.bucket_url(r.key, r.bucket))
+        return resp
+
+    async def head_object(self, key, bucket=None, headers=None):
+        r = HeadRequest(self, self.bucket(bucket), key, headers=headers)
+        resp, body = await self._request('HEAD',
+                                         r.bucket_url(r.key, r.bucket),
+                                         headers=r.headers)
+        return resp
+
+    async def list_multipart_uploads(self, prefix='', bucket=None,
+                                     encoding=None, max_uploads=1000,
+                                     key_marker='', upload_id_marker=''):
+        """
+        List a bucket's ongoing multipart uploads, see
+        Connection.list_multipart_uploads
+
+        Returns:
+            - An async iterator over AsyncMultipartUpload objects
+        """
+        r = ListMultipartUploadRequest(self, prefix, self.bucket(bucket),
+                                       max_uploads, encoding, key_marker,
+                                       upload_id_marker)
+        url = r.bucket_url('', r.bucket)
+        more = True
+        while more:
+            resp, body = await self._request('GET', url, params={
+                'encoding-type': r.encoding,
+                'max-uploads': r.max_uploads,
+                'key-marker': r.key_marker,
+                'prefix': r.prefix,
+                'upload-id-marker': r.upload_id_marker
+            })
+            uploads, more = r._parse_page(body)
+            for mp in uploads:
+                amp = AsyncMultipartUpload(self, mp.bucket, mp.key)
+                amp.uploadId = mp.uploadId
+                yield amp
+
+    async def get_all_multipart_uploads(self, bucket=None, prefix=''):
+        """The non-generator version of list_multipart_uploads."""
+        return [mp async for mp in self.list_multipart_uploads(prefix,
+                                                                bucket)]
+
+    async def initiate_multipart_upload(self, key, bucket=None):
+        """Returns an AsyncMultipartUpload object, after initiating the
+        upload."""
+        mp = AsyncMultipartUpload(self, bucket, key)
+        await mp.initiate()
+        return mp
+
+    def _handle_request(self, request):
+        """
+        S3Request objects are blocking, they can't be run by an
+        AsyncConnection
+        """
+        raise NotImplementedError("AsyncConnection can't run blocking "
+                                  "requests, use its coroutines instead")
+
+    async def close(self):
+        """
+        Closes the aiohttp session
+        """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def __enter__(self):
+        """
+        The session can only be closed from a coroutine, use async with
+        """
+        raise TypeError("Use 'async with' with an AsyncConnection")
+
+    async def __aenter__(self):
+        """
+        Async context manager implementation
+        """
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        """
+        Closes the connection
+        """
+        await self.close()
+
+    get_many = _not_supported('get_many')
+    upload_many = _not_supported('upload_many')
+    delete_many = _not_supported('delete_many')
+    delete_prefix = _not_supported('delete_prefix')
+    download = _not_supported('download')
+    iter_chunks = _not_supported('iter_chunks')
+    get_ranges = _not_supported('get_ranges')
+    open = _not_supported('open')
+    list_v2 = _not_supported('list_v2')
+    list_batches = _not_supported('list_batches')
+    list_parallel = _not_supported('list_parallel')
+    resume_multipart_upload = _not_supported('resume_multipart_upload')
+
+
+class AsyncMultipartUpload(MultipartUpload):
+    """The asyncio version of MultipartUpload, its methods are coroutines and
+    list_parts is an async iterator."""
+
+    async def initiate(self):
+        req = InitiateMultipartUploadRequest(self.conn, self.key, self.bucket)
+        resp, body = await self.conn._request(
+            'POST', req.bucket_url(req.key, req.bucket))
+        self.uploadId = req._parse_upload_id(body)
+        return self.uploadId
+
+    async def upload_part_from_file(self, fp, part_num, length=None, md5=None,
+                                    close=False, rewind=True):
+        """
+        Uploads a part from a file object, see
+        MultipartUpload.upload_part_from_file
+        """
+        extra_headers = {}
+        if length is None:
+            length = len(LenWrapperStream(fp))
+        extra_headers['Content-Length'] = length
+        if md5 is not None:
+            extra_headers['Content-MD5'] = md5
+        req = UploadPartRequest(self.conn, self.key, self.bucket, fp,
+                                part_num, self.uploadId, close, rewind,
+                                extra_headers)
+        if rewind and hasattr(fp, 'seek'):
+            fp.seek(0, os.SEEK_SET)
+        try:
+            resp, body = await self.conn._request(
+                'PUT', req.bucket_url(req.key, req.bucket),
+                headers=req.headers, data=fp)
+        finally:
+            if close and hasattr(fp, 'close'):
+                fp.close()
+        self._record_part(part_num, resp)
+        return resp
+
+    async def complete_upload(self):
+        """Finishes the multipart upload, see MultipartUpload.complete_upload
+        """
+        if self.parts:
+            parts = [{'part_number': n, 'etag': self.parts[n]}
+                     for n in sorted(self.parts)]
+        else:
+            parts = [part async for part in self.list_parts()]
+        req = CompleteUploadRequest(self.conn, self.key, self.bucket,
+                                    self.uploadId, parts)
+        resp, body = await self.conn._request(
+            'POST', req.bucket_url(req.key, req.bucket),
+            headers={'Content-Type': 'application/xml'},
+            data=req._build_body().encode('utf-8'))
+        return resp
+
+    async def cancel_upload(self):
+        """Aborts the multipart upload"""
+        req = CancelUploadRequest(self.conn, self.key, self.bucket,
+                                  self.uploadId)
+        resp, body = await self.conn._request(
+            'DELETE', req.bucket_url(req.key, req.bucket))
+        return resp
+
+    async def list_parts(self, encoding=None, max_parts=1000,
+                         part_number_marker=''):
+        """Async iterator over the uploaded parts of this multipart upload,
+        see MultipartUpload.list_parts"""
+        r = ListPartsRequest(self.conn, self.key, self.bucket, self.uploadId,
+                             max_parts, encoding, part_number_marker)
+        url = r.bucket_url(r.key, r.bucket)
+        more = True
+        while more:
+            resp, body = await self.conn._request('GET', url, params={
+                'encoding-type': r.encoding,
+                'max-parts': r.max_parts,
+                'part-number-marker': r.part_number_marker
+            })
+            parts, more = r._parse_page(body)
+            for part in parts:
+                yield part
+
+    async def number_of_parts(self):
+        """Get the number of already uploaded parts."""
+        return len([part async for part in self.list_parts()])
@@ -29,6 +29,35 @@ AWS_QUERY_PARAMS = ['versioning', 'location', 'acl', 'torrent', 'lifecycle',
                     'uploads', 'partnumber', 'uploadid']
 
 
+class SignableRequest(object):
+    """
+    A minimal request structure that can be signed by S3Auth
+
+    Used by the transports that don't go through the requests lib, and
+    therefore don't have a requests.PreparedRequest to sign.
+
+    Usage:
+
+    >>> r = SignableRequest('GET', '<S3Url>', {'Range': 'bytes=0-99'})
+    >>> auth(r)
+    >>> r.headers['Authorization']
+    """
+
+    def __init__(self, method, url, headers=None):
+        """
+        Creates a new signable request
+
+        Params:
+            - method    The HTTP method of the request
+            - url       The full url of the request
+            - headers   (Optional) A dict with the request headers, it will
+                        be updated in place when the request is signed
+        """
+        self.method = method
+        self.url = url
+        self.headers = headers if headers is not None else {}
+
+
 class S3Auth(AuthBase):
     """
     S3 Custom Authenticator class for requests
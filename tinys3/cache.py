@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+tinys3.cache
+~~~~~~~~~~~~
+
+Caches for the bodies of keys fetched with Connection.get
+
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+from .util import stringify
+
+# os.replace is atomic on all platforms, os.rename only on posix (Python 2)
+_replace = getattr(os, 'replace', os.rename)
+
+# The default maximum size of a disk cache
+DEFAULT_DISK_CACHE_SIZE = 1024 * 1024 * 1024
+# The default maximum size of a memory cache
+DEFAULT_MEMORY_CACHE_SIZE = 64 * 1024 * 1024
+# The default maximum size of the keys kept in a memory cache
+DEFAULT_MEMORY_CACHE_ITEM_SIZE = 1024 * 1024
+
+
+def cached_response(url, body, headers):
+    """
+    Builds a requests Response for a body served from a cache
+
+    Params:
+        - url       The url of the key
+        - body      The cached body
+        - headers   A dict with the cached headers (ETag, Last-Modified)
+    """
+    r = Response()
+    r.status_code = 200
+    r.reason = 'OK'
+    r.url = url
+    r._content = body
+    r.headers = CaseInsensitiveDict(headers)
+    r.headers['Content-Length'] = str(len(body))
+    r.from_cache = True
+    return r
+
+
+class DiskCache(object):
+    """
+    An on-disk cache of keys, storing every body with its ETag and
+    Last-Modified headers.
+
+    Connections created with a disk cache revalidate the cached keys with
+    conditional (If-None-Match) GETs, and serve the cached body when S3
+    answers with 304 Not Modified. With a ttl, keys validated less than ttl
+    seconds ago are served without any request.
+
+    The cache can be shared by several processes: entries are written to a
+    temporary file and atomically renamed, and the least recently used
+    entries are evicted once the cache grows over max_size.
+
+    Usage:
+
+    >>> cache = DiskCache('/var/cache/tinys3', max_size=10 * 1024 ** 3)
+    >>> conn = Connection(access_key, secret_key, disk_cache=cache)
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_DISK_CACHE_SIZE, ttl=None):
+        """
+        Creates a new cache
+
+        Params:
+            - directory     The directory of the cache, created if needed
+            - max_size      (Optional) The maximum size of the cache in
+              bytes (Defaults to 1GB)
+            - ttl           (Optional) Serve keys validated less than ttl
+              seconds ago without revalidating them (Defaults to None, always
+              revalidate)
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.ttl = ttl
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Created by another process
+                if not os.path.isdir(directory):
+                    raise
+        # An estimate of the size of the cache, other processes may write to
+        # the same directory, so it's recalculated before evicting
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _path(self, bucket, key):
+        name = stringify(bucket) + '/' + stringify(key)
+        if not isinstance(name, bytes):
+            name = name.encode('utf-8')
+        return os.path.join(self.directory, hashlib.sha1(name).hexdigest())
+
+    def get(self, bucket, key):
+        """
+        Returns a (headers, body, fresh) tuple for a cached key, or None.
+        `fresh` is True if the key can be served without revalidation.
+        """
+        path = self._path(bucket, key)
+        try:
+            with open(path, 'rb') as f:
+                headers = json.loads(f.readline().decode('utf-8'))
+                body = f.read()
+            validated = os.stat(path).st_mtime
+            # Mark the entry as recently used
+            os.utime(path, (time.time(), validated))
+        except (IOError, OSError, ValueError):
+            # Missing, or evicted by another process in the meantime
+            return None
+        fresh = self.ttl is not None and time.time() - validated < self.ttl
+        return headers, body, fresh
+
+    def set(self, bucket, key, headers, body):
+        """
+        Stores a key
+
+        Params:
+            - bucket    The bucket of the key
+            - key       The key
+            - headers   A dict with the headers to store (ETag,
+                        Last-Modified)
+            - body      The body of the key
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(json.dumps(headers).encode('utf-8') + b'\n')
+                f.write(body)
+                size = f.tell()
+            _replace(tmp, self._path(bucket, key))
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+            if self._size is None or self._size > self.max_size:
+                self._evict()
+
+    def touch(self, bucket, key):
+        """
+        Marks a key as validated now
+        """
+        try:
+            os.utime(self._path(bucket, key), None)
+        except OSError:
+            pass
+
+    def delete(self, bucket, key):
+        """
+        Removes a key from the cache
+        """
+        try:
+            os.remove(self._path(bucket, key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        """
+        Removes the least recently used entries until the cache fits in
+        max_size
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.startswith('.tmp'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_atime, st.st_size, name))
+        size = sum(e[1] for e in entries)
+        for atime, entry_size, name in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            size -= entry_size
+        self._size = size
+
+
+class MemoryCache(object):
+    """
+    A memory resident LRU cache of small keys, bounded by the total size of
+    the cached bodies.
+
+    Connections created with a memory cache serve the cached keys without
+    any request. The cached keys are invalidated by the uploads, copies,
+    metadata updates and deletes issued through the same connection, keys
+    modified by other clients are only refreshed once they expire (with a
+    ttl) or are evicted.
+
+    Usage:
+
+    >>> cache = MemoryCache(max_size=64 * 1024 ** 2, ttl=30)
+    >>> conn = Connection(access_key, secret_key, memory_cache=cache)
+    >>> conn.get('manifest.json', 'my_bucket')
+    >>> cache.hits, cache.misses, cache.evictions
+    """
+
+    def __init__(self, max_size=DEFAULT_MEMORY_CACHE_SIZE,
+                 max_item_size=DEFAULT_MEMORY_CACHE_ITEM_SIZE, ttl=None):
+        """
+        Creates a new cache
+
+        Params:
+            - max_size      (Optional) The maximum total size of the cached
+              bodies in bytes (Defaults to 64MB)
+            - max_item_size (Optional) Larger keys aren't cached (Defaults to
+              1MB)
+            - ttl           (Optional) The number of seconds a key is cached
+              for (Defaults to None, until it's evicted or invalidated)
+        """
+        self.max_size = max_size
+        self.max_item_size = max_item_size
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, bucket, key):
+        """
+        Returns a (headers, body) tuple for a cached key, or None
+        """
+        with self._lock:
+            entry = self._entries.get((bucket, key))
+            if entry is not None and self.ttl is not None and \
+                    time.time() - entry[2] >= self.ttl:
+                self._remove((bucket, key))
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # Move the entry to the end (most recently used)
+            del self._entries[(bucket, key)]
+            self._entries[(bucket, key)] = entry
+            return entry[0], entry[1]
+
+    def set(self, bucket, key, headers, body):
+        """
+        Stores a key, if it's small enough
+        """
+        if len(body) > self.max_item_size:
+            return
+        with self._lock:
+            self._remove((bucket, key))
+            self._entries[(bucket, key)] = (headers, body, time.time())
+            self.size += len(body)
+            while self.size > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, bucket, key):
+        """
+        Removes a key from the cache
+        """
+        with self._lock:
+            self._remove((bucket, key))
+
+    def clear(self):
+        """
+        Removes all the keys from the cache
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, entry_key):
+        entry = self._entries.pop(entry_key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,10 +1,46 @@
 # -*- coding: utf-8 -*-
 
+import functools
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
 from .auth import S3Auth
+from .http_transport import HTTPClientAdapter
 from .request_factory import (UploadRequest, UpdateMetadataRequest,
                               CopyRequest, DeleteRequest, GetRequest,
+                              CachedGetRequest,
                               ListRequest, ListMultipartUploadRequest,
-                              HeadRequest)
+                              HeadRequest, MultipartUploadRequest,
+                              DownloadRequest, ChunksRequest,
+                              RangedDownloadRequest, MultiRangeRequest,
+                              DeleteObjectsRequest, DELETE_BATCH_SIZE,
+                              ParallelListRequest, DEFAULT_LIST_WORKERS,
+                              ListObjectsV2Request, ListBatchesRequest,
+                              PathUploadRequest,
+                              DEFAULT_CHUNK_SIZE, DEFAULT_RANGE_SIZE,
+                              DEFAULT_RANGE_GAP, DEFAULT_RANGE_WORKERS)
+from .multipart_upload import (DEFAULT_PART_SIZE, DEFAULT_PART_WORKERS,
+                               MIN_PART_SIZE)
+from .s3file import S3File, DEFAULT_BLOCK_SIZE, DEFAULT_CACHE_BLOCKS
+from .util import LenWrapperStream, iter_windowed
+
+# The default number of requests in flight of batch operations
+DEFAULT_MAX_IN_FLIGHT = 16
+# The default maximum size of the files uploaded at once by upload_many
+DEFAULT_MAX_IN_FLIGHT_BYTES = 256 * 1024 * 1024
+# The default number of Multi-Object Delete requests in flight
+DEFAULT_DELETE_IN_FLIGHT = 4
+
+
+def _etag(response):
+    """
+    Returns the ETag of an upload response, without its quotes, or None
+    """
+    etag = getattr(response, 'headers', {}).get('ETag')
+    return etag.strip('"') if etag else None
 
 
 class Base(object):
@@ -16,7 +52,11 @@ class Base(object):
     """
 
     def __init__(self, access_key, secret_key, default_bucket=None, tls=False,
-                 endpoint="s3.amazonaws.com"):
+                 endpoint="s3.amazonaws.com", pool_size=10,
+                 transport='requests', multipart_threshold=None,
+                 multipart_part_size=DEFAULT_PART_SIZE,
+                 multipart_workers=DEFAULT_PART_WORKERS, disk_cache=None,
+                 memory_cache=None, index=None):
         """
         Creates a new S3 connection
 
@@ -29,12 +69,74 @@ class Base(object):
             - tls               (Optional) Make the requests using secure
               connection (Defaults to False)
             - endpoint          (Optional) Sets the s3 endpoint.
+            - pool_size         (Optional) The maximum number of keep-alive
+              connections kept open per host (Defaults to 10)
+            - transport         (Optional) The HTTP transport to use, either
+              'requests' or 'http.client' for the low overhead transport,
+              that talks to S3 directly over http.client connections.
+              (Defaults to 'requests')
+            - multipart_threshold   (Optional) Files larger than this size
+              (in bytes) are uploaded as multipart uploads, with their parts
+              uploaded concurrently. (Defaults to None, which disables
+              multipart uploads)
+            - multipart_part_size   (Optional) The size of the parts of
+              multipart uploads, at least 5MB (Defaults to 8MB)
+            - multipart_workers     (Optional) The number of parts uploaded
+              concurrently (Defaults to 4)
+            - disk_cache        (Optional) A DiskCache that keys fetched
+              with get are stored in, and revalidated with conditional GETs
+              (Defaults to None)
+            - memory_cache      (Optional) A MemoryCache that small keys
+              fetched with get are kept in, and served from without any
+              request (Defaults to None)
+            - index             (Optional) A BucketIndex updated with the
+              uploads, copies and deletes completed through the connection
+              (Defaults to None)
 
         """
+        if multipart_part_size < MIN_PART_SIZE:
+            # S3 would only reject the parts when the upload is completed
+            raise ValueError("multipart_part_size must be at least {0} bytes "
+                             "(5MB)".format(MIN_PART_SIZE))
         self.default_bucket = default_bucket
         self.auth = S3Auth(access_key, secret_key)
         self.tls = tls
         self.endpoint = endpoint
+        self.pool_size = pool_size
+        self.transport = transport
+        self.session = self._create_session(pool_size)
+        self.multipart_threshold = multipart_threshold
+        self.multipart_part_size = multipart_part_size
+        self.multipart_workers = multipart_workers
+        self.disk_cache = disk_cache
+        self.memory_cache = memory_cache
+        self.index = index
+
+    def _create_session(self, pool_size):
+        """
+        Creates the requests session shared by all the requests issued
+        through this connection.
+
+        The session keeps the underlying TCP (and TLS) connections alive
+        between requests, instead of opening a new connection for every
+        request. The connection pools of the session are thread safe, so a
+        single session can be shared by the worker threads of a Pool.
+
+        Params:
+            - pool_size     The maximum number of connections to keep open
+              per host
+        """
+        if self.transport == 'http.client':
+            return HTTPClientAdapter(pool_size)
+        if self.transport != 'requests':
+            raise ValueError("Unknown transport: {0}".format(self.transport))
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
 
     def bucket(self, bucket):
         """
@@ -64,6 +166,11 @@ class Base(object):
         """
         Get a key from a bucket
 
+        If the connection has a memory cache, cached keys are served from
+        memory. If it has a disk cache, the key is served from the disk when
+        it wasn't modified. Requests with additional headers bypass the
+        caches.
+
         Params:
             - key           The key to get
 
@@ -80,10 +187,225 @@ class Base(object):
         >>> conn.get('my_awesome_key.zip','sample_bucket')
 
         """
-        r = GetRequest(self, key, self.bucket(bucket), headers=headers)
+        r = self._get_request(key, self.bucket(bucket), headers)
+        return self.run(r)
+
+    def _get_request(self, key, bucket, headers=None):
+        """
+        Returns the request getting a key, through the caches of the
+        connection if it has any
+        """
+        cached = self.disk_cache is not None or \
+            self.memory_cache is not None
+        if cached and not headers:
+            return CachedGetRequest(self, key, bucket,
+                                    disk_cache=self.disk_cache,
+                                    memory_cache=self.memory_cache)
+        return GetRequest(self, key, bucket, headers=headers)
+
+    def get_many(self, keys, bucket=None, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 ordered=False, headers=None):
+        """
+        Get many keys from a bucket, keeping a fixed window of requests in
+        flight
+
+        The keys are consumed lazily, and only max_in_flight responses are
+        held at a time, so huge (or endless) iterables of keys can be
+        fetched in bounded memory.
+
+        Params:
+            - keys          An iterable of keys to get
+            - bucket        (Optional) The name of the bucket to use
+            (can be skipped if setting the default_bucket)
+            - max_in_flight (Optional) The maximum number of requests in
+              flight (Defaults to 16)
+            - ordered       (Optional) Yield the keys in the order they were
+              given, instead of as soon as they are fetched (Defaults to
+              False)
+            - headers       (Optional) Additional headers of the requests
+
+        Returns:
+            - A generator of (key, response) tuples, the response is the
+              exception raised if getting the key failed
+
+        Usage:
+
+        >>> for key, r in conn.get_many(keys, 'sample_bucket'):
+        >>>     if isinstance(r, Exception):
+        >>>         failed.append(key)
+
+        """
+        bucket = self.bucket(bucket)
+        batch = ((key, self._get_request(key, bucket, headers))
+                 for key in keys)
+        return self._run_many(batch, max_in_flight, ordered)
+
+    def _run_many(self, batch, max_in_flight, ordered=False, weight=None,
+                  max_weight=None):
+        """
+        Runs (tag, request) tuples concurrently, with at most max_in_flight
+        requests (and max_weight of their weight) in flight, yielding a
+        (tag, result) tuple for each of them
+        """
+        executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        try:
+            for item in iter_windowed(
+                    lambda r: self._submit(r, executor), batch,
+                    max_in_flight, ordered, weight=weight,
+                    max_weight=max_weight):
+                yield item
+        finally:
+            executor.shutdown(wait=False)
+
+    def _submit(self, request, executor):
+        """
+        Runs a request of a batch in the executor of the batch, returning a
+        future
+        """
+        return executor.submit(request.run)
+
+    def download(self, key, dest, bucket=None, headers=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE, workers=1,
+                 range_size=DEFAULT_RANGE_SIZE):
+        """
+        Download a key to a file, without holding its body in memory
+
+        When downloading to a path with more than one worker, the key is
+        split to ranges that are fetched concurrently, and written at their
+        offset in the (preallocated) file.
+
+        Params:
+            - key           The key to download
+            - dest          A path, a file-like object or a callable, the
+              body is written (or passed) to it chunk by chunk.
+            - bucket        (Optional) The name of the bucket to use
+            (can be skipped if setting the default_bucket)
+            - headers       (Optional) Additional headers of the request
+            - chunk_size    (Optional) The size of the chunks (Defaults to
+              1MB)
+            - workers       (Optional) The number of ranges fetched
+              concurrently, when downloading to a path (Defaults to 1)
+            - range_size    (Optional) The size of the ranges (Defaults to
+              8MB)
+
+        Returns:
+            - A response object from the requests lib (its body already
+              consumed, or the response of the HEAD request for ranged
+              downloads) or a future that wraps that response object if used
+              with a pool.
+
+        Usage:
+
+        >>> conn.download('my_awesome_key.zip', '/tmp/my_awesome_key.zip',
+        >>>               'sample_bucket')
+
+        >>> conn.download('my_huge_key.zip', '/tmp/my_huge_key.zip',
+        >>>               'sample_bucket', workers=8)
+
+        """
+        is_path = not callable(dest) and not hasattr(dest, 'write')
+        if workers > 1 and is_path:
+            r = RangedDownloadRequest(self, key, self.bucket(bucket), dest,
+                                      workers, range_size=range_size,
+                                      headers=headers, chunk_size=chunk_size)
+        else:
+            r = DownloadRequest(self, key, self.bucket(bucket), dest,
+                                headers=headers, chunk_size=chunk_size)
+        return self.run(r)
+
+    def iter_chunks(self, key, bucket=None, headers=None,
+                    chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Stream the body of a key
+
+        Params:
+            - key           The key to get
+            - bucket        (Optional) The name of the bucket to use
+            (can be skipped if setting the default_bucket)
+            - headers       (Optional) Additional headers of the request
+            - chunk_size    (Optional) The size of the chunks (Defaults to
+              1MB)
+
+        Returns:
+            - An iterator over the chunks of the body (or a future that wraps
+              it if used with a pool)
+
+        Usage:
+
+        >>> for chunk in conn.iter_chunks('my_awesome_key.zip'):
+        >>>     digest.update(chunk)
+
+        """
+        r = ChunksRequest(self, key, self.bucket(bucket), headers=headers,
+                          chunk_size=chunk_size)
         return self.run(r)
 
-    def list(self, prefix='', bucket=None):
+    def get_ranges(self, key, ranges, bucket=None, gap=DEFAULT_RANGE_GAP,
+                   workers=DEFAULT_RANGE_WORKERS, headers=None):
+        """
+        Read many byte ranges of a key
+
+        Ranges that overlap or are closer than `gap` bytes are merged, and
+        the merged spans are fetched concurrently.
+
+        Params:
+            - key           The key to read
+            - ranges        A list of (start, end) tuples, end being
+              exclusive (like python slices)
+            - bucket        (Optional) The name of the bucket to use
+            (can be skipped if setting the default_bucket)
+            - gap           (Optional) Ranges separated by less than gap
+              bytes are fetched together (Defaults to 32KB)
+            - workers       (Optional) The number of spans fetched
+              concurrently (Defaults to 8)
+            - headers       (Optional) Additional headers of the requests
+
+        Returns:
+            - A list with a memoryview for every range, in the order of the
+              ranges (or a future that wraps it if used with a pool)
+
+        Usage:
+
+        >>> header, footer = conn.get_ranges('data.parquet',
+        >>>                                  [(0, 4), (size - 8, size)])
+
+        """
+        r = MultiRangeRequest(self, key, self.bucket(bucket), ranges, gap=gap,
+                              workers=workers, headers=headers)
+        return self.run(r)
+
+    def open(self, key, bucket=None, block_size=DEFAULT_BLOCK_SIZE,
+             cache_blocks=DEFAULT_CACHE_BLOCKS, headers=None):
+        """
+        Open a key as a read only, seekable file object
+
+        Only the blocks that are read are fetched (using ranged GETs), and
+        they are kept in an LRU cache. See tinys3.s3file.S3File.
+
+        Params:
+            - key           The key to open
+            - bucket        (Optional) The name of the bucket to use
+            (can be skipped if setting the default_bucket)
+            - block_size    (Optional) The size of the fetched blocks
+              (Defaults to 1MB)
+            - cache_blocks  (Optional) The number of cached blocks (Defaults
+              to 32)
+            - headers       (Optional) Additional headers of the requests
+
+        Returns:
+            - An S3File object. Its requests are blocking, even when used
+              with a pool.
+
+        Usage:
+
+        >>> with conn.open('archive.tar', 'sample_bucket') as f:
+        >>>     names = tarfile.open(fileobj=f).getnames()
+
+        """
+        return S3File(self, key, self.bucket(bucket), block_size=block_size,
+                      cache_blocks=cache_blocks, headers=headers)
+
+    def list(self, prefix='', bucket=None, prefetch=0):
         """
         List files
 
@@ -92,6 +414,8 @@ class Base(object):
 
             - bucket        (Optional) The name of the bucket to use (can be skipped if setting the default_bucket option) for the connection
 
+            - prefetch      (Optional) The number of pages fetched ahead on a background thread, while the current page is consumed (default to 0)
+
         Returns:
             - An iterator over the files, each file being represented by a dict object with the following keys:
                 - etag
@@ -106,8 +430,125 @@ class Base(object):
         >>> conn.list('rep/','sample_bucket')
 
         """
-        r = ListRequest(self, prefix, self.bucket(bucket))
+        r = ListRequest(self, prefix, self.bucket(bucket), prefetch=prefetch)
+
+        return self.run(r)
+
+    def list_v2(self, prefix='', bucket=None, delimiter=None, max_keys=None,
+                start_after=None, continuation_token=None, prefetch=0):
+        """
+        List files with the ListObjectsV2 API
+
+        Params:
+            - prefix        (Optional) List only files starting with this
+              prefix (default to the empty string)
+            - bucket        (Optional) The name of the bucket to use (can be
+              skipped if setting the default_bucket option)
+            - delimiter     (Optional) Group the keys containing the
+              delimiter after the prefix (e.g. '/' to browse "folders"), the
+              groups are yielded as {'prefix': common_prefix} dicts
+            - max_keys      (Optional) The maximum number of keys of a page
+              (S3 defaults to 1000)
+            - start_after   (Optional) List only the keys after this key
+            - continuation_token    (Optional) Continue a previous listing
+            - prefetch      (Optional) The number of pages fetched ahead on
+              a background thread (default to 0)
+
+        Returns:
+            - An iterator over the files (dicts like the ones of list), and
+              the common prefixes ({'prefix'} dicts)
 
+        Usage:
+
+        >>> for f in conn.list_v2('photos/', 'sample_bucket', delimiter='/'):
+        >>>     print(f.get('prefix') or f['key'])
+
+        """
+        r = ListObjectsV2Request(self, prefix, self.bucket(bucket),
+                                 delimiter=delimiter, max_keys=max_keys,
+                                 start_after=start_after,
+                                 continuation_token=continuation_token,
+                                 prefetch=prefetch)
+        return self.run(r)
+
+    def list_batches(self, prefix='', bucket=None, delimiter=None,
+                     prefetch=0):
+        """
+        List files one page at a time, as compact columnar batches
+
+        Every page is a ListingBatch, holding the keys in a list, the sizes
+        and the last modification times (in seconds since the epoch) in
+        arrays, and the ETags and storage classes in lists. Rows are decoded
+        only when they're accessed, so scanning large prefixes costs far less
+        memory and CPU than the dicts of list.
+
+        Params:
+            - prefix        (Optional) List only files starting with this
+              prefix (default to the empty string)
+            - bucket        (Optional) The name of the bucket to use (can be
+              skipped if setting the default_bucket option)
+            - delimiter     (Optional) Group the keys containing the
+              delimiter after the prefix, the groups are stored in the
+              prefixes list of the batches
+            - prefetch      (Optional) The number of pages fetched ahead on
+              a background thread (default to 0)
+
+        Returns:
+            - An iterator over ListingBatch objects
+
+        Usage:
+
+        >>> total = 0
+        >>> for batch in conn.list_batches('logs/', 'sample_bucket'):
+        >>>     total += sum(batch.sizes)
+        >>> batch.to_arrow()  # Requires pyarrow
+
+        """
+        r = ListBatchesRequest(self, prefix, self.bucket(bucket),
+                               delimiter=delimiter, prefetch=prefetch)
+        return self.run(r)
+
+    def list_parallel(self, prefix='', bucket=None, split_points=None,
+                      delimiter='/', workers=DEFAULT_LIST_WORKERS,
+                      ordered=False):
+        """
+        List files, listing several shards of the prefix concurrently
+
+        The prefix is split to shards at the given split points, or at the
+        common prefixes found by listing it with the delimiter (e.g. the
+        "folders" under the prefix), and the shards are listed concurrently.
+        Prefixes with fewer common prefixes than workers are split by the
+        character following the prefix instead.
+
+        Params:
+            - prefix        (Optional) List only files starting with this
+              prefix (default to the empty string)
+            - bucket        (Optional) The name of the bucket to use (can be
+              skipped if setting the default_bucket option)
+            - split_points  (Optional) A list of keys to split the listing
+              at, every shard lists the keys after a split point up to (and
+              including) the next one
+            - delimiter     (Optional) The delimiter used to discover the
+              shards when there are no split points (Defaults to '/')
+            - workers       (Optional) The number of shards listed
+              concurrently (Defaults to 8)
+            - ordered       (Optional) Yield the files ordered by their keys,
+              like list does (Defaults to False)
+
+        Returns:
+            - An iterator over the files, like list
+
+        Usage:
+
+        >>> conn.list_parallel('logs/', 'sample_bucket', workers=16)
+        >>> conn.list_parallel(bucket='sample_bucket',
+        >>>                    split_points=['4', '8', 'c'], ordered=True)
+
+        """
+        r = ParallelListRequest(self, prefix, self.bucket(bucket),
+                                split_points=split_points,
+                                delimiter=delimiter, workers=workers,
+                                ordered=ordered)
         return self.run(r)
 
     def upload(self, key, local_file,
@@ -147,6 +588,11 @@ class Base(object):
             - Close         (Optional) If true, tinys3 will close the file like
               object after the upload was complete
 
+        Notes:
+            - If the connection was created with a multipart_threshold, files
+              larger than the threshold are uploaded as multipart uploads.
+              The headers are sent with the request initiating the upload.
+
         Returns:
             - A response object from the requests lib or a future that wraps
               that response object if used with a pool.
@@ -164,11 +610,114 @@ class Base(object):
         There are more usage examples in the readme file.
 
         """
-        r = UploadRequest(self, key, local_file, self.bucket(bucket),
-                          expires=expires, content_type=content_type,
-                          public=public, extra_headers=headers, rewind=rewind,
-                          close=close)
-        return self.run(r)
+        r = self._upload_request(key, local_file, self.bucket(bucket),
+                                 expires=expires, content_type=content_type,
+                                 public=public, headers=headers,
+                                 rewind=rewind, close=close)
+        return self._run_write(r, self.bucket(bucket), key,
+                               self._index_upload(r, self.bucket(bucket), key))
+
+    def _upload_request(self, key, local_file, bucket, expires=None,
+                        content_type=None, public=True, headers=None,
+                        rewind=True, close=False):
+        """
+        Returns the request uploading a file, a multipart upload if the file
+        is over the multipart threshold of the connection
+        """
+        if self._use_multipart(local_file, rewind):
+            return MultipartUploadRequest(self, key, local_file, bucket,
+                                          self.multipart_part_size,
+                                          self.multipart_workers,
+                                          expires=expires,
+                                          content_type=content_type,
+                                          public=public,
+                                          extra_headers=headers,
+                                          rewind=rewind, close=close)
+        return UploadRequest(self, key, local_file, bucket, expires=expires,
+                             content_type=content_type, public=public,
+                             extra_headers=headers, rewind=rewind,
+                             close=close)
+
+    def upload_many(self, items, bucket=None, public=True,
+                    max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                    max_in_flight_bytes=DEFAULT_MAX_IN_FLIGHT_BYTES,
+                    ordered=False):
+        """
+        Upload many files, keeping both the number of uploads in flight and
+        their total size bounded
+
+        The items are consumed lazily. Uploads are sent as long as the total
+        size of the files in flight fits in max_in_flight_bytes, so a few huge
+        files don't hold the whole budget while many tiny ones wait (a file
+        larger than the budget is uploaded alone).
+
+        Params:
+            - items         An iterable of (key, local_file) or (key,
+              local_file, headers) tuples. local_file is either a file-like
+              object or a path, paths are only opened (and closed) while
+              their upload runs
+            - bucket        (Optional) The name of the bucket to use (can be
+              skipped if setting the default_bucket)
+            - public        (Optional) Should the keys be publicly accessible
+              (Defaults to True)
+            - max_in_flight (Optional) The maximum number of uploads in
+              flight (Defaults to 16)
+            - max_in_flight_bytes   (Optional) The maximum total size of the
+              files in flight (Defaults to 256MB)
+            - ordered       (Optional) Yield the results in the order of the
+              items (Defaults to False)
+
+        Returns:
+            - A generator of (key, response) tuples, the response is the
+              exception raised if the upload failed
+
+        Usage:
+
+        >>> files = (('logs/' + name, os.path.join(root, name))
+        >>>          for name in os.listdir(root))
+        >>> for key, r in conn.upload_many(files, 'sample_bucket'):
+        >>>     if isinstance(r, Exception):
+        >>>         failed.append(key)
+
+        """
+        bucket = self.bucket(bucket)
+
+        def batch():
+            for item in items:
+                key, local_file = item[0], item[1]
+                headers = item[2] if len(item) > 2 else None
+                self._invalidate(bucket, key)
+                upload = functools.partial(self._upload_request, key,
+                                           bucket=bucket, public=public,
+                                           headers=headers)
+                if hasattr(local_file, 'read'):
+                    r = upload(local_file)
+                else:
+                    # Paths are opened once their upload runs
+                    r = PathUploadRequest(self, local_file, upload)
+                # The callback recording the upload in the index travels
+                # with the key, as a key may be uploaded more than once
+                yield (key, self._index_upload(r, bucket, key)), r
+
+        for (key, on_success), result in self._run_many(
+                batch(), max_in_flight, ordered, weight=lambda r: r.size(),
+                max_weight=max_in_flight_bytes):
+            self._invalidate(bucket, key)
+            if on_success is not None and \
+                    not isinstance(result, Exception):
+                on_success(result)
+            yield key, result
+
+    def _use_multipart(self, local_file, rewind):
+        """
+        Should the file be uploaded as a multipart upload?
+        """
+        if self.multipart_threshold is None:
+            return False
+        # The upload will start from the beginning of the file
+        if rewind and hasattr(local_file, 'seek'):
+            local_file.seek(0, os.SEEK_SET)
+        return len(LenWrapperStream(local_file)) > self.multipart_threshold
 
     def copy(self, from_key, from_bucket, to_key, to_bucket=None,
              metadata=None, public=True):
@@ -202,7 +751,9 @@ class Base(object):
         to_bucket = self.bucket(to_bucket or from_bucket)
         r = CopyRequest(self, from_key, from_bucket, to_key, to_bucket,
                         metadata=metadata, public=public)
-        return self.run(r)
+        return self._run_write(r, to_bucket, to_key,
+                               self._index_copy(from_key, from_bucket,
+                                                to_bucket, to_key))
 
     def update_metadata(self, key, metadata=None, bucket=None, public=True):
         """
@@ -227,7 +778,7 @@ class Base(object):
         r = UpdateMetadataRequest(self, key, self.bucket(bucket), metadata,
                                   public)
 
-        return self.run(r)
+        return self._run_write(r, self.bucket(bucket), key)
 
     def delete(self, key, bucket=None):
         """
@@ -249,7 +800,107 @@ class Base(object):
 
         """
         r = DeleteRequest(self, key, self.bucket(bucket))
-        return self.run(r)
+        return self._run_write(r, self.bucket(bucket), key,
+                               self._index_delete(self.bucket(bucket), key))
+
+    def delete_many(self, keys, bucket=None,
+                    max_in_flight=DEFAULT_DELETE_IN_FLIGHT):
+        """
+        Delete many keys from a bucket, using Multi-Object Delete requests of
+        up to 1000 keys, sent concurrently
+
+        Params:
+            - keys          An iterable of keys to delete, consumed lazily
+            - bucket        (Optional) The name of the bucket to use (can be
+              skipped if setting the default_bucket)
+            - max_in_flight (Optional) The maximum number of delete requests
+              in flight (Defaults to 4)
+
+        Returns:
+            - A {'deleted': count, 'errors': [...]} dict, with a {'key',
+              'code', 'message'} dict for every key that couldn't be deleted
+
+        Usage:
+
+        >>> r = conn.delete_many(['a.jpg', 'b.jpg'], 'sample_bucket')
+        >>> r['deleted'], r['errors']
+
+        """
+        return self._delete_batches(self._batches(keys), self.bucket(bucket),
+                                    max_in_flight)
+
+    def delete_prefix(self, prefix, bucket=None,
+                      max_in_flight=DEFAULT_DELETE_IN_FLIGHT):
+        """
+        Delete all the keys starting with a prefix
+
+        The listing is streamed into Multi-Object Delete requests of 1000
+        keys, that are sent while the next page of the listing is loading.
+
+        Params:
+            - prefix        The prefix of the keys to delete, it can't be
+              empty
+            - bucket        (Optional) The name of the bucket to use (can be
+              skipped if setting the default_bucket)
+            - max_in_flight (Optional) The maximum number of delete requests
+              in flight (Defaults to 4)
+
+        Returns:
+            - A {'deleted': count, 'errors': [...]} dict, like delete_many
+
+        Usage:
+
+        >>> conn.delete_prefix('logs/2013/', 'sample_bucket')
+
+        """
+        if not prefix:
+            raise ValueError("delete_prefix requires a prefix, it would "
+                             "delete the whole bucket")
+        bucket = self.bucket(bucket)
+        keys = (f['key'] for f in ListRequest(self, prefix, bucket))
+        return self._delete_batches(self._batches(keys), bucket,
+                                    max_in_flight)
+
+    def _batches(self, keys):
+        """
+        Splits an iterable of keys to lists of up to 1000 keys
+        """
+        batch = []
+        for key in keys:
+            batch.append(key)
+            if len(batch) == DELETE_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _delete_batches(self, batches, bucket, max_in_flight):
+        """
+        Sends a Multi-Object Delete request for every batch of keys, and sums
+        up their results
+        """
+        def batch_requests():
+            for keys in batches:
+                for key in keys:
+                    self._invalidate(bucket, key)
+                yield keys, DeleteObjectsRequest(self, keys, bucket)
+
+        result = {'deleted': 0, 'errors': []}
+        for keys, r in self._run_many(batch_requests(), max_in_flight):
+            for key in keys:
+                self._invalidate(bucket, key)
+            if isinstance(r, Exception):
+                # The whole request failed
+                result['errors'].extend({'key': key, 'code': None,
+                                         'message': str(r)} for key in keys)
+                continue
+            result['deleted'] += r['deleted']
+            result['errors'].extend(r['errors'])
+            if self.index is not None:
+                failed = set(e['key'] for e in r['errors'])
+                self.index.delete_many(
+                    bucket, [key for key in keys if key not in failed])
+        return result
 
     def run(self, request):
         """
@@ -261,6 +912,84 @@ class Base(object):
         """
         return self._handle_request(request)
 
+    def _run_write(self, request, bucket, key, on_success=None):
+        """
+        Executes a request that modifies a key, and invalidates the cached
+        copies of the key, both before the request is sent and once it's
+        completed (so gets running concurrently don't cache the old body).
+        on_success is called with the response once the request succeeded.
+        """
+        self._invalidate(bucket, key)
+        result = self.run(request)
+        self._on_complete(result, lambda: self._invalidate(bucket, key))
+        if on_success is not None:
+            self._on_success(result, on_success)
+        return result
+
+    def _invalidate(self, bucket, key):
+        """
+        Removes a key from the caches of the connection
+        """
+        if self.memory_cache is not None:
+            self.memory_cache.delete(bucket, key)
+        if self.disk_cache is not None:
+            self.disk_cache.delete(bucket, key)
+
+    def _on_complete(self, result, callback):
+        """
+        Calls callback once the result of a request is available. The
+        requests of a connection are already completed when they return.
+        """
+        callback()
+
+    def _on_success(self, result, callback):
+        """
+        Calls callback with the response of a request that succeeded. The
+        requests of a connection raise when they fail.
+        """
+        callback(result)
+
+    def _index_upload(self, request, bucket, key):
+        """
+        Returns the callback recording an upload in the index of the
+        connection, or None
+        """
+        if self.index is None or not self.index.covers(bucket, key):
+            return None
+        # Measured before the file is consumed (and maybe closed)
+        size = request.size()
+
+        def on_success(response):
+            self.index.put(bucket, key, size, etag=_etag(response))
+        return on_success
+
+    def _index_copy(self, from_key, from_bucket, to_bucket, to_key):
+        """
+        Returns the callback recording a copy in the index of the connection,
+        or None. The size and ETag of the copy are the ones of its source,
+        when the source is indexed too.
+        """
+        if self.index is None or not self.index.covers(to_bucket, to_key):
+            return None
+        source = {}
+        if self.index.covers(from_bucket, from_key):
+            source = self.index.get(from_key) or {}
+
+        def on_success(response):
+            self.index.put(to_bucket, to_key, source.get('size'),
+                           etag=source.get('etag'),
+                           storage_class=source.get('storage_class'))
+        return on_success
+
+    def _index_delete(self, bucket, key):
+        """
+        Returns the callback removing a deleted key from the index of the
+        connection, or None
+        """
+        if self.index is None:
+            return None
+        return lambda response: self.index.delete(bucket, key)
+
     def head_bucket(self, bucket=None):
         r = HeadRequest(self, self.bucket(bucket))
         return self.run(r)
@@ -271,7 +1000,7 @@ class Base(object):
 
     def list_multipart_uploads(self, prefix='', bucket=None, encoding=None,
                                max_uploads=1000, key_marker='',
-                               upload_id_marker=''):
+                               upload_id_marker='', prefetch=0):
         """
         List a bucket's ongoing multipart uploads
 
@@ -298,6 +1027,9 @@ class Base(object):
                                 the multipart upload after which listing should
                                 begin. (default to the empty string)
 
+            - prefetch:         (Optional) The number of pages fetched ahead
+                                on a background thread (default to 0)
+
         Returns:
             - An iterator over the files, each file being represented by a dict
               object with the following keys:
@@ -315,7 +1047,7 @@ class Base(object):
         """
         r = ListMultipartUploadRequest(self, prefix, self.bucket(bucket),
                                        max_uploads, encoding, key_marker,
-                                       upload_id_marker)
+                                       upload_id_marker, prefetch=prefetch)
 
         return self.run(r)
 
@@ -324,15 +1056,51 @@ class Base(object):
         mps = [mp for mp in self.list_multipart_uploads(prefix, bucket)]
         return mps
 
-    def initiate_multipart_upload(self, key, bucket=None):
+    def initiate_multipart_upload(self, key, bucket=None, journal=None):
         """Returns a "boto-ish" MultipartUpload object that works kind of
-        the same way than the Boto one."""
+        the same way than the Boto one.
+
+        If a journal path is given, the progress of the upload is recorded
+        in it, so it can be resumed with resume_multipart_upload."""
         from .multipart_upload import MultipartUpload
 
-        mp = MultipartUpload(self, bucket, key)
+        mp = MultipartUpload(self, bucket, key, journal=journal)
         mp.initiate()
         return mp
 
+    def resume_multipart_upload(self, journal):
+        """
+        Reattaches to a multipart upload started with a journal, see
+        MultipartUpload.resume
+
+        Usage:
+
+        >>> mp = conn.resume_multipart_upload('/tmp/upload.journal')
+        >>> mp.upload_file('my_huge_file.zip')
+        >>> mp.complete_upload()
+        """
+        from .multipart_upload import MultipartUpload
+
+        return MultipartUpload.resume(self, journal)
+
+    def close(self):
+        """
+        Closes the keep-alive connections held by the connection
+        """
+        self.session.close()
+
+    def __enter__(self):
+        """
+        Context manager implementation
+        """
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """
+        Closes the connection
+        """
+        self.close()
+
     def _handle_request(self, request):
         """
         An abstract method, to be implemented by inheriting classes
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+tinys3.http_transport
+~~~~~~~~~~~~~~~~~~~~~
+
+A low overhead transport, that talks to S3 over keep-alive http.client
+connections instead of going through the requests lib
+
+"""
+
+import threading
+
+# Python 2/3 compatibility
+try:
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
+    from urllib import urlencode
+    from urlparse import urlsplit
+except ImportError:
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
+    from urllib.parse import urlencode, urlsplit
+
+from requests.exceptions import HTTPError
+from requests.structures import CaseInsensitiveDict
+from requests.utils import requote_uri
+
+from .auth import SignableRequest
+from .util import LenWrapperStream
+
+# The size of the blocks used when sending file bodies
+SEND_BLOCK_SIZE = 64 * 1024
+# The methods that can be sent again when their response was lost, without
+# the risk of being processed twice (unlike e.g. initiating or completing a
+# multipart upload)
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE'])
+
+
+class HTTPClientAdapter(object):
+    """
+    A requests-like adapter (get/put/post/delete/head), used as the session
+    of a connection created with transport='http.client'.
+
+    Requests are signed directly by S3Auth using a SignableRequest, and sent
+    over a pool of kept-alive http.client connections, skipping the
+    PreparedRequest, hooks and AuthBase machinery of requests.
+
+    Notes:
+        - Response bodies are returned as stored in S3, they are never
+          decompressed.
+        - Requests failing on a kept-alive connection are sent again once,
+          on a new connection. POST requests are only sent again if they
+          failed before being sent completely.
+    """
+
+    def __init__(self, pool_size=10, timeout=None):
+        """
+        Creates a new adapter
+
+        Params:
+            - pool_size     (Optional) The maximum number of idle connections
+              to keep per host (Defaults to 10)
+            - timeout       (Optional) The socket timeout, in seconds
+        """
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def request(self, method, url, auth=None, params=None, headers=None,
+                data=None, stream=False):
+        """
+        Issues a request
+
+        Params:
+            - method    The HTTP method of the request
+            - url       The url of the request
+            - auth      (Optional) The S3Auth object used to sign the request
+            - params    (Optional) A dict of query string params, params with
+                        a None value are skipped (like requests does)
+            - headers   (Optional) A dict of headers
+            - data      (Optional) The body, as a string, bytes or a file-like
+                        object
+            - stream    (Optional) If True, the body of the response is not
+                        read until it's accessed
+
+        Returns:
+            A HTTPClientResponse
+        """
+        if params:
+            query = urlencode([(k, v) for k, v in params.items()
+                               if v is not None])
+            if query:
+                url += ('&' if '?' in url else '?') + query
+        url = requote_uri(url)
+        headers = dict((k, str(v)) for k, v in (headers or {}).items())
+        body, length = self._prepare_body(data)
+        if length is not None:
+            headers['Content-Length'] = str(length)
+        if auth is not None:
+            auth(SignableRequest(method, url, headers))
+
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        pool_key = (parts.scheme, parts.netloc)
+
+        # Remember where file bodies start, so they can be replayed
+        start = None
+        if hasattr(data, 'read') and hasattr(data, 'tell'):
+            start = data.tell()
+        replayable = body is None or isinstance(body, bytes) or \
+            start is not None
+
+        conn, reused = self._get_connection(pool_key)
+        sent = False
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            sent = True
+            resp = conn.getresponse()
+        except (HTTPException, IOError, OSError):
+            conn.close()
+            # The server may have closed an idle kept-alive connection,
+            # retry once on a fresh connection if we can replay the body.
+            # Once sent, the request may have been processed, so only the
+            # idempotent ones are sent again.
+            if not reused or not replayable or \
+                    (sent and method not in IDEMPOTENT_METHODS):
+                raise
+            if start is not None:
+                data.seek(start)
+                body = self._iter_file(data)
+            conn, reused = self._new_connection(pool_key), False
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+
+        response = HTTPClientResponse(
+            resp, url, lambda: self._release(pool_key, conn, resp))
+        if method == 'HEAD' or not stream:
+            # Read the whole body, this also releases the connection
+            response.content
+        return response
+
+    def _prepare_body(self, data):
+        """
+        Returns the (body, length) to send for the given data
+        """
+        if data is None:
+            return None, None
+        if isinstance(data, bytes):
+            return data, len(data)
+        if not hasattr(data, 'read'):
+            data = data.encode('utf-8')
+            return data, len(data)
+        # A file like object, S3 doesn't support chunked transfer, so we
+        # always send its length
+        length = len(data) if isinstance(data, LenWrapperStream) \
+            else len(LenWrapperStream(data))
+        return self._iter_file(data), length
+
+    def _iter_file(self, fp):
+        """
+        Reads a file-like object in blocks, encoding text blocks
+        """
+        while True:
+            block = fp.read(SEND_BLOCK_SIZE)
+            if not block:
+                break
+            if not isinstance(block, bytes):
+                block = block.encode('utf-8')
+            yield block
+
+    def _new_connection(self, pool_key):
+        scheme, netloc = pool_key
+        cls = HTTPSConnection if scheme == 'https' else HTTPConnection
+        return cls(netloc, timeout=self.timeout)
+
+    def _get_connection(self, pool_key):
+        """
+        Returns a (connection, reused) tuple, reusing an idle connection to
+        the same host if there is one
+        """
+        with self._lock:
+            idle = self._idle.get(pool_key)
+            if idle:
+                return idle.pop(), True
+        return self._new_connection(pool_key), False
+
+    def _release(self, pool_key, conn, resp):
+        """
+        Returns a connection to the pool once its response was fully read
+        """
+        if resp.will_close:
+            conn.close()
+            return
+        with self._lock:
+            idle = self._idle.setdefault(pool_key, [])
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """
+        Closes all the idle connections
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+class HTTPClientResponse(object):
+    """
+    The response of a HTTPClientAdapter request, exposes the parts of the
+    requests.Response interface used with S3.
+    """
+
+    def __init__(self, resp, url, release):
+        self.raw = resp
+        self.url = url
+        self.status_code = resp.status
+        self.reason = resp.reason
+        self.headers = CaseInsensitiveDict(resp.getheaders())
+        self._release = release
+        self._content = None
+
+    @property
+    def content(self):
+        """
+        The body of the response, read on first access
+        """
+        if self._content is None:
+            try:
+                self._content = self.raw.read()
+            finally:
+                self.close()
+        return self._content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def iter_content(self, chunk_size=1):
+        """
+        Iterates over the body of the response
+        """
+        if self._content is not None:
+            for i in range(0, len(self._content), chunk_size):
+                yield self._content[i:i + chunk_size]
+            return
+        try:
+            while True:
+                chunk = self.raw.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Releases the connection, if the body was fully read it's kept alive
+        for other requests
+        """
+        release, self._release = self._release, None
+        if release is None:
+            return
+        if not self.raw.isclosed():
+            # The body wasn't fully read, the connection can't be reused
+            self.raw.will_close = True
+            self.raw.close()
+        release()
+
+    def raise_for_status(self):
+        """
+        Raises a requests HTTPError for error responses, like
+        requests.Response.raise_for_status
+        """
+        if 400 <= self.status_code < 600:
+            kind = 'Client' if self.status_code < 500 else 'Server'
+            raise HTTPError('{0} {1} Error: {2} for url: {3}'.format(
+                self.status_code, kind, self.reason, self.url),
+                response=self)
+
+    def __repr__(self):
+        return '<HTTPClientResponse [{0}]>'.format(self.status_code)
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+tinys3.index
+~~~~~~~~~~~~
+
+A local, persistent index of the keys of a bucket prefix
+
+"""
+
+import datetime
+import sqlite3
+import threading
+import time
+
+from .listing import EPOCH
+from .request_factory import ListBatchesRequest
+
+# Python 2/3 compatibility
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+# The number of rows fetched at a time when iterating over the index
+INDEX_PAGE_SIZE = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS keys (
+    key TEXT PRIMARY KEY,
+    size INTEGER,
+    last_modified INTEGER,
+    etag TEXT,
+    storage_class TEXT,
+    generation INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS state (
+    name TEXT PRIMARY KEY,
+    value
+);
+"""
+
+
+class BucketIndex(object):
+    """
+    A SQLite index of the keys of a bucket prefix, answering existence
+    checks, prefix queries and size aggregations without any request.
+
+    The index is populated by refresh, that lists the prefix page by page
+    and stores the marker of every page, so an interrupted refresh resumes
+    where it stopped. Keys not found by a complete refresh are removed.
+
+    Connections created with an index update it with the uploads, copies
+    and deletes they complete, between refreshes.
+
+    Usage:
+
+    >>> index = BucketIndex('/var/lib/tinys3/logs.db', 'my_bucket', 'logs/')
+    >>> conn = Connection(access_key, secret_key, index=index)
+    >>> index.refresh(conn)
+    >>> index.exists('logs/2014/01/01.gz')
+    >>> index.size('logs/2014/')
+    """
+
+    def __init__(self, path, bucket, prefix=''):
+        """
+        Opens (or creates) an index
+
+        Params:
+            - path      The path of the SQLite database
+            - bucket    The indexed bucket
+            - prefix    (Optional) Index only the keys starting with this
+                        prefix (Defaults to the whole bucket)
+        """
+        self.path = path
+        self.bucket = bucket
+        self.prefix = prefix
+        # Completed writes may update the index from the workers of a pool
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        with self._lock, self._db:
+            self._db.executescript(_SCHEMA)
+            indexed = (self._state('bucket'), self._state('prefix'))
+            if indexed == (None, None):
+                self._set_state(bucket=bucket, prefix=prefix, generation=0)
+            elif indexed != (bucket, prefix):
+                raise ValueError(
+                    "{0} indexes {1[1]!r} in the bucket {1[0]!r}".format(
+                        path, indexed))
+
+    def _state(self, name):
+        row = self._db.execute('SELECT value FROM state WHERE name = ?',
+                               (name,)).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, **values):
+        self._db.executemany(
+            'INSERT OR REPLACE INTO state (name, value) VALUES (?, ?)',
+            values.items())
+
+    @property
+    def marker(self):
+        """
+        The last key listed by an interrupted refresh, or None
+        """
+        with self._lock:
+            return self._state('marker')
+
+    @property
+    def refreshed(self):
+        """
+        The time the last complete refresh ended at, or None
+        """
+        with self._lock:
+            return self._state('refreshed')
+
+    def refresh(self, conn, max_pages=None):
+        """
+        Lists the prefix and updates the index, resuming the refresh in
+        progress if the last one was interrupted
+
+        Params:
+            - conn          The connection listing the prefix
+            - max_pages     (Optional) Stop after this number of pages, the
+                            next refresh continues from there (Defaults to
+                            None, list the whole prefix)
+
+        Returns:
+            True if the refresh is complete
+        """
+        with self._lock, self._db:
+            generation = self._state('generation')
+            marker = self._state('marker')
+            if marker is None:
+                # Keys of older generations are removed once the whole
+                # prefix is listed again
+                generation += 1
+                marker = ''
+                self._set_state(generation=generation, marker=marker)
+
+        r = ListBatchesRequest(conn, self.prefix, self.bucket, marker=marker)
+        for pages, batch in enumerate(r, 1):
+            rows = zip(batch.keys, batch.sizes, batch.timestamps,
+                       batch.etags, batch.storage_classes,
+                       [generation] * len(batch))
+            with self._lock, self._db:
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO keys VALUES (?, ?, ?, ?, ?, ?)',
+                    rows)
+                self._set_state(marker=batch.keys[-1])
+            if max_pages is not None and pages >= max_pages:
+                return False
+
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM keys WHERE generation < ?',
+                             (generation,))
+            self._set_state(marker=None, refreshed=time.time())
+        return True
+
+    def covers(self, bucket, key):
+        """
+        Is a key in the indexed prefix?
+        """
+        return bucket == self.bucket and key.startswith(self.prefix)
+
+    def put(self, bucket, key, size=None, etag=None, storage_class=None,
+            last_modified=None):
+        """
+        Records a key written to S3, keys outside of the index are ignored.
+        Keys of an unknown size count for nothing in size, until the next
+        refresh.
+
+        Params:
+            - bucket            The bucket of the key
+            - key               The key
+            - size              (Optional) The size of the key
+            - etag              (Optional) The ETag of the key
+            - storage_class     (Optional) The storage class of the key
+            - last_modified     (Optional) The modification time of the key
+                                in seconds since the epoch (Defaults to now)
+        """
+        if not self.covers(bucket, key):
+            return
+        if last_modified is None:
+            last_modified = int(time.time())
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO keys VALUES (?, ?, ?, ?, ?, ?)',
+                (key, size, last_modified, etag, storage_class,
+                 self._state('generation')))
+
+    def delete(self, bucket, key):
+        """
+        Removes a key deleted from S3
+        """
+        self.delete_many(bucket, [key])
+
+    def delete_many(self, bucket, keys):
+        """
+        Removes keys deleted from S3
+        """
+        keys = [(key,) for key in keys if self.covers(bucket, key)]
+        with self._lock, self._db:
+            self._db.executemany('DELETE FROM keys WHERE key = ?', keys)
+
+    def exists(self, key):
+        """
+        Is the key in the index?
+        """
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM keys WHERE key = ?',
+                                    (key,)).fetchone() is not None
+
+    def get(self, key):
+        """
+        Returns the dict of an indexed key (like the ones yielded by
+        Connection.list), or None
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT key, size, last_modified, etag, storage_class '
+                'FROM keys WHERE key = ?', (key,)).fetchone()
+        return self._file(row) if row else None
+
+    def list(self, prefix=''):
+        """
+        Iterates over the indexed keys starting with a prefix, ordered by
+        their keys, as dicts like the ones yielded by Connection.list
+        """
+        where, params = self._range(prefix)
+        last = None
+        while True:
+            page_where, page_params = where, params
+            if last is not None:
+                page_where += ' AND key > ?'
+                page_params = params + (last,)
+            with self._lock:
+                rows = self._db.execute(
+                    'SELECT key, size, last_modified, etag, storage_class '
+                    'FROM keys WHERE ' + page_where + ' ORDER BY key LIMIT ?',
+                    page_params + (INDEX_PAGE_SIZE,)).fetchall()
+            for row in rows:
+                yield self._file(row)
+            if len(rows) < INDEX_PAGE_SIZE:
+                return
+            last = rows[-1][0]
+
+    def count(self, prefix=''):
+        """
+        Returns the number of indexed keys starting with a prefix
+        """
+        where, params = self._range(prefix)
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM keys WHERE ' + where,
+                                    params).fetchone()[0]
+
+    def size(self, prefix=''):
+        """
+        Returns the total size of the indexed keys starting with a prefix
+        """
+        where, params = self._range(prefix)
+        with self._lock:
+            return self._db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM keys WHERE ' + where,
+                params).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _range(self, prefix):
+        """
+        Returns a (where, params) tuple matching the keys starting with the
+        prefix, as a range of the primary key
+        """
+        if not prefix:
+            return '1', ()
+        # Text is compared by its UTF-8 bytes, in the order of code points
+        end = prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+        return 'key >= ? AND key < ?', (prefix, end)
+
+    def _file(self, row):
+        key, size, last_modified, etag, storage_class = row
+        if last_modified is not None:
+            last_modified = EPOCH + datetime.timedelta(seconds=last_modified)
+        return {
+            'key': key,
+            'size': size,
+            'last_modified': last_modified,
+            'etag': etag,
+            'storage_class': storage_class,
+        }
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+tinys3.listing
+~~~~~~~~~~~~~~
+
+Compact, columnar pages of listed keys
+
+"""
+
+import datetime
+from array import array
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Storage classes are shared by all the batches, instead of keeping a copy of
+# the string for every key
+_storage_classes = {}
+
+
+def _days_from_civil(year, month, day):
+    """
+    Returns the number of days between 1970-01-01 and a date of the
+    proleptic Gregorian calendar
+    """
+    year -= month <= 2
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    day_of_era = (year_of_era * 365 + year_of_era // 4 - year_of_era // 100 +
+                  day_of_year)
+    return era * 146097 + day_of_era - 719468
+
+
+def parse_timestamp(value, days=None):
+    """
+    Parses a timestamp of the fixed format used by S3
+    (2013-10-31T15:38:32.000Z) to seconds since the epoch, the fractions of
+    seconds are dropped
+
+    Params:
+        - value     The timestamp
+        - days      (Optional) A dict caching the days of the dates already
+                    parsed, shared by the calls parsing a page
+
+    Returns:
+        The number of seconds since the epoch
+    """
+    date = value[:10]
+    if days is None or date not in days:
+        d = _days_from_civil(int(value[0:4]), int(value[5:7]),
+                             int(value[8:10]))
+        if days is None:
+            return d * 86400 + _seconds_of_day(value)
+        days[date] = d
+    return days[date] * 86400 + _seconds_of_day(value)
+
+
+def _seconds_of_day(value):
+    return (int(value[11:13]) * 3600 + int(value[14:16]) * 60 +
+            int(value[17:19]))
+
+
+def intern_storage_class(value):
+    return _storage_classes.setdefault(value, value)
+
+
+class ListingBatch(object):
+    """
+    A page of a listing, stored by columns:
+
+        - keys              A list of the keys
+        - sizes             An array('q') of the sizes
+        - timestamps        An array('q') of the last modification times, in
+                            seconds since the epoch
+        - etags             A list of the ETags
+        - storage_classes   A list of the (interned) storage classes
+        - prefixes          A list of the common prefixes, when listing with
+                            a delimiter
+
+    Indexing or iterating over a batch returns ListingRow views, that decode
+    the fields of a key only when they're accessed.
+
+    Usage:
+
+    >>> for batch in conn.list_batches('logs/', 'sample_bucket'):
+    >>>     total += sum(batch.sizes)
+    >>>     old = [r.key for r in batch if r.timestamp < cutoff]
+    """
+
+    __slots__ = ('keys', 'sizes', 'timestamps', 'etags', 'storage_classes',
+                 'prefixes')
+
+    def __init__(self):
+        self.keys = []
+        self.sizes = array('q')
+        self.timestamps = array('q')
+        self.etags = []
+        self.storage_classes = []
+        self.prefixes = []
+
+    def append(self, key, size, timestamp, etag, storage_class):
+        self.keys.append(key)
+        self.sizes.append(size)
+        self.timestamps.append(timestamp)
+        self.etags.append(etag)
+        self.storage_classes.append(storage_class)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.keys)
+        if not 0 <= index < len(self.keys):
+            raise IndexError('ListingBatch index out of range')
+        return ListingRow(self, index)
+
+    def __iter__(self):
+        for i in range(len(self.keys)):
+            yield ListingRow(self, i)
+
+    def to_dicts(self):
+        """
+        Returns the keys as dicts, like the ones yielded by Connection.list
+        """
+        return [row.to_dict() for row in self]
+
+    def to_numpy(self):
+        """
+        Returns a dict of NumPy arrays, one for every column (key, size,
+        last_modified, etag, storage_class). The sizes are not copied.
+
+        Requires NumPy.
+        """
+        import numpy
+
+        sizes = numpy.frombuffer(self.sizes, dtype=numpy.int64)
+        timestamps = numpy.frombuffer(self.timestamps, dtype=numpy.int64)
+        return {
+            'key': numpy.array(self.keys, dtype=object),
+            'size': sizes,
+            'last_modified': timestamps.astype('datetime64[s]'),
+            'etag': numpy.array(self.etags, dtype=object),
+            'storage_class': numpy.array(self.storage_classes, dtype=object),
+        }
+
+    def to_arrow(self):
+        """
+        Returns the batch as a pyarrow Table, the storage classes are
+        dictionary encoded. The sizes and timestamps are not copied.
+
+        Requires pyarrow.
+        """
+        import pyarrow
+
+        count = len(self.keys)
+        sizes = pyarrow.Array.from_buffers(
+            pyarrow.int64(), count, [None, pyarrow.py_buffer(self.sizes)])
+        timestamps = pyarrow.Array.from_buffers(
+            pyarrow.timestamp('s', tz='UTC'), count,
+            [None, pyarrow.py_buffer(self.timestamps)])
+        return pyarrow.table({
+            'key': pyarrow.array(self.keys, pyarrow.string()),
+            'size': sizes,
+            'last_modified': timestamps,
+            'etag': pyarrow.array(self.etags, pyarrow.string()),
+            'storage_class': pyarrow.array(
+                self.storage_classes, pyarrow.string()).dictionary_encode(),
+        })
+
+    def __repr__(self):
+        return '<ListingBatch of {0} keys>'.format(len(self.keys))
+
+
+class ListingRow(object):
+    """
+    A view of a key of a ListingBatch. The fields are read from the batch
+    when they're accessed, and can also be read like the keys of a dict
+    (row['size']).
+    """
+
+    __slots__ = ('_batch', '_index')
+
+    _fields = ('key', 'size', 'last_modified', 'etag', 'storage_class')
+
+    def __init__(self, batch, index):
+        self._batch = batch
+        self._index = index
+
+    @property
+    def key(self):
+        return self._batch.keys[self._index]
+
+    @property
+    def size(self):
+        return self._batch.sizes[self._index]
+
+    @property
+    def timestamp(self):
+        return self._batch.timestamps[self._index]
+
+    @property
+    def last_modified(self):
+        return EPOCH + datetime.timedelta(seconds=self.timestamp)
+
+    @property
+    def etag(self):
+        return self._batch.etags[self._index]
+
+    @property
+    def storage_class(self):
+        return self._batch.storage_classes[self._index]
+
+    def __getitem__(self, name):
+        if name not in self._fields:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self._fields)
+
+    def __repr__(self):
+        return '<ListingRow {0!r}>'.format(self.key)
@@ -1,5 +1,47 @@
+import json
+import os
+import socket
+import threading
+import time
+from io import BytesIO
+
+import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+try:
+    from http.client import HTTPException
+except ImportError:
+    from httplib import HTTPException
+
 from .request_factory import (UploadPartRequest,
                               InitiateMultipartUploadRequest)
+from .util import FileSliceStream
+
+# The default size of the parts of multipart uploads
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+# S3's minimum size of the parts of multipart uploads (but the last one)
+MIN_PART_SIZE = 5 * 1024 * 1024
+# The default number of parts uploaded concurrently
+DEFAULT_PART_WORKERS = 4
+# S3 limits a multipart upload to 10000 parts
+MAX_PARTS = 10000
+# The default number of times a failed part is retried by upload_file
+DEFAULT_PART_RETRIES = 3
+# The delay before the first retry of a part, doubled on every retry
+PART_RETRY_DELAY = 0.5
+
+
+def _is_transient(e):
+    """
+    Is an exception a transient failure, worth retrying the request? Server
+    errors (5xx, including S3's 503 SlowDown) and network errors are, client
+    errors (4xx) aren't.
+    """
+    if isinstance(e, requests.exceptions.HTTPError):
+        return e.response is not None and e.response.status_code >= 500
+    return isinstance(e, (requests.exceptions.ConnectionError,
+                          requests.exceptions.Timeout, HTTPException,
+                          socket.error))
 
 
 class MultipartUpload:
@@ -8,9 +50,16 @@ class MultipartUpload:
     - the upload ID (self.uploadId)
     - the bucket (self.bucket)
     - the key (self.key)
-    Inspired by the boto implementation."""
+    - the ETags of the parts uploaded through it (self.parts, a dict of
+      part number -> ETag)
+    - the path of its journal (self.journal), if it's resumable
+    Inspired by the boto implementation.
 
-    def __init__(self, conn, bucket, key):
+    When created with a journal path, the upload ID, the part size and every
+    uploaded part are appended to the journal, so the upload can be resumed
+    with MultipartUpload.resume after the process died."""
+
+    def __init__(self, conn, bucket, key, journal=None):
         self.conn = conn
         self.bucket = self.conn.bucket(bucket)
         if type(key) is not str:
@@ -18,6 +67,46 @@ class MultipartUpload:
         else:
             self.key = key
         self.uploadId = ''
+        self.parts = {}
+        self.part_size = None
+        self.journal = journal
+        self._journal_lock = threading.Lock()
+
+    @classmethod
+    def resume(cls, conn, journal):
+        """
+        Reattaches to the multipart upload recorded in a journal.
+
+        The parts recorded in the journal are checked against the parts
+        listed by S3, only the parts with a matching ETag are kept, the
+        others will be uploaded again by upload_file.
+
+        Params:
+        - conn:     The connection to use
+        - journal:  The path of the journal
+
+        Returns : A MultipartUpload, ready for upload_file
+        """
+        state = {}
+        parts = {}
+        with open(journal) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if 'part_number' in entry:
+                    parts[entry['part_number']] = entry['etag']
+                else:
+                    state.update(entry)
+
+        mp = cls(conn, state['bucket'], state['key'], journal=journal)
+        mp.uploadId = state['upload_id']
+        mp.part_size = state.get('part_size')
+        for part in mp._listed_parts():
+            n = part['part_number']
+            if parts.get(n) == part['etag']:
+                mp.parts[n] = part['etag']
+        return mp
 
     def initiate(self):
         """A kind of advanced method to send the initiate
@@ -25,8 +114,39 @@ class MultipartUpload:
         since S3Conn.initiate_multipart_upload does it for you."""
         req = InitiateMultipartUploadRequest(self.conn, self.key, self.bucket)
         self.uploadId = self.conn.run(req)
+        if hasattr(self.uploadId, 'result'):
+            # A future, when used with a pool. The upload ID is required by
+            # any other request of the upload.
+            self.uploadId = self.uploadId.result()
+        self._write_journal({'bucket': self.bucket, 'key': self.key,
+                             'upload_id': self.uploadId})
         return self.uploadId
 
+    def _write_journal(self, entry):
+        """
+        Appends an entry to the journal, if there's one
+        """
+        if self.journal is None:
+            return
+        with self._journal_lock:
+            with open(self.journal, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _remove_journal(self):
+        """
+        Removes the journal of a completed/cancelled upload
+        """
+        if self.journal is not None and os.path.exists(self.journal):
+            os.remove(self.journal)
+
+    def _upload_done(self, response):
+        """
+        Removes the journal once the upload was completed or cancelled
+        """
+        self._remove_journal()
+
     def upload_part_from_file(self, fp, part_num, length=None, md5=None,
                               close=False, rewind=True):
         """
@@ -53,23 +173,159 @@ class MultipartUpload:
                                 part_num, self.uploadId, close, rewind,
                                 extra_headers)
         rep = self.conn.run(req)
+
+        def record_part(response):
+            self._record_part(part_num, response)
+
+        # Once the future succeeded, when used with a pool
+        self.conn._on_success(rep, record_part)
         return rep
 
+    def _record_part(self, part_num, response):
+        """
+        Records the ETag of an uploaded part, to complete the upload without
+        listing its parts
+        """
+        etag = response.headers['ETag']
+        self.parts[part_num] = etag
+        self._write_journal({'part_number': part_num, 'etag': etag})
+
+    def upload_file(self, local_file, part_size=None,
+                    workers=DEFAULT_PART_WORKERS,
+                    retries=DEFAULT_PART_RETRIES):
+        """
+        Uploads a whole file, splitting it to parts that are uploaded
+        concurrently. Parts that were already uploaded (e.g. by a resumed
+        upload) are skipped.
+
+        Each worker reads its part just before uploading it, so at most
+        `workers` parts are held in memory, no matter how large the file is.
+        Parts of real files are streamed from the file with FileSliceStream,
+        without being copied to memory at all.
+        The upload is not completed, call complete_upload once done.
+
+        Params:
+        - local_file:   A path, or a seekable file object. File objects are
+                        uploaded from their current position.
+        - part_size:    (Optional) The size in bytes of the parts, at least
+                        5MB. It's increased if needed to fit S3's 10000
+                        parts limit.
+                        (Defaults to the part size of a resumed upload, or
+                        to 8MB)
+        - workers:      (Optional) The number of parts uploaded concurrently
+                        (Defaults to 4)
+        - retries:      (Optional) The number of times a part failing with a
+                        server or network error is retried, with an
+                        exponential backoff, before the upload fails
+                        (Defaults to 3)
+
+        Returns : A list of {'part_number', 'etag'} dicts, ordered by part
+                  number
+        """
+        if part_size is not None and part_size < MIN_PART_SIZE:
+            # S3 would only reject the parts when the upload is completed
+            raise ValueError("part_size must be at least {0} bytes "
+                             "(5MB)".format(MIN_PART_SIZE))
+        close = not hasattr(local_file, 'read')
+        fp = open(local_file, 'rb') if close else local_file
+        try:
+            start = fp.tell()
+            fp.seek(0, os.SEEK_END)
+            size = fp.tell() - start
+            if self.part_size is not None:
+                # Resumed uploads must keep the boundaries of their parts
+                if part_size not in (None, self.part_size):
+                    raise ValueError("The upload was started with parts of "
+                                     "{0} bytes".format(self.part_size))
+                part_size = self.part_size
+            else:
+                part_size = max(part_size or DEFAULT_PART_SIZE,
+                                -(-size // MAX_PARTS))
+                self.part_size = part_size
+                self._write_journal({'part_size': part_size})
+            # An empty file is uploaded as a single empty part
+            offsets = range(start, start + size, part_size) or [start]
+            # Real files are read directly by the parts, using positional
+            # reads. Other file objects are shared by the workers, so their
+            # reads are serialized.
+            try:
+                fileno = fp.fileno()
+            except (AttributeError, IOError, OSError, ValueError):
+                fileno = None
+            lock = threading.Lock()
+
+            def upload_part(part_num, offset, length):
+                if fileno is None:
+                    with lock:
+                        fp.seek(offset)
+                        content = fp.read(length)
+                    if not isinstance(content, bytes):
+                        content = content.encode('utf-8')
+                for attempt in range(retries + 1):
+                    # Every attempt reads the part from its start
+                    if fileno is not None:
+                        data = FileSliceStream(fileno, offset, length)
+                    else:
+                        data = BytesIO(content)
+                    req = UploadPartRequest(self.conn, self.key, self.bucket,
+                                            data, part_num, self.uploadId,
+                                            False, True)
+                    try:
+                        r = req.run()
+                        break
+                    except Exception as e:
+                        if attempt == retries or not _is_transient(e):
+                            raise
+                    time.sleep(PART_RETRY_DELAY * 2 ** attempt)
+                self._record_part(part_num, r)
+                return r
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {}
+                for i, offset in enumerate(offsets):
+                    if i + 1 in self.parts:
+                        continue
+                    length = min(part_size, start + size - offset)
+                    future = executor.submit(upload_part, i + 1, offset,
+                                             length)
+                    futures[future] = i + 1
+                done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+                for future in pending:
+                    future.cancel()
+                for future in done:
+                    # Raises the exception of a failed part
+                    future.result()
+        finally:
+            if close:
+                fp.close()
+        return [{'part_number': n, 'etag': self.parts[n]}
+                for n in sorted(self.parts)]
+
     def complete_upload(self):
         """Method to finish a multipart upload after having uploaded parts.
         This needs to send a POST with each recorded ETag for each part sent by
         the server as response when they were uploaded.
+        The ETags recorded when the parts were uploaded through this object
+        are used. The parts are listed only if none was recorded (e.g. for
+        uploads obtained with list_multipart_uploads).
         See http://docs.aws.amazon.com/AmazonS3/latest/API/
         mpUploadComplete.html"""
         from .request_factory import CompleteUploadRequest
+        if self.parts:
+            parts = [{'part_number': n, 'etag': self.parts[n]}
+                     for n in sorted(self.parts)]
+        else:
+            parts = list(self._listed_parts())
         req = CompleteUploadRequest(
             self.conn,
             self.key,
             self.bucket,
             self.uploadId,
-            list(self.list_parts())  # Convert the generator to list
+            parts
         )
         resp = self.conn.run(req)
+        # On a pool, the journal is kept until the request succeeded
+        self.conn._on_success(resp, self._upload_done)
         return resp
 
     def cancel_upload(self):
@@ -81,9 +337,12 @@ class MultipartUpload:
             self.bucket,
             self.uploadId
         )
-        return self.conn.run(req)
+        resp = self.conn.run(req)
+        self.conn._on_success(resp, self._upload_done)
+        return resp
 
-    def list_parts(self, encoding=None, max_parts=1000, part_number_marker=''):
+    def list_parts(self, encoding=None, max_parts=1000, part_number_marker='',
+                   prefetch=0):
         """Generator to obtain all uploaded parts of this multipart upload.
         The following extra params can be used:
         - encoding: use 'url' to encode the response.
@@ -91,12 +350,25 @@ class MultipartUpload:
                      body. Default: 1,000 (Integer)
         - part_number_marker: Specifies the part after which listing should
                               begin. Only parts with higher part numbers will
-                              be listed. (String)"""
+                              be listed. (String)
+        - prefetch: The number of pages fetched ahead on a background thread
+                    (Default: 0)"""
         from .request_factory import ListPartsRequest
         r = ListPartsRequest(self.conn, self.key, self.bucket, self.uploadId,
-                             max_parts, encoding, part_number_marker)
+                             max_parts, encoding, part_number_marker,
+                             prefetch=prefetch)
         return self.conn.run(r)
 
+    def _listed_parts(self):
+        """
+        Returns an iterator over the parts listed by S3, waiting for the
+        listing when used with a pool
+        """
+        parts = self.list_parts()
+        if hasattr(parts, 'result'):
+            parts = parts.result()
+        return parts
+
     def number_of_parts(self):
         """Get the number of already uploaded parts.
         Useful when one is interested only in that number, but not the parts
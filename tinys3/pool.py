@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*
+import threading
+
 from .connection import Base
 
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -7,7 +9,8 @@ from concurrent.futures import wait
 
 class Pool(Base):
     def __init__(self, access_key, secret_key, default_bucket=None, tls=False,
-                 endpoint="s3.amazonaws.com", size=5):
+                 endpoint="s3.amazonaws.com", size=5, pool_size=None,
+                 transport='requests', coalesce=True, **kwargs):
         """
         Create a new pool.
 
@@ -22,6 +25,16 @@ class Pool(Base):
             - endpoint          (Optional) Sets the s3 endpoint.
             - size              (Optional) The maximum number of worker threads
               to use (Defaults to 5)
+            - pool_size         (Optional) The maximum number of keep-alive
+              connections kept open per host (Defaults to the number of
+              worker threads)
+            - transport         (Optional) The HTTP transport to use, either
+              'requests' or 'http.client' (Defaults to 'requests')
+            - coalesce          (Optional) Share a single request between
+              identical gets and heads submitted while it's in flight
+              (Defaults to True)
+            - Any other param (multipart_threshold, etc.) is passed to the
+              Base connection
 
         Notes:
             - The pool uses the concurrent.futures library to implement the
@@ -33,11 +46,18 @@ class Pool(Base):
         # Call to the base constructor
         super(Pool, self).__init__(access_key, secret_key, tls=tls,
                                    default_bucket=default_bucket,
-                                   endpoint=endpoint)
+                                   endpoint=endpoint,
+                                   pool_size=pool_size or size,
+                                   transport=transport, **kwargs)
 
         # Setup the executor
         self.executor = ThreadPoolExecutor(max_workers=size)
 
+        # The futures of the coalescable requests in flight, by their key
+        self.coalesce = coalesce
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+
     def _handle_request(self, request):
         """
         Handle S3 request and return the result.
@@ -48,10 +68,65 @@ class Pool(Base):
         Notes
             - This implementation will execute the request in a different
               thread and return a Future object.
+            - Identical gets and heads submitted while a request is in flight
+              get the future of the in flight request (single flight), so
+              they share its response object. Writing the key through the
+              pool stops the sharing.
         """
-        future = self.executor.submit(request.run)
+        key = request.coalesce_key() if self.coalesce else None
+        if key is None:
+            return self.executor.submit(request.run)
+
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future
+            future = self.executor.submit(request.run)
+            self._in_flight[key] = future
+        future.add_done_callback(lambda f: self._request_done(key, f))
         return future
 
+    def _submit(self, request, executor):
+        """
+        Runs the requests of batches in the workers of the pool
+        """
+        return self._handle_request(request)
+
+    def _request_done(self, key, future):
+        """
+        Stops sharing the future of a completed request
+        """
+        with self._in_flight_lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def _invalidate(self, bucket, key):
+        """
+        Removes a key from the caches of the pool, and stops sharing the
+        gets and heads of the key in flight, so the requests submitted after
+        a write don't get the result of a request sent before it
+        """
+        super(Pool, self)._invalidate(bucket, key)
+        with self._in_flight_lock:
+            for k in [k for k in self._in_flight if k[1:3] == (bucket, key)]:
+                del self._in_flight[k]
+
+    def _on_complete(self, result, callback):
+        """
+        Calls callback once the future of a request is done
+        """
+        result.add_done_callback(lambda future: callback())
+
+    def _on_success(self, result, callback):
+        """
+        Calls callback with the response of a request, once its future
+        succeeded
+        """
+        def done(future):
+            if future.exception() is None:
+                callback(future.result())
+        result.add_done_callback(done)
+
     def close(self, wait=True):
         """
         Close the pool.
@@ -61,6 +136,10 @@ class Pool(Base):
               work is completed? (Defaults to True)
         """
         self.executor.shutdown(wait)
+        # Only drop the keep-alive connections once the workers are done
+        # using them
+        if wait:
+            super(Pool, self).close()
 
     def as_completed(self, futures, timeout=None):
         """
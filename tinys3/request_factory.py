@@ -9,17 +9,38 @@ Generates Request objects for various S3 requests
 
 """
 
+import base64
+import collections
 import datetime
+import hashlib
 import mimetypes
 import os
+import re
 import requests
+import threading
+
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from xml.sax.saxutils import escape
 # Python 2/3 compatibility
 try:
     from urllib import quote
 except ImportError:
     from urllib.parse import quote
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+# tinys3 will try to use lxml if it's available
+try:
+    import lxml.etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 
-from .util import LenWrapperStream, stringify
+from .cache import cached_response
+from .listing import ListingBatch, parse_timestamp, intern_storage_class
+from .util import (LenWrapperStream, stringify, pwrite, queue_put,
+                   iter_prefetched)
 
 # A fix for windows pc issues with mimetypes
 # http://grokbase.com/t/python/python-list/129tb1ygws/
@@ -28,12 +49,113 @@ mimetypes.init([])
 
 XML_PARSE_STRING = "{{http://s3.amazonaws.com/doc/2006-03-01/}}{0}"
 
+# The size of the chunks used when streaming the body of a key
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# The size of the ranges fetched concurrently by ranged downloads
+DEFAULT_RANGE_SIZE = 8 * 1024 * 1024
+# Ranges closer than this are fetched together by multi-range reads
+DEFAULT_RANGE_GAP = 32 * 1024
+# The number of spans fetched concurrently by multi-range reads
+DEFAULT_RANGE_WORKERS = 8
+# The maximum number of keys of a Multi-Object Delete request
+DELETE_BATCH_SIZE = 1000
+# The default number of shards listed concurrently by parallel listings
+DEFAULT_LIST_WORKERS = 8
+# The default number of pages buffered per shard by parallel listings
+DEFAULT_LIST_QUEUE_SIZE = 4
+# The maximum number of files and shards discovered ahead of the consumer by
+# ordered parallel listings
+DEFAULT_LIST_READ_AHEAD = 1000
+# The split points of the prefixes parallel listings can't split at their
+# common prefixes (appended to the prefix)
+SPLIT_CHARS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-(\d+)/')
+
+
+def iter_elements(source, *tags):
+    """
+    Parses an XML document incrementally, yielding every element with one of
+    the given tags once it's complete. The yielded elements are dropped once
+    the consumer moves on, so the whole tree is never held in memory.
+
+    Params:
+        - source    The document, as bytes or a file-like object (e.g. the
+                    raw stream of a response)
+        - tags      The (namespaced) tags of the elements to yield
+    """
+    if not hasattr(source, 'read'):
+        source = BytesIO(source)
+    for event, elem in ET.iterparse(source, events=('end',)):
+        if elem.tag not in tags:
+            continue
+        yield elem
+        elem.clear()
+        # lxml also keeps the (cleared) previous siblings
+        if hasattr(elem, 'getprevious'):
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+
+def check_range(r, start, end, clamped=False):
+    """
+    Makes sure a response is the partial content of the range requested, and
+    not e.g. the whole body sent by a server ignoring the Range header
+
+    Params:
+        - r         The response
+        - start     The first byte of the requested range
+        - end       The last byte of the requested range (inclusive)
+        - clamped   (Optional) Accept a range ending before end, at the end
+                    of the key
+
+    Raises:
+        HTTPError if the response doesn't match the range
+    """
+    match = CONTENT_RANGE_RE.match(r.headers.get('Content-Range', ''))
+    if r.status_code == 206 and match:
+        r_start, r_end = int(match.group(1)), int(match.group(2))
+        if r_start == start and (r_end == end or clamped and r_end < end):
+            return
+    raise requests.exceptions.HTTPError(
+        "Expected the range bytes={0}-{1}, got a {2} response (Content-Range: "
+        "{3})".format(start, end, r.status_code,
+                      r.headers.get('Content-Range')), response=r)
+
+
+def iter_raw(r, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Iterates over the body of a streamed response as it's stored, without
+    decoding its Content-Encoding: a range of a compressed key can't be
+    decoded on its own
+
+    Params:
+        - r             The streamed response
+        - chunk_size    (Optional) The size of the chunks
+    """
+    raw = r.raw
+    if hasattr(raw, 'stream'):
+        # urllib3 responses
+        return raw.stream(chunk_size, decode_content=False)
+    return iter(lambda: raw.read(chunk_size), b'')
+
+
+def _without_range(headers, request):
+    """
+    Rejects the Range header of requests splitting a key to their own ranges
+    """
+    if any(name.lower() == 'range' for name in headers or {}):
+        raise ValueError("The Range header can't be used with {0}, it "
+                         "fetches its own ranges".format(request))
+    return headers
+
 
 class S3Request(object):
     def __init__(self, conn, params=None):
         self.auth = conn.auth
         self.tls = conn.tls
         self.endpoint = conn.endpoint
+        self.session = getattr(conn, 'session', None)
         self.params = params
 
     def bucket_url(self, key, bucket):
@@ -65,60 +187,506 @@ class S3Request(object):
     def run(self):
         raise NotImplementedError()
 
+    def coalesce_key(self):
+        """
+        Returns a key identifying the result of the request, if identical
+        requests in flight at the same time can share a single result, or
+        None if the request must always be sent (the default)
+        """
+        return None
+
     def adapter(self):
         """
         Returns the adapter to use when issuing a request.
         useful for testing
+
+        Requests are issued through the keep-alive session of the connection
+        when it has one, and through the requests module otherwise.
         """
-        return requests
+        return self.session or requests
+
+    def _stream(self, resp):
+        """
+        Returns a file-like object reading the body of a streamed response
+        """
+        raw = resp.raw
+        # Let urllib3 decode compressed bodies
+        if hasattr(raw, 'decode_content'):
+            raw.decode_content = True
+        return raw
 
 
 class GetRequest(S3Request):
-    def __init__(self, conn, key, bucket, headers=None):
+    def __init__(self, conn, key, bucket, headers=None, stream=False):
         super(GetRequest, self).__init__(conn)
         self.key = key
         self.bucket = bucket
         self.headers = headers
+        self.stream = stream
+
+    def coalesce_key(self):
+        # Streamed bodies can only be consumed once
+        if self.stream:
+            return None
+        return ('GET', self.bucket, self.key,
+                tuple(sorted((self.headers or {}).items())))
+
+    def run(self):
+        url = self.bucket_url(self.key, self.bucket)
+        if self.stream:
+            # Don't read the body until it's consumed
+            r = self.adapter().get(url, auth=self.auth, headers=self.headers,
+                                   stream=True)
+        else:
+            r = self.adapter().get(url, auth=self.auth, headers=self.headers)
+        try:
+            r.raise_for_status()
+        except Exception:
+            if self.stream:
+                r.close()
+            raise
+        return r
+
+
+class CachedGetRequest(GetRequest):
+    """
+    Gets a key through the caches of the connection. Keys are served from
+    the MemoryCache if it holds them, otherwise keys cached in the DiskCache
+    are revalidated with a conditional GET, and served from the disk on 304
+    Not Modified
+    """
+
+    def __init__(self, conn, key, bucket, disk_cache=None,
+                 memory_cache=None):
+        super(CachedGetRequest, self).__init__(conn, key, bucket)
+        self.disk_cache = disk_cache
+        self.memory_cache = memory_cache
 
     def run(self):
         url = self.bucket_url(self.key, self.bucket)
+        if self.memory_cache is not None:
+            cached = self.memory_cache.get(self.bucket, self.key)
+            if cached is not None:
+                return cached_response(url, cached[1], cached[0])
+
+        cached = None
+        if self.disk_cache is not None:
+            cached = self.disk_cache.get(self.bucket, self.key)
+        if cached is not None:
+            headers, body, fresh = cached
+            if fresh:
+                return self._cached(url, headers, body)
+            self.headers = {'If-None-Match': headers['ETag']}
+
         r = self.adapter().get(url, auth=self.auth, headers=self.headers)
+        if r.status_code == 304 and cached is not None:
+            self.disk_cache.touch(self.bucket, self.key)
+            return self._cached(url, headers, body)
         r.raise_for_status()
+
+        etag = r.headers.get('ETag')
+        if etag:
+            headers = {'ETag': etag}
+            for name in ('Last-Modified', 'Content-Type'):
+                if name in r.headers:
+                    headers[name] = r.headers[name]
+            if self.disk_cache is not None:
+                self.disk_cache.set(self.bucket, self.key, headers,
+                                    r.content)
+            if self.memory_cache is not None:
+                self.memory_cache.set(self.bucket, self.key, headers,
+                                      r.content)
         return r
 
+    def _cached(self, url, headers, body):
+        if self.memory_cache is not None:
+            self.memory_cache.set(self.bucket, self.key, headers, body)
+        return cached_response(url, body, headers)
 
-class ListRequest(S3Request):
-    def __init__(self, conn, prefix, bucket):
-        super(ListRequest, self).__init__(conn)
-        if prefix and type(prefix) is not str:
-            prefix = prefix.encode('utf-8')
-        self.prefix = prefix
+
+class ChunksRequest(GetRequest):
+    """
+    Streams the body of a key, in fixed size chunks
+    """
+
+    def __init__(self, conn, key, bucket, headers=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        super(ChunksRequest, self).__init__(conn, key, bucket,
+                                            headers=headers, stream=True)
+        self.chunk_size = chunk_size
+
+    def run(self):
+        # Send the request right away, so errors are raised by run
+        r = super(ChunksRequest, self).run()
+        return self._iter_chunks(r)
+
+    def _iter_chunks(self, r):
+        try:
+            for chunk in r.iter_content(self.chunk_size):
+                yield chunk
+        finally:
+            r.close()
+
+
+class DownloadRequest(GetRequest):
+    """
+    Streams the body of a key to a file or a sink, in fixed size chunks, so
+    the memory used is flat no matter how large the key is
+    """
+
+    def __init__(self, conn, key, bucket, dest, headers=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        super(DownloadRequest, self).__init__(conn, key, bucket,
+                                              headers=headers, stream=True)
+        self.dest = dest
+        self.chunk_size = chunk_size
+
+    def run(self):
+        r = super(DownloadRequest, self).run()
+        try:
+            if callable(self.dest):
+                self._write_chunks(r, self.dest)
+            elif hasattr(self.dest, 'write'):
+                self._write_chunks(r, self.dest.write)
+            else:
+                self._download_to_path(r)
+        finally:
+            r.close()
+        return r
+
+    def _write_chunks(self, r, write):
+        for chunk in r.iter_content(self.chunk_size):
+            write(chunk)
+
+    def _download_to_path(self, r):
+        try:
+            with open(self.dest, 'wb') as f:
+                self._write_chunks(r, f.write)
+        except Exception:
+            # Don't leave a partial file behind
+            if os.path.exists(self.dest):
+                os.remove(self.dest)
+            raise
+
+
+class RangedDownloadRequest(S3Request):
+    """
+    Downloads a key to a file using several concurrent ranged GETs.
+
+    The size of the key is fetched with a HEAD request, the file is
+    preallocated, and every range is written at its offset in the file with
+    positional writes.
+    """
+
+    def __init__(self, conn, key, bucket, dest, workers,
+                 range_size=DEFAULT_RANGE_SIZE, headers=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        super(RangedDownloadRequest, self).__init__(conn)
+        self.conn = conn
+        self.key = key
         self.bucket = bucket
+        self.dest = dest
+        self.workers = workers
+        self.range_size = range_size
+        self.headers = _without_range(headers, 'ranged downloads')
+        self.chunk_size = chunk_size
+
+    def run(self):
+        head = HeadRequest(self.conn, self.bucket, self.key,
+                           headers=self.headers).run()
+        size = int(head.headers['Content-Length'])
+        # Make sure all the ranges come from the same version of the key
+        etag = head.headers.get('ETag')
+
+        fd = os.open(self.dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC |
+                     getattr(os, 'O_BINARY', 0), 0o666)
+        try:
+            if size:
+                os.ftruncate(fd, size)
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = [executor.submit(self._download_range, fd, start,
+                                           min(start + self.range_size,
+                                               size) - 1, etag)
+                           for start in range(0, size, self.range_size)]
+                done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+                for future in pending:
+                    future.cancel()
+                for future in done:
+                    # Raises the exception of a failed range
+                    future.result()
+        except Exception:
+            os.close(fd)
+            os.remove(self.dest)
+            raise
+        os.close(fd)
+        return head
+
+    def _download_range(self, fd, start, end, etag):
+        headers = dict(self.headers or {})
+        headers['Range'] = 'bytes={0}-{1}'.format(start, end)
+        if etag:
+            headers['If-Match'] = etag
+        r = GetRequest(self.conn, self.key, self.bucket, headers=headers,
+                       stream=True).run()
+        try:
+            # A whole body would overwrite the other ranges
+            check_range(r, start, end)
+            offset = start
+            for chunk in iter_raw(r, self.chunk_size):
+                pwrite(fd, chunk, offset)
+                offset += len(chunk)
+        finally:
+            r.close()
+
+
+class MultiRangeRequest(S3Request):
+    """
+    Reads many byte ranges of a key.
+
+    Ranges that overlap, or that are separated by less than `gap` bytes, are
+    merged to a single span. The spans are fetched concurrently, and every
+    range is returned as a memoryview slice of its span (without copying).
+    """
+
+    def __init__(self, conn, key, bucket, ranges, gap=DEFAULT_RANGE_GAP,
+                 workers=DEFAULT_RANGE_WORKERS, headers=None):
+        super(MultiRangeRequest, self).__init__(conn)
+        self.conn = conn
+        self.key = key
+        self.bucket = bucket
+        self.ranges = ranges
+        self.gap = gap
+        self.workers = workers
+        self.headers = _without_range(headers, 'multi-range reads')
+
+    def run(self):
+        spans = self._merge_ranges()
+        contents = []
+        if spans:
+            # The ETag of the first span pins the version of the key the
+            # other spans are read from
+            content, etag = self._fetch_span(spans[0])
+            contents.append(content)
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                contents.extend(content for content, _ in executor.map(
+                    lambda span: self._fetch_span(span, etag), spans[1:]))
+
+        results = [None] * len(self.ranges)
+        for (start, end, members), content in zip(spans, contents):
+            view = memoryview(content)
+            for i in members:
+                r_start, r_end = self.ranges[i]
+                results[i] = view[r_start - start:r_end - start]
+        # Empty ranges aren't fetched at all
+        return [memoryview(b'') if r is None else r for r in results]
+
+    def _merge_ranges(self):
+        """
+        Returns a list of (start, end, members) spans, members being the
+        indexes of the ranges inside the span
+        """
+        spans = []
+        order = sorted(enumerate(self.ranges), key=lambda r: r[1][0])
+        for i, (start, end) in order:
+            if end <= start:
+                continue
+            if spans and start <= spans[-1][1] + self.gap:
+                span = spans[-1]
+                span[1] = max(span[1], end)
+                span[2].append(i)
+            else:
+                spans.append([start, end, [i]])
+        return spans
+
+    def _fetch_span(self, span, etag=None):
+        """
+        Fetches a span, from the version of the key with the given ETag
+
+        Returns:
+            A (content, etag) tuple
+        """
+        headers = dict(self.headers or {})
+        headers['Range'] = 'bytes={0}-{1}'.format(span[0], span[1] - 1)
+        if etag:
+            headers['If-Match'] = etag
+        r = GetRequest(self.conn, self.key, self.bucket, headers=headers,
+                       stream=True).run()
+        try:
+            # Spans past the end of the key are cut short
+            check_range(r, span[0], span[1] - 1, clamped=True)
+            return b''.join(iter_raw(r)), r.headers.get('ETag')
+        finally:
+            r.close()
+
+
+class PagedRequest(S3Request):
+    """
+    A request listing paginated results, iterating over the items of its
+    pages.
+
+    With prefetch, the next pages are fetched on a background thread (up to
+    prefetch pages ahead), while the current page is being consumed.
+    """
+
+    def __init__(self, conn, params=None, prefetch=0):
+        super(PagedRequest, self).__init__(conn, params)
+        self.prefetch = prefetch
 
     def run(self):
         return iter(self)
 
     def __iter__(self):
-        marker = ''
-        more = True
-        url = self.bucket_url('', self.bucket)
-        k = XML_PARSE_STRING.format
+        pages = self.pages()
+        if self.prefetch:
+            pages = iter_prefetched(pages, self.prefetch)
+        for page in pages:
+            for item in page:
+                yield item
+
+    def pages(self):
+        """
+        Iterates over the pages, yielding a list of items for every page
+        """
+        raise NotImplementedError()
+
+    def _get_page(self, url, params):
+        """
+        Gets a page, parsing it while it's downloaded
 
+        Returns:
+            The (items, truncated) tuple of _parse_page
+        """
+        resp = self.adapter().get(url, auth=self.auth, params=params,
+                                  stream=True)
         try:
-            import lxml.etree as ET
-        except ImportError:
-            import xml.etree.ElementTree as ET
+            resp.raise_for_status()
+            return self._parse_page(self._stream(resp))
+        finally:
+            resp.close()
 
-        while more:
-            resp = self.adapter().get(url, auth=self.auth, params={
-                'prefix': self.prefix,
-                'marker': marker,
-            })
+    def _stream_page(self, url, params):
+        """
+        Gets a page, yielding its items as soon as they're parsed, while the
+        rest of the page is still downloading
+        """
+        resp = self.adapter().get(url, auth=self.auth, params=params,
+                                  stream=True)
+        try:
             resp.raise_for_status()
-            root = ET.fromstring(resp.content)
-            for tag in root.findall(k('Contents')):
-                p = {
-                    'key': tag.find(k('Key')).text,
+            for item in self._iter_page(self._stream(resp)):
+                yield item
+        finally:
+            resp.close()
+
+
+class ListRequest(PagedRequest):
+    def __init__(self, conn, prefix, bucket, marker='', delimiter=None,
+                 end_key=None, prefetch=0):
+        """
+        Params:
+            - prefix        List the keys starting with this prefix
+            - bucket        The bucket to list
+            - marker        (Optional) List the keys after this key
+            - delimiter     (Optional) Group the keys containing the
+                            delimiter after the prefix, the groups are yielded
+                            as {'prefix': common_prefix} dicts
+            - end_key       (Optional) Stop the listing after this key
+            - prefetch      (Optional) The number of pages fetched ahead
+                            on a background thread (Defaults to 0)
+        """
+        super(ListRequest, self).__init__(conn, prefetch=prefetch)
+        if prefix and type(prefix) is not str:
+            prefix = prefix.encode('utf-8')
+        self.prefix = prefix
+        self.bucket = bucket
+        self.marker = marker
+        self.delimiter = delimiter
+        self.end_key = end_key
+        self._next_marker = None
+        self._truncated = False
+
+    def __iter__(self):
+        if self.prefetch or self.end_key is not None:
+            # Whole pages are fetched ahead, or filtered
+            return super(ListRequest, self).__iter__()
+        return self._iter_streamed()
+
+    def _iter_streamed(self):
+        """
+        Iterates over the files, yielding every file as soon as it's parsed
+        """
+        url = self.bucket_url('', self.bucket)
+        for params in self._page_params():
+            for p in self._stream_page(url, params):
+                yield p
+
+    def _page_params(self):
+        """
+        Yields the query string params of every page, the next page is
+        requested once the previous one was consumed
+        """
+        marker = self.marker
+        while True:
+            params = {'prefix': self.prefix, 'marker': marker}
+            if self.delimiter:
+                params['delimiter'] = self.delimiter
+            yield params
+            if not self._truncated:
+                return
+            marker = self._next_marker
+
+    def pages(self):
+        url = self.bucket_url('', self.bucket)
+
+        for params in self._page_params():
+            files, more = self._get_page(url, params)
+            if self.end_key is not None:
+                count = len(files)
+                files = [p for p in files
+                         if p.get('key', p.get('prefix')) <= self.end_key]
+                # The rest of the keys are after the end of the listing
+                if len(files) != count:
+                    self._truncated = False
+            if files:
+                yield files
+
+    def _parse_page(self, content):
+        """
+        Parses a page of the listing
+
+        Params:
+            - content   The body of the page, as bytes or a file-like object
+
+        Returns:
+            A (files, truncated) tuple
+        """
+        files = list(self._iter_page(content))
+        return files, self._truncated
+
+    def _iter_page(self, content):
+        """
+        Parses a page of the listing incrementally, yielding the files as
+        they're parsed, and then the common prefixes. The markers of the
+        next page are set once the page is consumed.
+
+        Params:
+            - content   The body of the page, as bytes or a file-like object
+        """
+        k = XML_PARSE_STRING.format
+        contents, common_prefix = k('Contents'), k('CommonPrefixes')
+        truncated, next_marker = k('IsTruncated'), k('NextMarker')
+        next_token = k('NextContinuationToken')
+
+        prefixes = []
+        more = False
+        marker = None
+        last_key = None
+        for tag in iter_elements(content, contents, common_prefix, truncated,
+                                 next_marker, next_token):
+            if tag.tag == contents:
+                last_key = tag.find(k('Key')).text
+                yield {
+                    'key': last_key,
                     'size': int(tag.find(k('Size')).text),
                     'last_modified': datetime.datetime.strptime(
                         tag.find(k('LastModified')).text,
@@ -127,17 +695,320 @@ class ListRequest(S3Request):
                     'etag': tag.find(k('ETag')).text[1:-1],
                     'storage_class': tag.find(k('StorageClass')).text,
                 }
+            elif tag.tag == common_prefix:
+                prefixes.append({'prefix': tag.find(k('Prefix')).text})
+            elif tag.tag == truncated:
+                more = tag.text == 'true'
+            elif tag.tag == next_marker:
+                # With a delimiter, S3 tells where the next page starts
+                marker = tag.text
+            else:
+                # ListObjectsV2 pages are chained with a continuation token
+                self._next_token = tag.text
+        for p in prefixes:
+            yield p
+        if last_key is not None:
+            self._next_marker = last_key
+        if marker is not None:
+            self._next_marker = marker
+        self._truncated = more
+
+
+class ListObjectsV2Request(ListRequest):
+    """
+    Lists files with the ListObjectsV2 API, following the continuation
+    tokens issued by S3
+    """
+
+    def __init__(self, conn, prefix, bucket, delimiter=None, max_keys=None,
+                 start_after=None, continuation_token=None, prefetch=0):
+        """
+        Params:
+            - prefix            List the keys starting with this prefix
+            - bucket            The bucket to list
+            - delimiter         (Optional) Group the keys containing the
+                                delimiter after the prefix, the groups are
+                                yielded as {'prefix': common_prefix} dicts
+            - max_keys          (Optional) The maximum number of keys (and
+                                common prefixes) of a page
+            - start_after       (Optional) List the keys after this key
+            - continuation_token    (Optional) Continue a listing from the
+                                token of a previous page
+            - prefetch          (Optional) The number of pages fetched ahead
+                                on a background thread (Defaults to 0)
+        """
+        super(ListObjectsV2Request, self).__init__(
+            conn, prefix, bucket, delimiter=delimiter, prefetch=prefetch)
+        self.max_keys = max_keys
+        self.start_after = start_after
+        self.continuation_token = continuation_token
+        self._next_token = None
+
+    def _page_params(self):
+        token = self.continuation_token
+        while True:
+            params = {'list-type': 2, 'prefix': self.prefix}
+            for name, value in (('delimiter', self.delimiter),
+                                ('max-keys', self.max_keys),
+                                ('start-after', self.start_after),
+                                ('continuation-token', token)):
+                if value:
+                    params[name] = value
+            yield params
+            if not self._truncated:
+                return
+            token = self._next_token
+
+
+class ListBatchesRequest(ListRequest):
+    """
+    Lists files one page at a time, every page being a ListingBatch storing
+    the keys by columns, instead of a dict for every key
+    """
+
+    def __init__(self, conn, prefix, bucket, marker='', delimiter=None,
+                 prefetch=0):
+        super(ListBatchesRequest, self).__init__(
+            conn, prefix, bucket, marker=marker, delimiter=delimiter,
+            prefetch=prefetch)
+
+    def __iter__(self):
+        # Batches are whole pages
+        return PagedRequest.__iter__(self)
+
+    def _parse_page(self, content):
+        """
+        Parses a page of the listing to a ListingBatch, incrementally
+
+        Returns:
+            A ([batch], truncated) tuple
+        """
+        k = XML_PARSE_STRING.format
+        contents, common_prefix = k('Contents'), k('CommonPrefixes')
+        truncated, next_marker = k('IsTruncated'), k('NextMarker')
+        key, size, modified = k('Key'), k('Size'), k('LastModified')
+        etag, storage_class = k('ETag'), k('StorageClass')
+
+        batch = ListingBatch()
+        days = {}
+        more = False
+        marker = None
+        for tag in iter_elements(content, contents, common_prefix, truncated,
+                                 next_marker):
+            if tag.tag == contents:
+                batch.append(
+                    tag.findtext(key),
+                    int(tag.findtext(size)),
+                    parse_timestamp(tag.findtext(modified), days),
+                    tag.findtext(etag)[1:-1],
+                    intern_storage_class(tag.findtext(storage_class)),
+                )
+            elif tag.tag == common_prefix:
+                batch.prefixes.append(tag.findtext(k('Prefix')))
+            elif tag.tag == truncated:
+                more = tag.text == 'true'
+            else:
+                marker = tag.text
+        if batch.keys:
+            self._next_marker = batch.keys[-1]
+        if marker is not None:
+            self._next_marker = marker
+        self._truncated = more
+        if not batch.keys and not batch.prefixes:
+            return [], more
+        return [batch], more
+
+
+class ParallelListRequest(S3Request):
+    """
+    Lists a prefix as several shards, listed concurrently
+
+    The keyspace is split either at the given split points, or at the
+    common prefixes found by listing the prefix with a delimiter. The files
+    found by this discovery are yielded while it goes on, and every common
+    prefix is listed by a worker as soon as it's found. When the first page
+    of the discovery has fewer common prefixes than workers (e.g. a flat
+    prefix, without delimiters in its keys), the rest of the prefix is split
+    at SPLIT_CHARS instead of being discovered serially.
+
+    Every shard pushes the pages it gets to a bounded queue, so a slow
+    consumer doesn't buffer the whole listing.
+    """
+
+    def __init__(self, conn, prefix, bucket, split_points=None,
+                 delimiter='/', workers=DEFAULT_LIST_WORKERS, ordered=False,
+                 queue_size=DEFAULT_LIST_QUEUE_SIZE):
+        super(ParallelListRequest, self).__init__(conn)
+        self.conn = conn
+        self.prefix = prefix
+        self.bucket = bucket
+        self.split_points = split_points
+        self.delimiter = delimiter
+        self.workers = workers
+        self.ordered = ordered
+        self.queue_size = queue_size
+
+    def run(self):
+        return iter(self)
+
+    def _split(self, bounds):
+        """
+        Returns the shards listing between the given markers (the first
+        one is exclusive, and every shard ends at the next one)
+        """
+        return [ListRequest(self.conn, self.prefix, self.bucket,
+                            marker=bounds[i], end_key=bounds[i + 1])
+                for i in range(len(bounds) - 1)]
+
+    def _discover(self):
+        """
+        Iterates over the direct files and the shards (ListRequests) of the
+        prefix, ordered by their keys
+        """
+        if self.split_points is not None:
+            bounds = [''] + sorted(set(self.split_points)) + [None]
+            for shard in self._split(bounds):
+                yield shard
+            return
+
+        listing = ListRequest(self.conn, self.prefix, self.bucket,
+                              delimiter=self.delimiter)
+        for i, page in enumerate(listing.pages()):
+            # The common prefixes of a page come after its files
+            page.sort(key=lambda p: p.get('key', p.get('prefix')))
+            if i == 0 and listing._truncated and \
+                    sum('prefix' in p for p in page) < self.workers:
+                for item in self._split_rest(page):
+                    yield item
+                return
+            for p in page:
+                if 'prefix' in p:
+                    yield ListRequest(self.conn, p['prefix'], self.bucket)
+                else:
+                    yield p
+
+    def _split_rest(self, page):
+        """
+        Iterates over the files and shards of the first page of the
+        discovery, and then over shards splitting the rest of the prefix at
+        SPLIT_CHARS
+        """
+        files = [p['key'] for p in page if 'prefix' not in p]
+        # The common prefixes after the last file are listed by the shards
+        start = files[-1] if files else ''
+        for p in page:
+            if 'prefix' not in p:
                 yield p
-            more = root.find(k('IsTruncated')).text == 'true'
-            if more:
-                marker = p['key']
+            elif p['prefix'] < start:
+                yield ListRequest(self.conn, p['prefix'], self.bucket)
+        bounds = [start] + [b for b in (self.prefix + c for c in SPLIT_CHARS)
+                            if b > start] + [None]
+        for shard in self._split(bounds):
+            yield shard
 
+    def __iter__(self):
+        stop = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            if self.ordered:
+                files = self._iter_ordered(executor, stop)
+            else:
+                files = self._iter_unordered(executor, stop)
+            for p in files:
+                yield p
+        finally:
+            # The consumer may have stopped early, stop the workers
+            stop.set()
+            executor.shutdown(wait=False)
+
+    def _iter_unordered(self, executor, stop):
+        q = queue.Queue(self.queue_size * self.workers)
+        shards = 0
+        for item in self._discover():
+            if isinstance(item, ListRequest):
+                executor.submit(self._list_shard, item, q, stop)
+                shards += 1
+            else:
+                yield item
+            # Yield the pages already listed by the shards, without waiting
+            # for the discovery to end
+            while True:
+                try:
+                    files = q.get_nowait()
+                except queue.Empty:
+                    break
+                if files is None:
+                    shards -= 1
+                elif isinstance(files, Exception):
+                    raise files
+                else:
+                    for p in files:
+                        yield p
+        for p in self._drain(q, shards):
+            yield p
+
+    def _iter_ordered(self, executor, stop):
+        # The discovery is read ahead, so up to `workers` shards are listed
+        # while the current file or shard is consumed. Shards are submitted
+        # (and therefore started) in the order they're consumed, so a worker
+        # blocked on a full queue never holds back the shard being consumed.
+        discovered = self._discover()
+        ahead = collections.deque()
+        shards = 0
+        while True:
+            while shards < self.workers and \
+                    len(ahead) < DEFAULT_LIST_READ_AHEAD:
+                item = next(discovered, None)
+                if item is None:
+                    break
+                if isinstance(item, ListRequest):
+                    q = queue.Queue(self.queue_size)
+                    executor.submit(self._list_shard, item, q, stop)
+                    item = q
+                    shards += 1
+                ahead.append(item)
+            if not ahead:
+                return
+            item = ahead.popleft()
+            if isinstance(item, dict):
+                yield item
+                continue
+            shards -= 1
+            for p in self._drain(item, 1):
+                yield p
 
-class ListMultipartUploadRequest(S3Request):
+    def _list_shard(self, shard, q, stop):
+        try:
+            for files in shard.pages():
+                if not queue_put(q, files, stop):
+                    return
+        except Exception as e:
+            queue_put(q, e, stop)
+            return
+        queue_put(q, None, stop)
+
+    def _drain(self, q, shards):
+        """
+        Yields the files pushed to a queue, until the given number of shards
+        are done
+        """
+        while shards:
+            item = q.get()
+            if item is None:
+                shards -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                for p in item:
+                    yield p
+
+
+class ListMultipartUploadRequest(PagedRequest):
     def __init__(self, conn, prefix, bucket, max_uploads, encoding, key_marker,
-                 upload_id_marker):
+                 upload_id_marker, prefetch=0):
         params = {'uploads': None}
-        super(ListMultipartUploadRequest, self).__init__(conn, params)
+        super(ListMultipartUploadRequest, self).__init__(conn, params,
+                                                         prefetch=prefetch)
         self.conn = conn
         if type(prefix) is not str:
             self.prefix = prefix.encode('utf-8')
@@ -150,47 +1021,62 @@ class ListMultipartUploadRequest(S3Request):
         self.key_marker = key_marker
         self.upload_id_marker = upload_id_marker
 
-    def run(self):
-        return iter(self)
-
-    def __iter__(self):
+    def pages(self):
         more = True
         url = self.bucket_url('', self.bucket)
-        k = XML_PARSE_STRING.format
-
-        try:
-            import lxml.etree as ET
-        except ImportError:
-            import xml.etree.ElementTree as ET
-        from .multipart_upload import MultipartUpload
 
         while more:
-            resp = self.adapter().get(url, auth=self.auth, params={
+            uploads, more = self._get_page(url, {
                 'encoding-type': self.encoding,
                 'max-uploads': self.max_uploads,
                 'key-marker': self.key_marker,
                 'prefix': self.prefix,
                 'upload-id-marker': self.upload_id_marker
             })
-            resp.raise_for_status()
-            root = ET.fromstring(resp.content)
-            for tag in root.findall(k('Upload')):
+            yield uploads
+
+    def _parse_page(self, content):
+        """
+        Parses a page of the listing incrementally, and moves the markers to
+        the next page
+
+        Returns:
+            A (uploads, truncated) tuple
+        """
+        from .multipart_upload import MultipartUpload
+
+        k = XML_PARSE_STRING.format
+        upload, truncated = k('Upload'), k('IsTruncated')
+        key_marker, upload_id_marker = k('NextKeyMarker'), \
+            k('NextUploadIdMarker')
+
+        uploads = []
+        more = False
+        markers = {}
+        for tag in iter_elements(content, upload, truncated, key_marker,
+                                 upload_id_marker):
+            if tag.tag == upload:
                 mp = MultipartUpload(self.conn, self.bucket,
                                      tag.find(k('Key')).text)
                 mp.uploadId = tag.find(k('UploadId')).text
-                yield mp
+                uploads.append(mp)
+            elif tag.tag == truncated:
+                more = tag.text == 'true'
+            else:
+                markers[tag.tag] = tag.text
 
-            more = root.find(k('IsTruncated')).text == 'true'
-            if more:
-                self.key_marker = root.find(k('NextKeyMarker')).text
-                self.upload_id_marker = root.find(k('NextUploadIdMarker')).text
+        if more:
+            self.key_marker = markers[key_marker]
+            self.upload_id_marker = markers[upload_id_marker]
+        return uploads, more
 
 
-class ListPartsRequest(S3Request):
+class ListPartsRequest(PagedRequest):
     def __init__(self, conn, key, bucket, upload_id, max_parts,
-                 encoding, part_number_marker):
+                 encoding, part_number_marker, prefetch=0):
         params = {'uploadId': upload_id}
-        super(ListPartsRequest, self).__init__(conn, params)
+        super(ListPartsRequest, self).__init__(conn, params,
+                                               prefetch=prefetch)
         self.key = key
         self.bucket = bucket
         self.encoding = encoding
@@ -198,58 +1084,68 @@ class ListPartsRequest(S3Request):
         self.max_parts = max_parts
         self.part_number_marker = part_number_marker
 
-    def run(self):
-        return iter(self)
-
-    def __iter__(self):
+    def pages(self):
         more = True
         url = self.bucket_url(self.key, self.bucket)
-        k = XML_PARSE_STRING.format
 
-        try:
-            import lxml.etree as ET
-        except ImportError:
-            import xml.etree.ElementTree as ET
         while more:
-            resp = self.adapter().get(url, auth=self.auth, params={
+            parts, more = self._get_page(url, {
                 'encoding-type': self.encoding,
                 'max-parts': self.max_parts,
                 'part-number-marker': self.part_number_marker
             })
-            resp.raise_for_status()
-            root = ET.fromstring(resp.content)
-            for tag in root.findall(k('Part')):
-                part = {
+            yield parts
+
+    def _parse_page(self, content):
+        """
+        Parses a page of the listing incrementally, and moves the marker to
+        the next page
+
+        Returns:
+            A (parts, truncated) tuple
+        """
+        k = XML_PARSE_STRING.format
+        part, truncated, marker = k('Part'), k('IsTruncated'), \
+            k('NextPartNumberMarker')
+
+        parts = []
+        more = False
+        next_marker = None
+        for tag in iter_elements(content, part, truncated, marker):
+            if tag.tag == part:
+                parts.append({
                     'part_number': int(tag.find(k('PartNumber')).text),
                     'last_modified': tag.find(k('LastModified')).text,
                     'etag': tag.find(k('ETag')).text,
                     'size': int(tag.find(k('Size')).text)
-                }
-                yield part
+                })
+            elif tag.tag == truncated:
+                more = tag.text == 'true'
+            else:
+                next_marker = tag.text
 
-            more = root.find(k('IsTruncated')).text == 'true'
-            if more:
-                self.part_number_marker = root.find(
-                    k('NextPartNumberMarker')).text
+        if more:
+            self.part_number_marker = next_marker
+        return parts, more
 
 
 class InitiateMultipartUploadRequest(S3Request):
-    def __init__(self, conn, key, bucket):
+    def __init__(self, conn, key, bucket, headers=None):
         params = {'uploads': None}
         super(InitiateMultipartUploadRequest, self).__init__(conn, params)
         self.key = key
         self.bucket = bucket
+        self.headers = headers
 
     def run(self, data=None):
         url = self.bucket_url(self.key, self.bucket)
-        k = XML_PARSE_STRING.format
-        try:
-            import lxml.etree as ET
-        except ImportError:
-            import xml.etree.ElementTree as ET
-        r = self.adapter().post(url, auth=self.auth)
+        r = self.adapter().post(url, auth=self.auth, headers=self.headers)
         r.raise_for_status()
-        root = ET.fromstring(r.content)
+        return self._parse_upload_id(r.content)
+
+    def _parse_upload_id(self, content):
+        k = XML_PARSE_STRING.format
+        root = ET.fromstring(content)
         return root.find(k('UploadId')).text
 
 
@@ -266,6 +1162,58 @@ class DeleteRequest(S3Request):
         return r
 
 
+class DeleteObjectsRequest(S3Request):
+    """
+    Deletes up to 1000 keys in a single Multi-Object Delete request
+    """
+
+    def __init__(self, conn, keys, bucket):
+        if len(keys) > DELETE_BATCH_SIZE:
+            raise ValueError("Can't delete more than {0} keys in a single "
+                             "request".format(DELETE_BATCH_SIZE))
+        super(DeleteObjectsRequest, self).__init__(conn, {'delete': None})
+        self.keys = keys
+        self.bucket = bucket
+
+    def run(self):
+        """
+        Returns:
+            A {'deleted': count, 'errors': [...]} dict, with a {'key',
+            'code', 'message'} dict for every key that couldn't be deleted
+        """
+        # POST /?delete
+        body = self._build_body()
+        headers = {
+            'Content-MD5': base64.b64encode(
+                hashlib.md5(body).digest()).decode('ascii'),
+            'Content-Type': 'application/xml',
+        }
+        url = self.bucket_url('', self.bucket)
+        r = self.adapter().post(url, auth=self.auth, headers=headers,
+                                data=body)
+        r.raise_for_status()
+        errors = self._parse_errors(r.content)
+        return {'deleted': len(self.keys) - len(errors), 'errors': errors}
+
+    def _build_body(self):
+        # Quiet mode, S3 only reports the keys it failed to delete
+        obj = "<Object><Key>{0}</Key></Object>"
+        body = "<Delete><Quiet>true</Quiet>{0}</Delete>".format(
+            "".join([obj.format(escape(stringify(key)))
+                     for key in self.keys]))
+        return body.encode('utf-8')
+
+    def _parse_errors(self, content):
+        k = XML_PARSE_STRING.format
+
+        root = ET.fromstring(content)
+        return [{
+            'key': tag.find(k('Key')).text,
+            'code': tag.find(k('Code')).text,
+            'message': tag.find(k('Message')).text,
+        } for tag in root.findall(k('Error'))]
+
+
 class HeadRequest(S3Request):
     def __init__(self, conn, bucket, key='', headers=None):
         super(HeadRequest, self).__init__(conn)
@@ -273,6 +1221,10 @@ class HeadRequest(S3Request):
         self.bucket = bucket
         self.headers = headers
 
+    def coalesce_key(self):
+        return ('HEAD', self.bucket, self.key,
+                tuple(sorted((self.headers or {}).items())))
+
     def run(self):
         url = self.bucket_url(self.key, self.bucket)
         r = self.adapter().head(url, auth=self.auth, headers=self.headers)
@@ -308,26 +1260,10 @@ class UploadRequest(S3Request):
         self.rewind = rewind
 
     def run(self):
-        headers = {}
-        # calc the expires headers
-        if self.expires is not None:
-            headers['Cache-Control'] = self._calc_cache_control()
-        # calc the content type
-        if self.content_type is not None:
-            headers['Content-Type'] = self.content_type
-        elif mimetypes.guess_type(self.key)[0] is not None:
-            headers['Content-Type'] = mimetypes.guess_type(self.key)[0]
-        else:
-            headers['Content-Type'] = 'application/octet-stream'
-        # if public - set public headers
-        if self.public:
-            headers['x-amz-acl'] = 'public-read'
+        headers = self._build_headers()
         # if rewind - rewind the fp like object
         if self.rewind and hasattr(self.fp, 'seek'):
             self.fp.seek(0, os.SEEK_SET)
-        # update headers with extra headers
-        if self.extra_headers:
-            headers.update(self.extra_headers)
         try:
             # Wrap our file pointer with a LenWrapperStream.
             # We do it because requests will try to fallback to chunked
@@ -352,6 +1288,34 @@ class UploadRequest(S3Request):
                 self.fp.close()
         return r
 
+    def size(self):
+        """
+        Returns the number of bytes the request uploads
+        """
+        if self.rewind and hasattr(self.fp, 'seek'):
+            self.fp.seek(0, os.SEEK_SET)
+        return len(LenWrapperStream(self.fp))
+
+    def _build_headers(self):
+        headers = {}
+        # calc the expires headers
+        if self.expires is not None:
+            headers['Cache-Control'] = self._calc_cache_control()
+        # calc the content type
+        if self.content_type is not None:
+            headers['Content-Type'] = self.content_type
+        elif mimetypes.guess_type(self.key)[0] is not None:
+            headers['Content-Type'] = mimetypes.guess_type(self.key)[0]
+        else:
+            headers['Content-Type'] = 'application/octet-stream'
+        # if public - set public headers
+        if self.public:
+            headers['x-amz-acl'] = 'public-read'
+        # update headers with extra headers
+        if self.extra_headers:
+            headers.update(self.extra_headers)
+        return headers
+
     def _calc_cache_control(self):
         expires = self.expires
         # Handle content expiration
@@ -373,6 +1337,108 @@ class UploadRequest(S3Request):
         return timedelta.days * 24 * 60 * 60 + timedelta.seconds
 
 
+class MultipartUploadRequest(UploadRequest):
+    """
+    Uploads a seekable file as a multipart upload, with the parts uploaded
+    concurrently.
+
+    Accepts the same params as UploadRequest, the headers are sent with the
+    request initiating the upload.
+    """
+
+    def __init__(self, conn, key, local_file, bucket, part_size, workers,
+                 expires=None, content_type=None, public=True,
+                 extra_headers=None, close=False, rewind=True):
+        super(MultipartUploadRequest, self).__init__(
+            conn, key, local_file, bucket, expires=expires,
+            content_type=content_type, public=public,
+            extra_headers=extra_headers, close=close, rewind=rewind)
+        self.conn = conn
+        self.part_size = part_size
+        self.workers = workers
+
+    def run(self):
+        # if rewind - rewind the fp like object
+        if self.rewind and hasattr(self.fp, 'seek'):
+            self.fp.seek(0, os.SEEK_SET)
+        try:
+            upload_id = InitiateMultipartUploadRequest(
+                self.conn, self.key, self.bucket,
+                headers=self._build_headers()).run()
+            try:
+                parts = self._upload_parts(upload_id)
+                r = CompleteUploadRequest(self.conn, self.key, self.bucket,
+                                          upload_id, parts).run()
+            except Exception:
+                # Don't leave the uploaded parts behind
+                self._abort(upload_id)
+                raise
+        finally:
+            # if close is set, try to close the fp like object
+            # (also, use finally to ensure the close)
+            if self.close and hasattr(self.fp, 'close'):
+                self.fp.close()
+        return r
+
+    def _abort(self, upload_id):
+        """
+        Aborts a failed upload. A failing abort is ignored, so it doesn't
+        hide the error that failed the upload (S3 lifecycle rules can abort
+        the incomplete uploads left behind).
+        """
+        try:
+            CancelUploadRequest(self.conn, self.key, self.bucket,
+                                upload_id).run()
+        except Exception:
+            pass
+
+    def _upload_parts(self, upload_id):
+        """
+        Uploads the parts of the file concurrently, see
+        MultipartUpload.upload_file
+
+        Returns:
+            A list of {'part_number', 'etag'} dicts
+        """
+        from .multipart_upload import MultipartUpload
+
+        mp = MultipartUpload(self.conn, self.bucket, self.key)
+        mp.uploadId = upload_id
+        return mp.upload_file(self.fp, self.part_size, self.workers)
+
+
+class PathUploadRequest(S3Request):
+    """
+    Uploads a file given by its path, opening it only when the upload runs,
+    so uploads that are never run don't hold a file handle
+    """
+
+    def __init__(self, conn, path, upload):
+        """
+        Params:
+            - path      The path of the file
+            - upload    A callable, returning the request uploading an open
+                        file object
+        """
+        super(PathUploadRequest, self).__init__(conn)
+        self.path = path
+        self.upload = upload
+
+    def run(self):
+        with open(self.path, 'rb') as fp:
+            return self.upload(fp).run()
+
+    def size(self):
+        """
+        Returns the number of bytes the request uploads
+        """
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            # The upload fails (and reports the error) once it runs
+            return 0
+
+
 class UploadPartRequest(S3Request):
 
     def __init__(self, conn, key, bucket, fp, part_num,
@@ -416,22 +1482,22 @@ class CompleteUploadRequest(S3Request):
         self.parts_list = parts_list
 
     def run(self):
-        # We need to pass some HTML in the POST request data body.
-        # It includes all the ETags headers sent by the server responses when
-        # parts were uploaded, in order
-        data = "<CompleteMultipartUpload>"
-        for part in self.parts_list:
-            data += "<Part>"
-            data += "<PartNumber>{0}</PartNumber>".format(part['part_number'])
-            data += "<ETag>{0}</ETag>".format(part['etag'])
-            data += "</Part>"
-        data += "</CompleteMultipartUpload>"
         # POST /ObjectName?uploadId=UploadId
         url = self.bucket_url(self.key, self.bucket)
-        r = self.adapter().post(url, auth=self.auth, data=data)
+        r = self.adapter().post(url, auth=self.auth, data=self._build_body())
         r.raise_for_status()
         return r
 
+    def _build_body(self):
+        # We need to pass some HTML in the POST request data body.
+        # It includes all the ETags headers sent by the server responses when
+        # parts were uploaded, in order
+        # (Joined once, concatenating would be quadratic on 10000 parts)
+        part = "<Part><PartNumber>{0}</PartNumber><ETag>{1}</ETag></Part>"
+        return "<CompleteMultipartUpload>{0}</CompleteMultipartUpload>".format(
+            "".join([part.format(p['part_number'], p['etag'])
+                     for p in self.parts_list]))
+
 
 class CancelUploadRequest(S3Request):
 
@@ -465,6 +1531,12 @@ class CopyRequest(S3Request):
         self.public = public
 
     def run(self):
+        r = self.adapter().put(self.bucket_url(self.to_key, self.to_bucket),
+                               auth=self.auth, headers=self._build_headers())
+        r.raise_for_status()
+        return r
+
+    def _build_headers(self):
         headers = {
             'x-amz-copy-source': "/%s/%s" % (self.from_bucket,
                                              self.from_key)
@@ -477,10 +1549,7 @@ class CopyRequest(S3Request):
             headers['x-amz-acl'] = 'public-read'
         if self.metadata:
             headers.update(self.metadata)
-        r = self.adapter().put(self.bucket_url(self.to_key, self.to_bucket),
-                               auth=self.auth, headers=headers)
-        r.raise_for_status()
-        return r
+        return headers
 
 
 class UpdateMetadataRequest(CopyRequest):
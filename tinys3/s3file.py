@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+tinys3.s3file
+~~~~~~~~~~~~~
+
+A read only, seekable file object over a key
+
+"""
+
+import io
+import os
+from collections import OrderedDict
+
+from .request_factory import GetRequest, HeadRequest, check_range, iter_raw
+
+# The default size of the blocks fetched from S3
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+# The default number of blocks kept in the cache
+DEFAULT_CACHE_BLOCKS = 32
+# The default maximum number of blocks read ahead on sequential reads
+DEFAULT_MAX_READ_AHEAD = 8
+
+
+class S3File(io.RawIOBase):
+    """
+    A read only file object over a key, fetching only the bytes it reads,
+    using ranged GET requests.
+
+    Fetched blocks are kept in an LRU cache, so random reads (like the ones
+    of zipfile, tarfile or parquet readers) don't fetch the same blocks
+    twice. When the file is read sequentially, the following blocks are read
+    ahead in the same request, doubling the read ahead on every sequential
+    block up to max_read_ahead.
+
+    Usage:
+
+    >>> with conn.open('archive.zip', 'my_bucket') as f:
+    >>>     names = zipfile.ZipFile(f).namelist()
+    """
+
+    def __init__(self, conn, key, bucket, block_size=DEFAULT_BLOCK_SIZE,
+                 cache_blocks=DEFAULT_CACHE_BLOCKS,
+                 max_read_ahead=DEFAULT_MAX_READ_AHEAD, headers=None):
+        """
+        Opens a key
+
+        Params:
+            - conn              The connection to use
+            - key               The key to open
+            - bucket            The bucket of the key
+            - block_size        (Optional) The size of the fetched blocks
+              (Defaults to 1MB)
+            - cache_blocks      (Optional) The number of blocks kept in the
+              cache (Defaults to 32)
+            - max_read_ahead    (Optional) The maximum number of blocks read
+              ahead on sequential reads (Defaults to 8)
+            - headers           (Optional) Additional headers of the requests
+        """
+        super(S3File, self).__init__()
+        self.conn = conn
+        self.key = key
+        self.bucket = bucket
+        self.block_size = block_size
+        self.cache_blocks = max(cache_blocks, max_read_ahead + 1)
+        self.max_read_ahead = max_read_ahead
+        self.headers = headers
+
+        head = HeadRequest(conn, bucket, key, headers=headers).run()
+        self.size = int(head.headers['Content-Length'])
+        # Make sure all the blocks come from the same version of the key
+        self.etag = head.headers.get('ETag')
+
+        self.pos = 0
+        self.blocks = OrderedDict()
+        self._last_block = None
+        self._read_ahead = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.pos
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position {0}".format(offset))
+        self.pos = offset
+        return self.pos
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def read(self, n=-1):
+        """
+        Reads up to n bytes (or until the end of the key)
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        end = self.size if n is None or n < 0 else min(self.pos + n,
+                                                        self.size)
+        chunks = []
+        while self.pos < end:
+            block = self._block(self.pos // self.block_size)
+            offset = self.pos % self.block_size
+            chunk = block[offset:offset + end - self.pos]
+            chunks.append(chunk)
+            self.pos += len(chunk)
+        return b''.join(chunks)
+
+    def readall(self):
+        return self.read()
+
+    def peek(self, n=0):
+        """
+        Returns the bytes left in the current block, without moving the
+        position (used by readline)
+        """
+        if self.pos >= self.size:
+            return b''
+        block = self._block(self.pos // self.block_size)
+        return block[self.pos % self.block_size:]
+
+    def _block(self, index):
+        """
+        Returns a block, from the cache or from S3
+        """
+        # Adapt the read ahead to the access pattern
+        if self._last_block is not None and index == self._last_block + 1:
+            self._read_ahead = min(max(1, self._read_ahead * 2),
+                                   self.max_read_ahead)
+        elif index != self._last_block:
+            self._read_ahead = 0
+        self._last_block = index
+
+        if index in self.blocks:
+            self.blocks.move_to_end(index)
+            return self.blocks[index]
+
+        # Fetch the block, and the blocks read ahead that aren't cached
+        last = index
+        last_block = (self.size - 1) // self.block_size
+        while last < min(index + self._read_ahead, last_block) and \
+                last + 1 not in self.blocks:
+            last += 1
+        data = self._fetch(index * self.block_size,
+                           min((last + 1) * self.block_size, self.size) - 1)
+        for i in range(index, last + 1):
+            start = (i - index) * self.block_size
+            self.blocks[i] = data[start:start + self.block_size]
+        while len(self.blocks) > self.cache_blocks:
+            self.blocks.popitem(last=False)
+        return self.blocks[index]
+
+    def _fetch(self, start, end):
+        headers = dict(self.headers or {})
+        headers['Range'] = 'bytes={0}-{1}'.format(start, end)
+        if self.etag:
+            headers['If-Match'] = self.etag
+        r = GetRequest(self.conn, self.key, self.bucket, headers=headers,
+                       stream=True).run()
+        try:
+            # A whole body would be cut to wrong blocks
+            check_range(r, start, end, clamped=True)
+            return b''.join(iter_raw(r))
+        finally:
+            r.close()
+
+    def close(self):
+        self.blocks.clear()
+        super(S3File, self).close()
+
+    def __repr__(self):
+        return '<S3File {0}/{1}>'.format(self.bucket, self.key)
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+An in-memory stand-in for S3, used as the session of a connection in the
+tests that run several requests against the same objects
+"""
+import base64
+import hashlib
+import itertools
+import threading
+import xml.etree.ElementTree as ET
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+try:
+    from urlparse import urlsplit, parse_qsl
+except ImportError:
+    from urllib.parse import urlsplit, parse_qsl
+
+from requests.exceptions import HTTPError, ContentDecodingError
+from requests.structures import CaseInsensitiveDict
+from urllib3.exceptions import DecodeError
+from urllib3.response import HTTPResponse
+
+XMLNS = 'http://s3.amazonaws.com/doc/2006-03-01/'
+
+
+class FakeResponse(object):
+    def __init__(self, status_code=200, content=b'', headers=None):
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers or {})
+        if 'Content-Encoding' in self.headers:
+            # Like requests, content and iter_content decode the body
+            self.raw = HTTPResponse(BytesIO(content), headers=self.headers,
+                                    preload_content=False,
+                                    decode_content=False)
+            self._content = None
+        else:
+            self.raw = BytesIO(content)
+            self._content = content
+        self.closed = False
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = b''.join(self.iter_content(1024))
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        self._content = value
+
+    def iter_content(self, chunk_size=1):
+        if isinstance(self.raw, HTTPResponse):
+            try:
+                for chunk in self.raw.stream(chunk_size, decode_content=True):
+                    yield chunk
+            except DecodeError as e:
+                raise ContentDecodingError(e)
+            return
+        while True:
+            chunk = self.raw.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise HTTPError('{0} Error'.format(self.status_code),
+                            response=self)
+
+
+class FakeS3Adapter(object):
+    """
+    Stores objects in a dict of (bucket, key) -> bytes, and records every
+    request it gets in `calls`
+    """
+
+    def __init__(self):
+        self.objects = {}
+        # The headers stored with the objects (e.g. Content-Encoding), by
+        # (bucket, key)
+        self.object_headers = {}
+        self.uploads = {}
+        self.upload_ids = itertools.count(1)
+        self.calls = []
+        # Keys that Multi-Object Deletes fail to delete
+        self.protected = set()
+        # The number of keys of a listing page
+        self.page_size = 1000
+        self.lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def request(self, method, url, auth=None, params=None, headers=None,
+                data=None, stream=False):
+        parts = urlsplit(url)
+        bucket = parts.netloc.split('.')[0]
+        key = parts.path.lstrip('/')
+        query = dict(parse_qsl(parts.query, keep_blank_values=True))
+        # Subresources without a value
+        for item in parts.query.split('&'):
+            if item and '=' not in item:
+                query[item] = None
+        query.update(params or {})
+        headers = CaseInsensitiveDict(headers or {})
+        body = self._read_body(data)
+        with self.lock:
+            self.calls.append((method, bucket, key, query, headers))
+        handler = getattr(self, '_' + method.lower())
+        return handler(bucket, key, query, headers, body)
+
+    def _read_body(self, data):
+        if data is None:
+            return b''
+        if hasattr(data, 'read'):
+            data = data.read()
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        return data
+
+    def _etag(self, body):
+        return '"{0}"'.format(hashlib.md5(body).hexdigest())
+
+    def _list_parts(self, query):
+        upload = self.uploads.get(query['uploadId'])
+        if upload is None:
+            return FakeResponse(404)
+        parts = ''.join(
+            '<Part><PartNumber>{0}</PartNumber>'
+            '<LastModified>2010-11-10T20:48:34.000Z</LastModified>'
+            '<ETag>{1}</ETag><Size>{2}</Size></Part>'.format(
+                n, self._etag(body), len(body))
+            for n, body in sorted(upload['parts'].items()))
+        return FakeResponse(200, (
+            '<ListPartsResult xmlns="{0}"><IsTruncated>false</IsTruncated>'
+            '{1}</ListPartsResult>').format(XMLNS, parts).encode('utf-8'))
+
+    def _list_entries(self, bucket, prefix, delimiter, after):
+        """
+        Returns the sorted keys and common prefixes after a marker
+        """
+        entries = set()
+        with self.lock:
+            keys = [k for b, k in self.objects if b == bucket]
+        for k in keys:
+            if not k.startswith(prefix):
+                continue
+            rest = k[len(prefix):]
+            if delimiter and delimiter in rest:
+                k = prefix + rest[:rest.index(delimiter) + len(delimiter)]
+            if k > after:
+                entries.add(k)
+        return sorted(entries)
+
+    def _contents(self, bucket, entries, delimiter, prefix):
+        contents, prefixes = [], []
+        for k in entries:
+            if delimiter and k.endswith(delimiter) and \
+                    delimiter in k[len(prefix):]:
+                prefixes.append('<CommonPrefixes><Prefix>{0}</Prefix>'
+                                '</CommonPrefixes>'.format(escape(k)))
+                continue
+            body = self.objects.get((bucket, k), b'')
+            contents.append(
+                '<Contents><Key>{0}</Key>'
+                '<LastModified>2010-11-10T20:48:34.000Z</LastModified>'
+                '<ETag>{1}</ETag><Size>{2}</Size>'
+                '<StorageClass>STANDARD</StorageClass></Contents>'.format(
+                    escape(k), self._etag(body), len(body)))
+        return ''.join(contents) + ''.join(prefixes)
+
+    def _list_objects(self, bucket, query):
+        if query.get('list-type') in (2, '2'):
+            return self._list_objects_v2(bucket, query)
+        prefix = query.get('prefix') or ''
+        delimiter = query.get('delimiter')
+        max_keys = min(int(query.get('max-keys') or self.page_size),
+                       self.page_size)
+        entries = self._list_entries(bucket, prefix, delimiter,
+                                     query.get('marker') or '')
+        page = entries[:max_keys]
+        truncated = len(entries) > max_keys
+        next_marker = ''
+        if truncated and delimiter:
+            next_marker = '<NextMarker>{0}</NextMarker>'.format(
+                escape(page[-1]))
+        return FakeResponse(200, (
+            '<ListBucketResult xmlns="{0}"><Name>{1}</Name>'
+            '<IsTruncated>{2}</IsTruncated>{3}{4}</ListBucketResult>').format(
+                XMLNS, bucket, 'true' if truncated else 'false', next_marker,
+                self._contents(bucket, page, delimiter, prefix)
+        ).encode('utf-8'))
+
+    def _list_objects_v2(self, bucket, query):
+        prefix = query.get('prefix') or ''
+        delimiter = query.get('delimiter')
+        max_keys = min(int(query.get('max-keys') or self.page_size),
+                       self.page_size)
+        after = query.get('start-after') or ''
+        token = query.get('continuation-token')
+        if token:
+            after = token[len('token:'):]
+        entries = self._list_entries(bucket, prefix, delimiter, after)
+        page = entries[:max_keys]
+        truncated = len(entries) > max_keys
+        next_token = ''
+        if truncated:
+            next_token = ('<NextContinuationToken>token:{0}'
+                          '</NextContinuationToken>').format(escape(page[-1]))
+        return FakeResponse(200, (
+            '<ListBucketResult xmlns="{0}"><Name>{1}</Name>'
+            '<KeyCount>{2}</KeyCount><IsTruncated>{3}</IsTruncated>{4}{5}'
+            '</ListBucketResult>').format(
+                XMLNS, bucket, len(page), 'true' if truncated else 'false',
+                next_token, self._contents(bucket, page, delimiter, prefix)
+        ).encode('utf-8'))
+
+    def _get(self, bucket, key, query, headers, body):
+        if 'uploadId' in query:
+            return self._list_parts(query)
+        if not key:
+            return self._list_objects(bucket, query)
+        data = self.objects.get((bucket, key))
+        if data is None:
+            return FakeResponse(404)
+        etag = self._etag(data)
+        if headers.get('If-None-Match') == etag:
+            return FakeResponse(304, headers={'ETag': etag})
+        if headers.get('If-Match') not in (None, etag):
+            return FakeResponse(412)
+        stored = self.object_headers.get((bucket, key), {})
+        rng = headers.get('Range')
+        if rng:
+            start, end = rng.split('=')[1].split('-')
+            start, end = int(start), min(int(end), len(data) - 1)
+            return FakeResponse(206, data[start:end + 1], dict(
+                stored, **{
+                    'ETag': etag,
+                    'Content-Length': str(end + 1 - start),
+                    'Content-Range': 'bytes {0}-{1}/{2}'.format(
+                        start, end, len(data))}))
+        return FakeResponse(200, data, dict(
+            stored, **{
+                'ETag': etag,
+                'Content-Length': str(len(data)),
+                'Last-Modified': 'Thu, 17 Nov 2005 18:49:58 GMT'}))
+
+    def _head(self, bucket, key, query, headers, body):
+        r = self._get(bucket, key, query, headers, body)
+        r.content = b''
+        r.raw = BytesIO()
+        return r
+
+    def _put(self, bucket, key, query, headers, body):
+        if 'uploadId' in query:
+            upload = self.uploads.get(query['uploadId'])
+            if upload is None:
+                return FakeResponse(404)
+            with self.lock:
+                upload['parts'][int(query['partNumber'])] = body
+            return FakeResponse(200, headers={'ETag': self._etag(body)})
+        source = headers.get('x-amz-copy-source')
+        if source:
+            from_bucket, from_key = source.lstrip('/').split('/', 1)
+            body = self.objects.get((from_bucket, from_key))
+            if body is None:
+                return FakeResponse(404)
+        with self.lock:
+            self.objects[(bucket, key)] = body
+        return FakeResponse(200, headers={'ETag': self._etag(body)})
+
+    def _delete_objects(self, bucket, headers, body):
+        md5 = base64.b64encode(hashlib.md5(body).digest()).decode('ascii')
+        if headers.get('Content-MD5') != md5:
+            return FakeResponse(400)
+        errors = []
+        for tag in ET.fromstring(body).iter('Key'):
+            if (bucket, tag.text) in self.protected:
+                errors.append(
+                    '<Error><Key>{0}</Key><Code>AccessDenied</Code>'
+                    '<Message>Access Denied</Message></Error>'.format(
+                        escape(tag.text)))
+                continue
+            with self.lock:
+                self.objects.pop((bucket, tag.text), None)
+        return FakeResponse(200, (
+            '<DeleteResult xmlns="{0}">{1}</DeleteResult>'
+        ).format(XMLNS, ''.join(errors)).encode('utf-8'))
+
+    def _post(self, bucket, key, query, headers, body):
+        if 'delete' in query:
+            return self._delete_objects(bucket, headers, body)
+        if 'uploads' in query:
+            upload_id = 'upload-{0}'.format(next(self.upload_ids))
+            self.uploads[upload_id] = {'key': key, 'parts': {},
+                                       'headers': headers}
+            return FakeResponse(200, (
+                '<InitiateMultipartUploadResult xmlns="{0}">'
+                '<UploadId>{1}</UploadId>'
+                '</InitiateMultipartUploadResult>'
+            ).format(XMLNS, upload_id).encode('utf-8'))
+        if 'uploadId' in query:
+            upload = self.uploads.pop(query['uploadId'])
+            parts = upload['parts']
+            self.objects[(bucket, key)] = b''.join(
+                parts[n] for n in sorted(parts))
+            return FakeResponse(200)
+        return FakeResponse(400)
+
+    def _delete(self, bucket, key, query, headers, body):
+        if 'uploadId' in query:
+            self.uploads.pop(query['uploadId'], None)
+            return FakeResponse(204)
+        with self.lock:
+            self.objects.pop((bucket, key), None)
+        return FakeResponse(204)
+
+    def close(self):
+        pass
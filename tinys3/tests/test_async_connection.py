@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import socket
+import unittest
+from io import BytesIO
+
+import aiohttp
+from aiohttp import web
+from aiohttp.abc import AbstractResolver
+from aiohttp.test_utils import TestServer
+from flexmock import flexmock
+from tinys3 import AsyncConnection
+from tinys3.auth import SignableRequest
+from .fake_adapter import FakeS3Adapter
+from .test_conn import TEST_SECRET_KEY, TEST_ACCESS_KEY
+
+
+class MockResponse(object):
+    """
+    A minimal stand-in for an aiohttp response. Like aiohttp, a released
+    response can't be read again.
+    """
+
+    def __init__(self, content=b''):
+        self._body = content
+        self._released = False
+
+    async def read(self):
+        if self._released:
+            raise aiohttp.ClientConnectionError("Connection closed")
+        return self._body
+
+    def release(self):
+        self._released = True
+
+    def raise_for_status(self):
+        pass
+
+
+class MockSession(object):
+    """
+    Records the requests it gets, and answers with the given responses
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    async def request(self, method, url, params=None, headers=None,
+                      data=None):
+        self.calls.append((method, url, params, headers, data))
+        return self.responses.pop(0) if self.responses else MockResponse()
+
+
+class TestAsyncConnection(unittest.TestCase):
+    def setUp(self):
+        self.conn = AsyncConnection(TEST_ACCESS_KEY, TEST_SECRET_KEY,
+                                    default_bucket='bucket', tls=True)
+
+    def _mock_session(self, *responses):
+        session = MockSession(*responses)
+        flexmock(self.conn).should_receive('adapter').and_return(session)
+        return session
+
+    def _run(self, coro):
+        return asyncio.run(coro)
+
+    def test_get(self):
+        """
+        Test that get requests are signed and sent through the session
+        """
+        session = self._mock_session(MockResponse(b'data'))
+
+        async def get():
+            r = await self.conn.get('key_to_get')
+            return await r.read()
+
+        self.assertEqual(self._run(get()), b'data')
+        method, url, params, headers, data = session.calls[0]
+        self.assertEqual(method, 'GET')
+        self.assertEqual(url, 'https://bucket.s3.amazonaws.com/key_to_get')
+        self.assertTrue(headers['Authorization'].startswith(
+            'AWS {0}:'.format(TEST_ACCESS_KEY)))
+        self.assertTrue('Date' in headers)
+
+    def test_upload(self):
+        """
+        Test that uploads set the length and the upload headers
+        """
+        session = self._mock_session()
+        f = BytesIO(b'DUMMY_DATA')
+
+        self._run(self.conn.upload('test_zip_key.zip', f, expires=1337))
+
+        method, url, params, headers, data = session.calls[0]
+        self.assertEqual(method, 'PUT')
+        self.assertEqual(headers['Content-Length'], '10')
+        self.assertEqual(headers['Content-Type'], 'application/zip')
+        self.assertEqual(headers['Cache-Control'], 'max-age=1337, public')
+        self.assertEqual(headers['x-amz-acl'], 'public-read')
+        self.assertTrue(data is f)
+
+    def test_list(self):
+        """
+        Test paginating through a listing with an async iterator
+        """
+        page = """<?xml version="1.0" encoding="UTF-8"?>
+            <ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">
+                <IsTruncated>{0}</IsTruncated>
+                <Contents>
+                    <Key>{1}</Key>
+                    <LastModified>2013-10-31T15:38:32.000Z</LastModified>
+                    <ETag>&quot;d41d8cd98f00b204e9800998ecf8427e&quot;</ETag>
+                    <Size>0</Size>
+                    <StorageClass>STANDARD</StorageClass>
+                </Contents>
+            </ListBucketResult>"""
+        session = self._mock_session(
+            MockResponse(page.format('true', 'prefix/file1').encode('utf-8')),
+            MockResponse(page.format('false', 'prefix/file2').encode('utf-8')))
+
+        async def collect():
+            return [f['key'] async for f in self.conn.list('prefix')]
+
+        self.assertEqual(self._run(collect()), ['prefix/file1', 'prefix/file2'])
+        self.assertEqual(session.calls[0][2],
+                         {'prefix': 'prefix', 'marker': ''})
+        self.assertEqual(session.calls[1][2],
+                         {'prefix': 'prefix', 'marker': 'prefix/file1'})
+
+    def test_signature_matches_blocking_connection(self):
+        """
+        Test that both paths sign requests identically
+        """
+        session = self._mock_session()
+        flexmock(self.conn.auth).should_receive('_get_date').and_return(
+            'Thu, 17 Nov 2005 18:49:58 GMT')
+
+        self._run(self.conn.delete('key_to_delete'))
+
+        headers = session.calls[0][3]
+        request = flexmock(method='DELETE',
+                           url='https://bucket.s3.amazonaws.com/key_to_delete',
+                           headers={})
+        self.conn.auth(request)
+        self.assertEqual(headers['Authorization'],
+                         request.headers['Authorization'])
+
+    def test_context_managers(self):
+        """
+        Test that the session is closed by async with, and that the methods
+        of Connection that aren't coroutines fail clearly
+        """
+        closed = []
+
+        class Session(MockSession):
+            async def close(self):
+                closed.append(True)
+
+        async def use():
+            async with self.conn as conn:
+                conn.session = Session()
+                await conn.delete('key')
+
+        self._run(use())
+        self.assertEqual(closed, [True])
+        self.assertEqual(self.conn.session, None)
+
+        with self.assertRaises(TypeError):
+            with self.conn:
+                pass
+        self.assertRaises(NotImplementedError, self.conn.get_many, ['key'])
+        self.assertRaises(NotImplementedError, self.conn.list_v2)
+
+
+class LocalResolver(AbstractResolver):
+    """
+    Resolves every host (e.g. bucket.s3.local) to the local test server
+    """
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        return [{'hostname': host, 'host': '127.0.0.1', 'port': port,
+                 'family': socket.AF_INET, 'proto': 0,
+                 'flags': socket.AI_NUMERICHOST}]
+
+    async def close(self):
+        pass
+
+
+class TestAsyncConnectionServer(unittest.TestCase):
+    """
+    Runs the requests of an AsyncConnection through a real aiohttp session,
+    against a local server backed by a FakeS3Adapter, that rejects the
+    requests whose signature doesn't match what it received
+    """
+
+    def setUp(self):
+        self.s3 = FakeS3Adapter()
+        self.s3.page_size = 1
+
+    async def _handle(self, request):
+        url = 'http://{0}{1}'.format(request.host, request.path_qs)
+        headers = dict(request.headers)
+        signature = headers.pop('Authorization', None)
+        signed = SignableRequest(request.method, url, dict(headers))
+        self.conn.auth(signed)
+        if signed.headers['Authorization'] != signature:
+            return web.Response(status=403, body=b'SignatureDoesNotMatch')
+        r = self.s3.request(request.method, url, headers=headers,
+                            data=await request.read())
+        return web.Response(status=r.status_code, body=r.content,
+                            headers=dict(r.headers))
+
+    def _run(self, test):
+        async def run():
+            app = web.Application()
+            app.router.add_route('*', '/{key:.*}', self._handle)
+            async with TestServer(app) as server:
+                self.conn = AsyncConnection(
+                    TEST_ACCESS_KEY, TEST_SECRET_KEY,
+                    default_bucket='bucket',
+                    endpoint='s3.local:{0}'.format(server.port))
+                self.conn.session = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(resolver=LocalResolver()))
+                async with self.conn:
+                    return await test(self.conn)
+        return asyncio.run(run())
+
+    def test_get_and_list(self):
+        """
+        Test reading a key, copying it and paginating through a listing
+        """
+        self.s3.objects[('bucket', 'prefix/file1')] = b'data'
+        self.s3.objects[('bucket', 'prefix/file2')] = b''
+
+        async def test(conn):
+            await conn.copy('prefix/file1', 'bucket', 'other/file1')
+            r = await conn.get('prefix/file1')
+            return (await r.read(),
+                    [f['key'] async for f in conn.list('prefix/')])
+
+        self.assertEqual(self._run(test),
+                         (b'data', ['prefix/file1', 'prefix/file2']))
+        self.assertEqual(self.s3.objects[('bucket', 'other/file1')], b'data')
+
+    def test_multipart_upload(self):
+        """
+        Test initiating a multipart upload, uploading a part and listing it
+        """
+        async def test(conn):
+            mp = await conn.initiate_multipart_upload('big')
+            await mp.upload_part_from_file(BytesIO(b'part'), 1)
+            return [p['part_number'] async for p in mp.list_parts()]
+
+        self.assertEqual(self._run(test), [1])
+        self.assertEqual(self.s3.uploads['upload-1']['parts'], {1: b'part'})
+
+    def test_complete_from_recorded_parts(self):
+        """
+        Test that the ETags of the uploaded parts are recorded, and that the
+        upload is completed without listing its parts
+        """
+        async def test(conn):
+            mp = await conn.initiate_multipart_upload('big')
+            await mp.upload_part_from_file(BytesIO(b'12'), 1)
+            await mp.upload_part_from_file(BytesIO(b'34'), 2)
+            await mp.complete_upload()
+            return mp.parts
+
+        parts = self._run(test)
+        self.assertEqual(sorted(parts), [1, 2])
+        self.assertEqual(parts[2], self.s3._etag(b'34'))
+        self.assertEqual([c[0] for c in self.s3.calls],
+                         ['POST', 'PUT', 'PUT', 'POST'])
+        self.assertEqual(self.s3.objects[('bucket', 'big')], b'1234')
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import threading
+import unittest
+from io import BytesIO
+from requests.exceptions import HTTPError
+from tinys3 import Connection, Pool
+from tinys3.request_factory import PathUploadRequest
+from .fake_adapter import FakeS3Adapter, FakeResponse
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        """
+        Create a connection to a fake S3, holding a few keys
+        """
+        self.conn = Connection("TEST_ACCESS_KEY", "TEST_SECRET_KEY", tls=True,
+                               default_bucket='bucket')
+        self.s3 = self.conn.session = FakeS3Adapter()
+        for i in range(20):
+            key = 'key{0:02d}'.format(i)
+            self.s3.objects[('bucket', key)] = key.encode('utf-8')
+
+    def test_get_many(self):
+        """
+        Test getting keys with a window of requests in flight
+        """
+        keys = ['key{0:02d}'.format(i) for i in range(20)] + ['missing']
+        results = dict(self.conn.get_many(keys, max_in_flight=4))
+
+        self.assertEqual(sorted(results), sorted(keys))
+        self.assertEqual(results['key07'].content, b'key07')
+        self.assertTrue(isinstance(results['missing'], HTTPError))
+
+    def test_get_many_ordered(self):
+        """
+        Test that ordered results keep the order of the keys
+        """
+        keys = ['key{0:02d}'.format(i) for i in reversed(range(20))]
+        results = list(self.conn.get_many(keys, ordered=True,
+                                          max_in_flight=3))
+        self.assertEqual([k for k, r in results], keys)
+        self.assertEqual([r.content for k, r in results],
+                         [k.encode('utf-8') for k in keys])
+
+    def test_get_many_window(self):
+        """
+        Test that the keys are consumed lazily
+        """
+        consumed = []
+
+        def keys():
+            for i in range(20):
+                consumed.append(i)
+                yield 'key{0:02d}'.format(i)
+
+        results = self.conn.get_many(keys(), max_in_flight=4, ordered=True)
+        next(results)
+        self.assertTrue(len(consumed) <= 5)
+        results.close()
+
+    def test_get_many_pool(self):
+        """
+        Test that pools run the batches in their workers
+        """
+        pool = Pool("TEST_ACCESS_KEY", "TEST_SECRET_KEY",
+                    default_bucket='bucket')
+        pool.session = self.s3
+        with pool:
+            results = dict(pool.get_many(['key01', 'key02']))
+        self.assertEqual(results['key02'].content, b'key02')
+
+    def test_get_many_pool_duplicates(self):
+        """
+        Test that duplicate keys sharing a single flight get a result each
+        """
+        pool = Pool("TEST_ACCESS_KEY", "TEST_SECRET_KEY",
+                    default_bucket='bucket', size=1)
+        pool.session = self.s3
+        with pool:
+            results = list(pool.get_many(['key01'] * 3 + ['key02']))
+        self.assertEqual(sorted(k for k, r in results),
+                         ['key01', 'key01', 'key01', 'key02'])
+        self.assertEqual(set(r.content for k, r in results),
+                         set([b'key01', b'key02']))
+
+    def test_upload_many(self):
+        """
+        Test uploading file objects and paths
+        """
+        fd, path = tempfile.mkstemp()
+        os.write(fd, b'FROM_PATH')
+        os.close(fd)
+        try:
+            items = [('a', BytesIO(b'AAA')),
+                     ('b', path),
+                     ('c.json', BytesIO(b'{}'), {'x-amz-meta-a': 'b'})]
+            results = dict(self.conn.upload_many(items,
+                                                  max_in_flight_bytes=4))
+        finally:
+            os.remove(path)
+
+        self.assertEqual(sorted(results), ['a', 'b', 'c.json'])
+        self.assertEqual(self.s3.objects[('bucket', 'a')], b'AAA')
+        self.assertEqual(self.s3.objects[('bucket', 'b')], b'FROM_PATH')
+        headers = [c[4] for c in self.s3.calls if c[2] == 'c.json'][0]
+        self.assertEqual(headers['x-amz-meta-a'], 'b')
+        self.assertEqual(headers['Content-Type'], 'application/json')
+
+    def test_upload_many_lazy_open(self):
+        """
+        Test that paths are only opened by the uploads that run
+        """
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        runs = []
+        run = PathUploadRequest.run
+
+        def record_run(request):
+            done = threading.Event()
+            runs.append(done)
+            try:
+                return run(request)
+            finally:
+                done.set()
+
+        PathUploadRequest.run = record_run
+        self.addCleanup(setattr, PathUploadRequest, 'run', run)
+        try:
+            results = self.conn.upload_many(
+                [('a', path + '.missing')] + [('b', path)] * 50,
+                max_in_flight=2, ordered=True)
+            key, r = next(results)
+            self.assertTrue(isinstance(r, IOError))
+            results.close()
+            # Only the uploads in flight ran, wait until they're done
+            self.assertTrue(len(runs) <= 3)
+            for done in list(runs):
+                done.wait(5)
+            if os.path.isdir('/proc/self/fd'):
+                opened = []
+                for name in os.listdir('/proc/self/fd'):
+                    try:
+                        opened.append(os.readlink('/proc/self/fd/' + name))
+                    except OSError:
+                        # The descriptor of the listing itself
+                        pass
+                self.assertFalse(path in opened)
+        finally:
+            os.remove(path)
+
+    def test_upload_many_errors(self):
+        """
+        Test that failed uploads are reported per key
+        """
+        results = dict(self.conn.upload_many([('a', BytesIO(b'AAA'))],
+                                             bucket='bucket'))
+        self.assertEqual(results['a'].status_code, 200)
+
+        self.s3._put = lambda *args: FakeResponse(500)
+        results = dict(self.conn.upload_many([('a', BytesIO(b'AAA'))]))
+        self.assertTrue(isinstance(results['a'], HTTPError))
+
+    def test_delete_many(self):
+        """
+        Test deleting keys in batches of 1000 keys
+        """
+        keys = ['old/{0:04d}'.format(i) for i in range(2500)]
+        for key in keys:
+            self.s3.objects[('bucket', key)] = b'DATA'
+        self.s3.protected.add(('bucket', 'old/1234'))
+
+        r = self.conn.delete_many(iter(keys))
+
+        self.assertEqual(r['deleted'], 2499)
+        self.assertEqual(r['errors'], [{'key': 'old/1234',
+                                        'code': 'AccessDenied',
+                                        'message': 'Access Denied'}])
+        self.assertEqual([k for b, k in self.s3.objects
+                          if k.startswith('old/')], ['old/1234'])
+        posts = [c for c in self.s3.calls if c[0] == 'POST']
+        self.assertEqual(len(posts), 3)
+        self.assertTrue('delete' in posts[0][3])
+
+    def test_delete_many_failed_batch(self):
+        """
+        Test that the keys of failed requests are reported
+        """
+        self.s3._post = lambda *args: FakeResponse(503)
+        r = self.conn.delete_many(['key01', 'key02'])
+        self.assertEqual(r['deleted'], 0)
+        self.assertEqual([e['key'] for e in r['errors']], ['key01', 'key02'])
+
+    def test_delete_prefix(self):
+        """
+        Test deleting the keys of a prefix while it's listed
+        """
+        for i in range(2500):
+            self.s3.objects[('bucket', 'old/{0:04d}'.format(i))] = b'DATA'
+        self.s3.protected.add(('bucket', 'old/0007'))
+        self.s3.page_size = 700
+
+        r = self.conn.delete_prefix('old/')
+
+        self.assertEqual(r['deleted'], 2499)
+        self.assertEqual([e['key'] for e in r['errors']], ['old/0007'])
+        self.assertEqual(len(self.s3.objects), 21)
+        # The first batch was sent before the listing was done
+        methods = [c[0] for c in self.s3.calls]
+        self.assertTrue(methods.index('POST') < len(methods) - 2)
+        self.assertEqual(methods.count('GET'), 4)
+
+        self.assertRaises(ValueError, self.conn.delete_prefix, '')
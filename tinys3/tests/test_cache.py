@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
+from tinys3 import Connection, Pool
+from tinys3.cache import DiskCache, MemoryCache
+from .fake_adapter import FakeS3Adapter
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        """
+        Create a connection to a fake S3, with a disk cache
+        """
+        self.directory = tempfile.mkdtemp()
+        self.cache = DiskCache(self.directory)
+        self.conn = Connection("TEST_ACCESS_KEY", "TEST_SECRET_KEY", tls=True,
+                               default_bucket='bucket',
+                               disk_cache=self.cache)
+        self.s3 = self.conn.session = FakeS3Adapter()
+        self.s3.objects[('bucket', 'key')] = b'DUMMY_DATA'
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_revalidation(self):
+        """
+        Test that cached keys are revalidated with conditional GETs
+        """
+        r = self.conn.get('key')
+        self.assertEqual(r.content, b'DUMMY_DATA')
+        self.assertFalse(getattr(r, 'from_cache', False))
+
+        r = self.conn.get('key')
+        self.assertEqual(r.content, b'DUMMY_DATA')
+        self.assertTrue(r.from_cache)
+        self.assertEqual(r.headers['Last-Modified'],
+                         'Thu, 17 Nov 2005 18:49:58 GMT')
+        self.assertEqual(self.s3.calls[1][4]['If-None-Match'],
+                         r.headers['ETag'])
+
+        # Modified keys are fetched again
+        self.s3.objects[('bucket', 'key')] = b'NEW_DATA'
+        r = self.conn.get('key')
+        self.assertEqual(r.content, b'NEW_DATA')
+        self.assertEqual(self.conn.get('key').content, b'NEW_DATA')
+
+    def test_ttl(self):
+        """
+        Test that fresh keys are served without a request
+        """
+        self.cache.ttl = 60
+        self.conn.get('key')
+        self.conn.get('key')
+        self.assertEqual(len(self.s3.calls), 1)
+
+        # Requests with headers bypass the cache
+        self.conn.get('key', headers={'Range': 'bytes=0-4'})
+        self.assertEqual(len(self.s3.calls), 2)
+
+    def test_eviction(self):
+        """
+        Test that the least recently used keys are evicted
+        """
+        self.cache.max_size = 100
+        for i, key in enumerate(['a', 'b', 'c']):
+            self.cache.set('bucket', key, {'ETag': '"x"'}, b'0123456789')
+            # Make sure the access times differ
+            os.utime(self.cache._path('bucket', key), (i, i))
+        self.cache.get('bucket', 'a')
+        self.cache.set('bucket', 'd', {'ETag': '"x"'}, b'0123456789')
+
+        self.assertTrue(self.cache.get('bucket', 'a') is not None)
+        self.assertTrue(self.cache.get('bucket', 'b') is None)
+        self.assertTrue(self.cache.get('bucket', 'c') is not None)
+        self.assertTrue(self.cache.get('bucket', 'd') is not None)
+        # No temporary files are left behind
+        self.assertEqual(len(os.listdir(self.directory)), 3)
+
+    def test_shared_directory(self):
+        """
+        Test that caches of different processes see each other's entries
+        """
+        self.conn.get('key')
+        other = DiskCache(self.directory, ttl=60)
+        headers, body, fresh = other.get('bucket', 'key')
+        self.assertEqual(body, b'DUMMY_DATA')
+        self.assertTrue(fresh)
+
+        other.delete('bucket', 'key')
+        self.assertTrue(self.cache.get('bucket', 'key') is None)
+
+
+class TestMemoryCache(unittest.TestCase):
+    def setUp(self):
+        """
+        Create a connection to a fake S3, with a memory cache
+        """
+        self.cache = MemoryCache(max_size=25, max_item_size=10)
+        self.conn = Connection("TEST_ACCESS_KEY", "TEST_SECRET_KEY", tls=True,
+                               default_bucket='bucket',
+                               memory_cache=self.cache)
+        self.s3 = self.conn.session = FakeS3Adapter()
+        self.s3.objects[('bucket', 'key')] = b'DUMMY_DATA'
+
+    def test_hits(self):
+        """
+        Test that cached keys are served without any request
+        """
+        self.assertEqual(self.conn.get('key').content, b'DUMMY_DATA')
+        r = self.conn.get('key')
+        self.assertEqual(r.content, b'DUMMY_DATA')
+        self.assertTrue(r.from_cache)
+        self.assertEqual(len(self.s3.calls), 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        # Keys larger than max_item_size aren't cached
+        self.s3.objects[('bucket', 'large')] = b'x' * 11
+        self.conn.get('large')
+        self.conn.get('large')
+        self.assertEqual(len(self.s3.calls), 3)
+
+    def test_invalidation(self):
+        """
+        Test that writes through the connection invalidate the cached keys
+        """
+        self.conn.get('key')
+        self.conn.upload('key', BytesIO(b'NEW_DATA'))
+        self.assertEqual(self.conn.get('key').content, b'NEW_DATA')
+
+        self.conn.copy('key', 'bucket', 'other')
+        self.conn.get('other')
+        self.conn.delete('other')
+        self.assertEqual(len(self.cache), 1)
+
+        self.conn.update_metadata('key', {'x-amz-meta-a': 'b'})
+        self.assertEqual(len(self.cache), 0)
+
+    def test_pool_invalidation(self):
+        """
+        Test that a pool invalidates the keys once the writes are done
+        """
+        pool = Pool("TEST_ACCESS_KEY", "TEST_SECRET_KEY",
+                    default_bucket='bucket', memory_cache=self.cache)
+        pool.session = self.s3
+        with pool:
+            pool.get('key').result()
+            self.assertEqual(len(self.cache), 1)
+            # A stale copy of the key
+            self.cache.set('bucket', 'key', {'ETag': '"x"'}, b'OLD_DATA')
+            pool.upload('key', BytesIO(b'NEW_DATA')).result()
+            self.assertEqual(pool.get('key').result().content, b'NEW_DATA')
+
+    def test_eviction(self):
+        """
+        Test the LRU eviction and ttl expiry
+        """
+        for key in ['a', 'b', 'c']:
+            self.cache.set('bucket', key, {}, b'0123456789')
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertEqual(self.cache.size, 20)
+        self.assertTrue(self.cache.get('bucket', 'a') is None)
+
+        self.cache.get('bucket', 'b')
+        self.cache.set('bucket', 'd', {}, b'0123456789')
+        self.assertTrue(self.cache.get('bucket', 'b') is not None)
+        self.assertTrue(self.cache.get('bucket', 'c') is None)
+
+        self.cache.ttl = 0
+        self.assertTrue(self.cache.get('bucket', 'b') is None)
+        self.assertEqual(self.cache.size, 10)
@@ -3,7 +3,9 @@
 import unittest
 from tinys3 import Connection
 from tinys3.auth import S3Auth
+from tinys3.request_factory import GetRequest
 from flexmock import flexmock
+import requests
 
 TEST_SECRET_KEY = 'TEST_SECRET_KEY'
 TEST_ACCESS_KEY = 'TEST_ACCESS_KEY'
@@ -24,3 +26,31 @@ class TestConn(unittest.TestCase):
         self.assertEquals(self.conn.default_bucket, TEST_BUCKET)
         self.assertEquals(self.conn.tls, True)
         self.assertEquals(self.conn.endpoint, "s3.amazonaws.com")
+
+    def test_shared_session(self):
+        """
+        Test that requests are issued through the connection's keep-alive
+        session
+        """
+
+        self.assertTrue(isinstance(self.conn.session, requests.Session))
+
+        adapter = self.conn.session.get_adapter('https://bucket.s3.amazonaws.com/')
+        self.assertEquals(adapter._pool_maxsize, 10)
+
+        r = GetRequest(self.conn, 'key', TEST_BUCKET)
+        self.assertTrue(r.adapter() is self.conn.session)
+
+        conn = Connection(TEST_ACCESS_KEY, TEST_SECRET_KEY, pool_size=32)
+        adapter = conn.session.get_adapter('http://bucket.s3.amazonaws.com/')
+        self.assertEquals(adapter._pool_maxsize, 32)
+
+    def test_connection_as_context_manager(self):
+        """
+        Test that the connection closes its session upon exit
+        """
+
+        flexmock(self.conn.session).should_receive('close').once()
+
+        with self.conn:
+            pass
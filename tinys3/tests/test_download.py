@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+import gzip
+import os
+import tempfile
+import unittest
+import zipfile
+from io import BytesIO
+from requests.exceptions import HTTPError
+from tinys3 import Connection
+from .fake_adapter import FakeS3Adapter
+
+TEST_DATA = b'abcdefghijklmnopqrstuvwxyz' * 10
+
+
+class TestDownload(unittest.TestCase):
+    def setUp(self):
+        """
+        Create a connection to a fake S3, holding a single key
+        """
+        self.conn = Connection("TEST_ACCESS_KEY", "TEST_SECRET_KEY", tls=True,
+                               default_bucket='bucket')
+        self.conn.session = FakeS3Adapter()
+        self.conn.session.objects[('bucket', 'key')] = TEST_DATA
+
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_download_to_path(self):
+        """
+        Test streaming a key to a file
+        """
+        self.conn.download('key', self.path, chunk_size=7)
+
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), TEST_DATA)
+
+    def test_download_to_sink(self):
+        """
+        Test streaming a key to a file object or a callable
+        """
+        f = BytesIO()
+        self.conn.download('key', f)
+        self.assertEqual(f.getvalue(), TEST_DATA)
+
+        chunks = []
+        self.conn.download('key', chunks.append, chunk_size=100)
+        self.assertEqual([len(c) for c in chunks], [100, 100, 60])
+
+    def test_download_missing_key(self):
+        """
+        Test that failed downloads don't leave a file behind
+        """
+        os.remove(self.path)
+        self.assertRaises(HTTPError, self.conn.download, 'missing',
+                          self.path)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_iter_chunks(self):
+        """
+        Test iterating over the chunks of a key
+        """
+        chunks = list(self.conn.iter_chunks('key', chunk_size=100))
+
+        self.assertEqual(b''.join(chunks), TEST_DATA)
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(self.conn.session.calls[0][0], 'GET')
+
+    def test_ranged_download(self):
+        """
+        Test downloading a key with concurrent ranged GETs
+        """
+        self.conn.download('key', self.path, workers=3, range_size=100,
+                           chunk_size=7)
+
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), TEST_DATA)
+
+        calls = self.conn.session.calls
+        self.assertEqual(calls[0][0], 'HEAD')
+        ranges = sorted(c[4]['Range'] for c in calls[1:])
+        self.assertEqual(ranges, ['bytes=0-99', 'bytes=100-199',
+                                  'bytes=200-259'])
+        # All the ranges are fetched from the version that was HEADed
+        etags = set(c[4]['If-Match'] for c in calls[1:])
+        self.assertEqual(len(etags), 1)
+
+    def test_ranged_download_of_changed_key(self):
+        """
+        Test that ranges of a different version of the key fail the download
+        """
+        s3 = self.conn.session
+        head = s3._head
+
+        def head_then_change(*args):
+            r = head(*args)
+            s3.objects[('bucket', 'key')] = b'changed'
+            return r
+
+        s3._head = head_then_change
+        self.assertRaises(HTTPError, self.conn.download, 'key', self.path,
+                          workers=2, range_size=100)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_ranged_download_ignored_range(self):
+        """
+        Test that whole bodies sent instead of ranges fail the download
+        """
+        s3 = self.conn.session
+        get = s3._get
+
+        def ignore_range(bucket, key, query, headers, body):
+            headers = dict(headers)
+            headers.pop('Range', None)
+            return get(bucket, key, query, headers, body)
+
+        s3._get = ignore_range
+        self.assertRaises(HTTPError, self.conn.download, 'key', self.path,
+                          workers=2, range_size=100)
+        self.assertFalse(os.path.exists(self.path))
+
+        self.assertRaises(ValueError, self.conn.download, 'key', self.path,
+                          workers=2, headers={'range': 'bytes=0-9'})
+
+    def test_ranged_download_of_encoded_key(self):
+        """
+        Test that the ranges of a compressed key are written as stored
+        """
+        compressed = gzip.compress(TEST_DATA)
+        s3 = self.conn.session
+        s3.objects[('bucket', 'key.gz')] = compressed
+        s3.object_headers[('bucket', 'key.gz')] = {'Content-Encoding': 'gzip'}
+
+        self.conn.download('key.gz', self.path, workers=4, range_size=20)
+
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), compressed)
+
+    def test_get_ranges(self):
+        """
+        Test that close ranges are merged, and returned in order
+        """
+        ranges = [(200, 210), (0, 5), (8, 12), (3, 6), (100, 100), (250, 300)]
+
+        results = self.conn.get_ranges('key', ranges, gap=5)
+
+        self.assertEqual([bytes(r) for r in results],
+                         [TEST_DATA[start:end] for start, end in ranges])
+        calls = self.conn.session.calls
+        self.assertEqual(sorted(c[4]['Range'] for c in calls),
+                         ['bytes=0-11', 'bytes=200-209', 'bytes=250-299'])
+        # The spans are read from the version of the first one
+        self.assertFalse('If-Match' in calls[0][4])
+        self.assertEqual(len(set(c[4]['If-Match'] for c in calls[1:])), 1)
+
+    def test_get_ranges_of_encoded_key(self):
+        """
+        Test that the ranges of a compressed key are returned as stored
+        """
+        compressed = gzip.compress(TEST_DATA)
+        s3 = self.conn.session
+        s3.objects[('bucket', 'key.gz')] = compressed
+        s3.object_headers[('bucket', 'key.gz')] = {'Content-Encoding': 'gzip'}
+
+        results = self.conn.get_ranges('key.gz', [(10, 20), (50, 60)], gap=5)
+
+        self.assertEqual([bytes(r) for r in results],
+                         [compressed[10:20], compressed[50:60]])
+
+    def test_get_ranges_of_changed_key(self):
+        """
+        Test that spans of different versions of the key aren't mixed
+        """
+        s3 = self.conn.session
+        get = s3._get
+
+        def get_then_change(*args):
+            r = get(*args)
+            s3.objects[('bucket', 'key')] = TEST_DATA.upper()
+            return r
+
+        s3._get = get_then_change
+        self.assertRaises(HTTPError, self.conn.get_ranges, 'key',
+                          [(0, 10), (200, 210)], gap=5)
+
+
+class TestS3File(unittest.TestCase):
+    def setUp(self):
+        self.conn = Connection("TEST_ACCESS_KEY", "TEST_SECRET_KEY", tls=True,
+                               default_bucket='bucket')
+        self.conn.session = FakeS3Adapter()
+        self.conn.session.objects[('bucket', 'key')] = TEST_DATA
+        self.s3 = self.conn.session
+
+    def _ranges(self):
+        return [c[4]['Range'] for c in self.s3.calls if c[0] == 'GET']
+
+    def test_random_reads(self):
+        """
+        Test seeking and reading, with the blocks served from the cache
+        """
+        f = self.conn.open('key', block_size=10)
+
+        self.assertEqual(f.size, len(TEST_DATA))
+        f.seek(105)
+        self.assertEqual(f.read(10), TEST_DATA[105:115])
+        self.assertEqual(f.tell(), 115)
+        f.seek(-5, os.SEEK_END)
+        self.assertEqual(f.read(), TEST_DATA[-5:])
+        f.seek(107)
+        self.assertEqual(f.read(2), TEST_DATA[107:109])
+
+        # The second block is sequential, so the third one is read ahead
+        self.assertEqual(self._ranges(), ['bytes=100-109', 'bytes=110-129',
+                                          'bytes=250-259'])
+
+    def test_sequential_read_ahead(self):
+        """
+        Test that sequential reads fetch more and more blocks at once
+        """
+        f = self.conn.open('key', block_size=10)
+
+        self.assertEqual(f.read(), TEST_DATA)
+        self.assertEqual(self._ranges(), [
+            'bytes=0-9', 'bytes=10-29', 'bytes=30-79', 'bytes=80-169',
+            'bytes=170-259'])
+
+    def test_ignored_range(self):
+        """
+        Test that whole bodies sent instead of blocks fail the reads
+        """
+        get = self.s3._get
+
+        def ignore_range(bucket, key, query, headers, body):
+            headers = dict(headers)
+            headers.pop('Range', None)
+            return get(bucket, key, query, headers, body)
+
+        self.s3._get = ignore_range
+        f = self.conn.open('key', block_size=10)
+        f.seek(105)
+        self.assertRaises(HTTPError, f.read, 10)
+
+    def test_encoded_key(self):
+        """
+        Test that the blocks of a compressed key are read as stored
+        """
+        compressed = gzip.compress(TEST_DATA)
+        self.s3.objects[('bucket', 'key.gz')] = compressed
+        self.s3.object_headers[('bucket', 'key.gz')] = {
+            'Content-Encoding': 'gzip'}
+
+        f = self.conn.open('key.gz', block_size=10)
+        f.seek(15)
+        self.assertEqual(f.read(20), compressed[15:35])
+
+    def test_readline(self):
+        """
+        Test reading lines
+        """
+        self.s3.objects[('bucket', 'lines')] = b'first\nsecond\nthird'
+        f = self.conn.open('lines', block_size=4)
+
+        self.assertEqual(f.readline(), b'first\n')
+        self.assertEqual(list(f), [b'second\n', b'third'])
+
+    def test_zipfile(self):
+        """
+        Test reading an archive without downloading all of it
+        """
+        buf = BytesIO()
+        with zipfile.ZipFile(buf, 'w') as z:
+            z.writestr('small.txt', b'small')
+            z.writestr('big.bin', os.urandom(50000))
+        self.s3.objects[('bucket', 'archive.zip')] = buf.getvalue()
+
+        with self.conn.open('archive.zip', block_size=1024) as f:
+            with zipfile.ZipFile(f) as z:
+                self.assertEqual(z.read('small.txt'), b'small')
+
+        # The content of the big file is never fetched
+        ranges = [r.split('=')[1].split('-') for r in self._ranges()]
+        fetched = sum(int(end) - int(start) + 1 for start, end in ranges)
+        self.assertTrue(fetched < 10000)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import threading
+import unittest
+from io import BytesIO
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from httplib import HTTPException
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from http.client import HTTPException
+
+from requests.exceptions import HTTPError
+from tinys3 import Connection
+from tinys3.http_transport import HTTPClientAdapter
+from tinys3.request_factory import GetRequest, UploadRequest
+from .test_conn import TEST_SECRET_KEY, TEST_ACCESS_KEY
+
+
+class S3Handler(BaseHTTPRequestHandler):
+    """
+    A tiny keep-alive server, storing the bodies it gets by path
+    """
+    protocol_version = 'HTTP/1.1'
+    store = {}
+    requests = []
+    drop = []
+
+    def _reply(self, status, body=b''):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.requests.append((self.command, self.path, dict(self.headers),
+                              self.client_address))
+        if self._drop():
+            return
+        if self.path in self.store:
+            self._reply(200, self.store[self.path])
+        else:
+            self._reply(404)
+
+    def do_PUT(self):
+        self.requests.append((self.command, self.path, dict(self.headers),
+                              self.client_address))
+        length = int(self.headers['Content-Length'])
+        self.store[self.path] = self.rfile.read(length)
+        self._reply(200)
+
+    def do_POST(self):
+        self.requests.append((self.command, self.path, dict(self.headers),
+                              self.client_address))
+        self.rfile.read(int(self.headers['Content-Length']))
+        if self._drop():
+            return
+        self._reply(200)
+
+    def _drop(self):
+        """
+        Closes the connection without answering the requests of the paths
+        in `drop`, like a server losing the response after processing the
+        request
+        """
+        if self.path in self.drop:
+            self.drop.remove(self.path)
+            self.close_connection = True
+            return True
+        return False
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHTTPClientAdapter(unittest.TestCase):
+    def setUp(self):
+        S3Handler.store = {}
+        S3Handler.requests = []
+        S3Handler.drop = []
+        self.server = HTTPServer(('127.0.0.1', 0), S3Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{0}'.format(self.server.server_port)
+
+        self.conn = Connection(TEST_ACCESS_KEY, TEST_SECRET_KEY,
+                               transport='http.client')
+        self.adapter = self.conn.session
+
+    def tearDown(self):
+        self.adapter.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_transport_selection(self):
+        """
+        Test that requests use the adapter of the connection
+        """
+        self.assertTrue(isinstance(self.adapter, HTTPClientAdapter))
+        r = GetRequest(self.conn, 'key', 'bucket')
+        self.assertTrue(r.adapter() is self.adapter)
+
+        self.assertRaises(ValueError, Connection, TEST_ACCESS_KEY,
+                          TEST_SECRET_KEY, transport='carrier-pigeon')
+
+    def test_put_and_get(self):
+        """
+        Test signed requests, bodies and params over a kept-alive connection
+        """
+        r = self.adapter.put(self.url + '/key', data=BytesIO(b'DUMMY_DATA'),
+                             headers={'Content-Type': 'text/plain'},
+                             auth=self.conn.auth)
+        r.raise_for_status()
+
+        r = self.adapter.get(self.url + '/key', auth=self.conn.auth,
+                             params={'a': 'b', 'skipped': None})
+        self.assertEqual(r.status_code, 404)
+        self.assertRaises(HTTPError, r.raise_for_status)
+
+        r = self.adapter.get(self.url + '/key', auth=self.conn.auth)
+        self.assertEqual(r.content, b'DUMMY_DATA')
+
+        put, get_with_params, get = S3Handler.requests
+        self.assertEqual(put[2]['Content-Length'], '10')
+        self.assertTrue(put[2]['Authorization'].startswith(
+            'AWS {0}:'.format(TEST_ACCESS_KEY)))
+        self.assertEqual(get_with_params[1], '/key?a=b')
+        # All the requests went through the same connection
+        self.assertEqual(len(set(req[3] for req in S3Handler.requests)), 1)
+
+    def test_streamed_response(self):
+        """
+        Test reading a response body in chunks
+        """
+        S3Handler.store['/key'] = b'x' * 100
+
+        r = self.adapter.get(self.url + '/key', stream=True)
+        self.assertEqual(b''.join(r.iter_content(30)), b'x' * 100)
+
+        # The connection was released and is reused
+        r = self.adapter.get(self.url + '/key')
+        self.assertEqual(len(set(req[3] for req in S3Handler.requests)), 1)
+
+    def test_lost_response(self):
+        """
+        Test that only idempotent requests are sent again when the response
+        is lost on a kept-alive connection
+        """
+        S3Handler.store['/key'] = b'DATA'
+        self.adapter.get(self.url + '/key')
+
+        S3Handler.drop = ['/key']
+        r = self.adapter.get(self.url + '/key')
+        self.assertEqual(r.content, b'DATA')
+        self.assertEqual([req[0] for req in S3Handler.requests],
+                         ['GET', 'GET', 'GET'])
+
+        S3Handler.drop = ['/key?uploads']
+        self.assertRaises((HTTPException, IOError, OSError),
+                          self.adapter.post, self.url + '/key?uploads',
+                          data=b'')
+        self.assertEqual([req[0] for req in S3Handler.requests[3:]],
+                         ['POST'])
+
+    def test_upload_request(self):
+        """
+        Test that the request classes work on the adapter
+        """
+        r = UploadRequest(self.conn, 'upload_key', BytesIO(b'DUMMY'),
+                          'bucket')
+        r.bucket_url = lambda key, bucket: self.url + '/' + key
+
+        r.run()
+
+        self.assertEqual(S3Handler.store['/upload_key'], b'DUMMY')
+        headers = S3Handler.requests[0][2]
+        self.assertEqual(headers['x-amz-acl'], 'public-read')
+        self.assertEqual(headers['Content-Type'], 'application/octet-stream')
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
+from tinys3 import Connection, Pool
+from tinys3.index import BucketIndex
+from .fake_adapter import FakeS3Adapter
+
+
+class TestBucketIndex(unittest.TestCase):
+    def setUp(self):
+        """
+        Create a connection to a fake S3, and an index of its 'logs/' prefix
+        """
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'index.db')
+        self.index = BucketIndex(self.path, 'bucket', 'logs/')
+        self.conn = Connection("TEST_ACCESS_KEY", "TEST_SECRET_KEY", tls=True,
+                               default_bucket='bucket', index=self.index)
+        self.s3 = self.conn.session = FakeS3Adapter()
+        self.s3.page_size = 10
+        for d in 'abc':
+            for i in range(20):
+                key = 'logs/{0}/{1:02d}'.format(d, i)
+                self.s3.objects[('bucket', key)] = b'x' * i
+        self.s3.objects[('bucket', 'other/1')] = b'DATA'
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.dir)
+
+    def test_refresh(self):
+        """
+        Test populating and querying the index
+        """
+        self.assertTrue(self.index.refresh(self.conn))
+        self.assertEqual(len(self.s3.calls), 6)
+
+        self.assertTrue(self.index.exists('logs/b/07'))
+        self.assertFalse(self.index.exists('logs/b/20'))
+        self.assertFalse(self.index.exists('other/1'))
+        self.assertEqual(self.index.count(), 60)
+        self.assertEqual(self.index.count('logs/b/'), 20)
+        self.assertEqual(self.index.count('logs/b/1'), 10)
+        self.assertEqual(self.index.size('logs/a/'), sum(range(20)))
+        self.assertEqual(self.index.size('nothing/'), 0)
+
+        files = list(self.index.list('logs/c'))
+        self.assertEqual([f['key'] for f in files],
+                         ['logs/c/{0:02d}'.format(i) for i in range(20)])
+        self.assertEqual(files[3], self.index.get('logs/c/03'))
+        self.assertEqual(files[3]['size'], 3)
+        self.assertEqual(files[3]['etag'], hashlib.md5(b'xxx').hexdigest())
+        self.assertEqual(self.index.get('logs/c/20'), None)
+        self.assertTrue(self.index.refreshed is not None)
+        self.assertEqual(len(self.s3.calls), 6)
+
+    def test_resume(self):
+        """
+        Test that an interrupted refresh resumes from its marker, and that
+        a complete refresh removes the keys that are gone
+        """
+        self.index.refresh(self.conn)
+        del self.s3.objects[('bucket', 'logs/a/05')]
+        del self.s3.objects[('bucket', 'logs/c/19')]
+        self.s3.calls = []
+
+        self.assertFalse(self.index.refresh(self.conn, max_pages=2))
+        self.assertEqual(self.index.marker, 'logs/b/00')
+        self.index.close()
+
+        self.index = BucketIndex(self.path, 'bucket', 'logs/')
+        self.assertTrue(self.index.refresh(self.conn))
+        self.assertEqual([c[3]['marker'] for c in self.s3.calls],
+                         ['', 'logs/a/10', 'logs/b/00', 'logs/b/10',
+                          'logs/c/00', 'logs/c/10'])
+        self.assertEqual(self.index.marker, None)
+        self.assertEqual(self.index.count(), 58)
+        self.assertFalse(self.index.exists('logs/a/05'))
+        self.assertFalse(self.index.exists('logs/c/19'))
+
+    def test_other_prefix(self):
+        """
+        Test that an index can't be reopened for another prefix
+        """
+        self.assertRaises(ValueError, BucketIndex, self.path, 'bucket',
+                          'other/')
+
+    def test_writes(self):
+        """
+        Test that the writes of the connection update the index
+        """
+        self.index.refresh(self.conn)
+
+        self.conn.upload('logs/d/00', BytesIO(b'12345'))
+        self.conn.upload('other/2', BytesIO(b'12345'))
+        self.conn.copy('logs/a/10', 'bucket', 'logs/d/01')
+        self.conn.delete('logs/a/00')
+        self.conn.delete_many(['logs/b/{0:02d}'.format(i) for i in range(5)])
+        results = dict(self.conn.upload_many([('logs/e', BytesIO(b'123'))]))
+        self.assertEqual(results['logs/e'].status_code, 200)
+
+        self.assertEqual(self.index.get('logs/d/00')['size'], 5)
+        self.assertEqual(self.index.get('logs/d/00')['etag'],
+                         hashlib.md5(b'12345').hexdigest())
+        self.assertEqual(self.index.get('logs/d/01')['size'], 10)
+        self.assertEqual(self.index.get('logs/e')['size'], 3)
+        self.assertFalse(self.index.exists('logs/a/00'))
+        self.assertFalse(self.index.exists('other/2'))
+        self.assertEqual(self.index.count('logs/b/'), 15)
+        self.assertEqual(self.index.count(), 60 - 6 + 3)
+
+        # The keys written through the connection survive the next refresh
+        self.index.refresh(self.conn)
+        self.assertEqual(self.index.count(), 57)
+
+    def test_upload_many_duplicates(self):
+        """
+        Test that every upload of a key is recorded with its own size
+        """
+        items = [('logs/u1', BytesIO(b'a')), ('logs/u1', BytesIO(b'bb'))]
+        list(self.conn.upload_many(items, max_in_flight=1, ordered=True))
+        f = self.index.get('logs/u1')
+        self.assertEqual(f['size'], 2)
+        self.assertEqual(f['etag'], hashlib.md5(b'bb').hexdigest())
+
+    def test_pool_writes(self):
+        """
+        Test that the writes of a pool update the index once they succeed
+        """
+        pool = Pool("TEST_ACCESS_KEY", "TEST_SECRET_KEY",
+                    default_bucket='bucket', index=self.index)
+        pool.session = self.s3
+        with pool:
+            pool.upload('logs/d/00', BytesIO(b'12345')).result()
+            pool.delete('logs/missing').result()
+        self.assertEqual(self.index.size('logs/d/'), 5)
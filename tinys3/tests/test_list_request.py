@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 import datetime
+import threading
 import unittest
+from io import BytesIO
 from flexmock import flexmock
 from tinys3.request_factory import ListRequest
+from tinys3.listing import parse_timestamp
 from tinys3 import Connection
+from .fake_adapter import FakeS3Adapter
 
 
 class TestNonUploadRequests(unittest.TestCase):
@@ -51,9 +55,11 @@ class TestNonUploadRequests(unittest.TestCase):
             # 'https://s3.amazonaws.com/bucket/',
             auth=self.conn.auth,
             params={'prefix': 'prefix', 'marker': marker},
+            stream=True,
         ).and_return(flexmock(
             raise_for_status=lambda: None,
-            content="""
+            close=lambda: None,
+            raw=BytesIO("""
                 <?xml version="1.0" encoding="UTF-8"?>
                 <ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">
                     <Name>bucket</Name>
@@ -67,7 +73,7 @@ class TestNonUploadRequests(unittest.TestCase):
                 marker,
                 'true' if truncated else 'false',
                 files,
-            ).strip().encode('utf-8'),
+            ).strip().encode('utf-8')),
         )).once()
 
     def test_simple_list_request(self):
@@ -86,3 +92,219 @@ class TestNonUploadRequests(unittest.TestCase):
         self.setup_adapter('prefix/file1', self.files[1], False)
 
         self.assertEquals(list(self.r.run()), self.parsed_files)
+
+
+class FakeBucketTestCase(unittest.TestCase):
+    def setUp(self):
+        """
+        Create a connection to a fake S3, holding keys in a few "folders"
+        """
+        self.conn = Connection("TEST_ACCESS_KEY", "TEST_SECRET_KEY", tls=True,
+                               default_bucket='bucket')
+        self.s3 = self.conn.session = FakeS3Adapter()
+        self.s3.page_size = 7
+        self.keys = ['logs/{0}/{1:02d}'.format(d, i)
+                     for d in 'abcd' for i in range(20)]
+        self.keys += ['logs/b.txt', 'logs/z.txt', 'other/1']
+        for key in self.keys:
+            self.s3.objects[('bucket', key)] = b'DATA'
+        self.keys.sort()
+
+
+class TestParallelList(FakeBucketTestCase):
+    def test_delimiter(self):
+        """
+        Test the common prefixes of a listing with a delimiter
+        """
+        r = ListRequest(self.conn, 'logs/', 'bucket', delimiter='/')
+        self.assertEqual([p.get('key', p.get('prefix')) for p in r],
+                         ['logs/b.txt', 'logs/z.txt', 'logs/a/', 'logs/b/',
+                          'logs/c/', 'logs/d/'])
+        self.assertEqual(self.s3.calls[0][3]['delimiter'], '/')
+
+    def test_sharded_by_prefixes(self):
+        """
+        Test listing the common prefixes concurrently
+        """
+        logs = [k for k in self.keys if k.startswith('logs/')]
+        files = list(self.conn.list_parallel('logs/', workers=2,
+                                             ordered=True))
+        self.assertEqual([f['key'] for f in files], logs)
+        self.assertEqual(files[0]['size'], 4)
+
+        files = self.conn.list_parallel('logs/', workers=3)
+        self.assertEqual(sorted(f['key'] for f in files), logs)
+
+    def test_sharded_by_split_points(self):
+        """
+        Test listing between split points concurrently
+        """
+        files = self.conn.list_parallel(split_points=['logs/b/05', 'logs/c'],
+                                        ordered=True)
+        self.assertEqual([f['key'] for f in files], self.keys)
+
+        # Every shard stops at its split point
+        markers = set(c[3]['marker'] for c in self.s3.calls)
+        self.assertTrue('logs/b/05' in markers and 'logs/c' in markers)
+        self.assertEqual(len(self.s3.calls), 13)
+
+    def test_early_exit(self):
+        """
+        Test that the workers stop when the consumer does
+        """
+        files = self.conn.list_parallel('logs/', workers=1, ordered=True)
+        self.assertEqual(next(files)['key'], 'logs/a/00')
+        files.close()
+
+    def test_flat_prefix(self):
+        """
+        Test that the direct files are yielded before the discovery ends, and
+        that a prefix without common prefixes is split at SPLIT_CHARS
+        """
+        big = ['big/{0:04d}'.format(i) for i in range(300)]
+        big += ['big/A', 'big/a/1', 'big/z']
+        for key in big:
+            self.s3.objects[('bucket', key)] = b'DATA'
+        big.sort()
+
+        for ordered in (True, False):
+            del self.s3.calls[:]
+            files = self.conn.list_parallel('big/', workers=2,
+                                            ordered=ordered)
+            first = next(files)['key']
+            # The discovery stopped at its first page
+            self.assertEqual(
+                len([c for c in self.s3.calls if 'delimiter' in c[3]]), 1)
+            keys = [first] + [f['key'] for f in files]
+            if ordered:
+                self.assertEqual(keys, big)
+            else:
+                self.assertEqual(sorted(keys), big)
+            # The rest of the prefix is listed by shards, without delimiter
+            self.assertTrue(any('delimiter' not in c[3] and
+                                c[3]['marker'] == 'big/0006'
+                                for c in self.s3.calls))
+
+
+class TestPrefetch(FakeBucketTestCase):
+    def test_prefetch(self):
+        """
+        Test listing with the next pages fetched in the background
+        """
+        second_page = threading.Event()
+        get = self.s3._get
+
+        def recording_get(bucket, key, query, *args):
+            if query.get('marker'):
+                second_page.set()
+            return get(bucket, key, query, *args)
+
+        self.s3._get = recording_get
+        files = self.conn.list('logs/', prefetch=2)
+        self.assertEqual(next(files)['key'], 'logs/a/00')
+        # The second page is requested while the first one is consumed, but
+        # no more than prefetch pages are fetched ahead
+        self.assertTrue(second_page.wait(5))
+        self.assertTrue(len(self.s3.calls) <= 4)
+        self.assertEqual([f['key'] for f in files],
+                         [k for k in self.keys if k.startswith('logs/')][1:])
+        self.assertEqual(len(self.s3.calls), 12)
+
+
+class TestStreamedList(FakeBucketTestCase):
+    def test_streamed(self):
+        """
+        Test that files are yielded while their page is still downloading
+        """
+        for i in range(1000):
+            self.s3.objects[('bucket', 'big/{0:04d}'.format(i))] = b'DATA'
+        self.s3.page_size = 1000
+        responses = []
+        get = self.s3._get
+
+        def recording_get(*args):
+            responses.append(get(*args))
+            return responses[-1]
+
+        self.s3._get = recording_get
+        files = self.conn.list('big/')
+        self.assertEqual(next(files)['key'], 'big/0000')
+        raw = responses[0].raw
+        self.assertTrue(raw.tell() < len(raw.getvalue()))
+        self.assertEqual(len(list(files)), 999)
+        self.assertTrue(responses[0].closed)
+
+
+class TestListV2(FakeBucketTestCase):
+    def test_list_v2(self):
+        """
+        Test listing with ListObjectsV2 and continuation tokens
+        """
+        files = list(self.conn.list_v2('logs/', start_after='logs/b/10',
+                                       max_keys=5))
+        self.assertEqual([f['key'] for f in files],
+                         [k for k in self.keys
+                          if k.startswith('logs/') and k > 'logs/b/10'])
+        params = [c[3] for c in self.s3.calls]
+        self.assertEqual(params[0], {'list-type': 2, 'prefix': 'logs/',
+                                     'max-keys': 5,
+                                     'start-after': 'logs/b/10'})
+        self.assertEqual(params[1]['continuation-token'], 'token:logs/b/15')
+
+    def test_list_v2_delimiter(self):
+        """
+        Test browsing "folders" with a delimiter
+        """
+        files = list(self.conn.list_v2('logs/', delimiter='/'))
+        self.assertEqual(
+            [f.get('prefix') or f['key'] for f in files],
+            ['logs/b.txt', 'logs/z.txt', 'logs/a/', 'logs/b/', 'logs/c/',
+             'logs/d/'])
+        self.assertEqual(len(self.s3.calls), 1)
+
+
+class TestListBatches(FakeBucketTestCase):
+    def test_batches(self):
+        """
+        Test listing pages as columnar batches
+        """
+        batches = list(self.conn.list_batches('logs/'))
+        self.assertEqual([len(b) for b in batches], [7] * 11 + [5])
+        keys = [k for k in self.keys if k.startswith('logs/')]
+        self.assertEqual([k for b in batches for k in b.keys], keys)
+
+        files = list(self.conn.list('logs/'))
+        self.assertEqual([r.to_dict() for b in batches for r in b], files)
+        row = batches[0][-1]
+        self.assertEqual(row['size'], 4)
+        self.assertEqual(row.key, 'logs/a/06')
+        self.assertEqual(batches[0].sizes.typecode, 'q')
+        self.assertTrue(batches[0].storage_classes[0] is
+                        batches[1].storage_classes[3])
+
+    def test_batches_delimiter(self):
+        """
+        Test the common prefixes of the batches
+        """
+        batches = list(self.conn.list_batches('logs/', delimiter='/'))
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(batches[0].keys, ['logs/b.txt', 'logs/z.txt'])
+        self.assertEqual(batches[0].prefixes,
+                         ['logs/a/', 'logs/b/', 'logs/c/', 'logs/d/'])
+
+    def test_parse_timestamp(self):
+        """
+        Test the fixed format timestamp parser against strptime
+        """
+        epoch = datetime.datetime(1970, 1, 1)
+        days = {}
+        for value in ['1970-01-01T00:00:00.000Z', '2000-02-29T23:59:59.000Z',
+                      '2013-10-31T15:38:32.000Z', '2100-03-01T01:02:03.999Z',
+                      '1969-12-31T23:59:59.000Z']:
+            expected = datetime.datetime.strptime(
+                value, '%Y-%m-%dT%H:%M:%S.%fZ').replace(microsecond=0)
+            seconds = (expected - epoch).days * 86400 + \
+                (expected - epoch).seconds
+            self.assertEqual(parse_timestamp(value), seconds)
+            self.assertEqual(parse_timestamp(value, days), seconds)
+        self.assertEqual(len(days), 5)
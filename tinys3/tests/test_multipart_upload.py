@@ -5,11 +5,16 @@ try:
     from StringIO import StringIO
 except ImportError:
     from io import StringIO
-from tinys3 import Connection
+import os
+import tempfile
+from io import BytesIO
+from requests.exceptions import HTTPError
+from tinys3 import Connection, Pool, MultipartUpload, multipart_upload
 from tinys3.request_factory import (
     InitiateMultipartUploadRequest, UploadPartRequest, CompleteUploadRequest,
     CancelUploadRequest, ListMultipartUploadRequest, ListPartsRequest
 )
+from .fake_adapter import FakeS3Adapter, FakeResponse
 
 
 class TestMultipartUpload(unittest.TestCase):
@@ -53,7 +58,8 @@ class TestMultipartUpload(unittest.TestCase):
         mock.should_receive('post').with_args(
             'https://{0}.s3.amazonaws.com/{1}?uploads'.format(
                 self.test_bucket, self.test_key),
-            auth=self.conn.auth
+            auth=self.conn.auth,
+            headers=None
         ).and_return(flexmock(
             raise_for_status=lambda: None,
             content=response_content)
@@ -193,10 +199,12 @@ class TestMultipartUpload(unittest.TestCase):
             'https://{0}.s3.amazonaws.com/?uploads'.format(
                 self.test_bucket, self.test_key),
             auth=self.conn.auth,
-            params=my_params
+            params=my_params,
+            stream=True
         ).and_return(flexmock(
             raise_for_status=lambda: None,
-            content=response_content)).once()
+            raw=BytesIO(response_content.encode('utf-8')),
+            close=lambda: None)).once()
 
         mp_uploads = list(req.run())
         self.assertEqual(len(mp_uploads), 1)
@@ -258,10 +266,12 @@ class TestMultipartUpload(unittest.TestCase):
             'https://{0}.s3.amazonaws.com/{1}?uploadId={2}'.format(
                 self.test_bucket, self.test_key, self.uploadId),
             auth=self.conn.auth,
-            params=my_params
+            params=my_params,
+            stream=True
             ).and_return(flexmock(
                 raise_for_status=lambda: None,
-                content=response_content)).once()
+                raw=BytesIO(response_content.encode('utf-8')),
+                close=lambda: None)).once()
 
         parts = list(req.run())
         self.assertEqual(len(parts), 2)
@@ -275,3 +285,236 @@ class TestMultipartUpload(unittest.TestCase):
         self.assertEqual(parts[1]['etag'],
                                  '"aaaa18db4cc2f85cedef654fccc4a4x8"')
         self.assertEqual(parts[1]['size'], 10485760)
+
+    def _multipart_conn(self):
+        """
+        A connection uploading files larger than 10 bytes in 4 bytes parts,
+        to a fake S3
+        """
+        conn = Connection("TEST_ACCESS_KEY", "TEST_SECRET_KEY", tls=True,
+                          multipart_threshold=10, multipart_workers=2)
+        # The fake S3 has no minimum part size
+        conn.multipart_part_size = 4
+        conn.session = FakeS3Adapter()
+        # Retry the failed parts without waiting
+        flexmock(multipart_upload, MIN_PART_SIZE=1, PART_RETRY_DELAY=0)
+        return conn
+
+    def test_minimum_part_size(self):
+        """Test that parts smaller than S3's minimum are rejected"""
+        self.assertRaises(ValueError, Connection, "TEST_ACCESS_KEY",
+                          "TEST_SECRET_KEY", multipart_threshold=10,
+                          multipart_part_size=1024 * 1024)
+
+        mp = MultipartUpload(self.conn, self.test_bucket, self.test_key)
+        self.assertRaises(ValueError, mp.upload_file, BytesIO(b'data'),
+                          part_size=1024 * 1024)
+
+    def test_upload_switches_to_multipart(self):
+        """Test that large uploads are sent as concurrent multipart uploads"""
+        conn = self._multipart_conn()
+        data = b'abcdefghijklmnopqrstuvwxyz'
+
+        conn.upload('big.zip', BytesIO(data), self.test_bucket, expires=1337)
+
+        s3 = conn.session
+        self.assertEqual(s3.objects[(self.test_bucket, 'big.zip')], data)
+        initiate = s3.calls[0]
+        self.assertEqual(initiate[0], 'POST')
+        self.assertEqual(initiate[4]['Content-Type'], 'application/zip')
+        self.assertEqual(initiate[4]['Cache-Control'], 'max-age=1337, public')
+        self.assertEqual(initiate[4]['x-amz-acl'], 'public-read')
+        part_calls = [c for c in s3.calls if 'partNumber' in c[3]]
+        self.assertEqual(len(part_calls), 7)
+
+        # Small files are still uploaded with a single request
+        conn.upload('small.zip', BytesIO(b'abc'), self.test_bucket)
+        self.assertEqual(s3.calls[-1][0], 'PUT')
+        self.assertFalse('uploadId' in s3.calls[-1][3])
+        self.assertEqual(s3.objects[(self.test_bucket, 'small.zip')], b'abc')
+
+    def test_failed_multipart_upload_is_cancelled(self):
+        """Test that the upload is aborted when a part fails"""
+        conn = self._multipart_conn()
+        s3 = conn.session
+        put = s3._put
+
+        def failing_put(bucket, key, query, headers, body):
+            if query.get('partNumber') == '3':
+                return FakeResponse(500)
+            return put(bucket, key, query, headers, body)
+
+        s3._put = failing_put
+
+        self.assertRaises(HTTPError, conn.upload, 'big.zip',
+                          BytesIO(b'x' * 26), self.test_bucket)
+        self.assertEqual(s3.calls[-1][0], 'DELETE')
+        self.assertEqual(s3.uploads, {})
+        self.assertFalse((self.test_bucket, 'big.zip') in s3.objects)
+
+    def test_failed_part_is_retried(self):
+        """Test that a part failing with a server error is uploaded again"""
+        conn = self._multipart_conn()
+        s3 = conn.session
+        put = s3._put
+        failures = [500]
+
+        def flaky_put(bucket, key, query, headers, body):
+            if query.get('partNumber') == '3' and failures:
+                return FakeResponse(failures.pop())
+            return put(bucket, key, query, headers, body)
+
+        s3._put = flaky_put
+        data = b'abcdefghijklmnopqrstuvwxyz'
+
+        conn.upload('big.zip', BytesIO(data), self.test_bucket)
+
+        self.assertEqual(s3.objects[(self.test_bucket, 'big.zip')], data)
+        part_calls = [c for c in s3.calls if c[3].get('partNumber') == '3']
+        self.assertEqual(len(part_calls), 2)
+
+    def test_failed_abort_keeps_the_error(self):
+        """Test that client errors aren't retried, and that the error of the
+        part is raised when the abort fails too"""
+        conn = self._multipart_conn()
+        s3 = conn.session
+        put = s3._put
+
+        def failing_put(bucket, key, query, headers, body):
+            if query.get('partNumber') == '3':
+                return FakeResponse(403)
+            return put(bucket, key, query, headers, body)
+
+        s3._put = failing_put
+        s3._delete = lambda *args: FakeResponse(500)
+
+        with self.assertRaises(HTTPError) as raised:
+            conn.upload('big.zip', BytesIO(b'x' * 26), self.test_bucket)
+        self.assertEqual(raised.exception.response.status_code, 403)
+        part_calls = [c for c in s3.calls if c[3].get('partNumber') == '3']
+        self.assertEqual(len(part_calls), 1)
+        self.assertEqual(s3.calls[-1][0], 'DELETE')
+
+    def test_upload_file(self):
+        """Test uploading the parts of a file concurrently"""
+        conn = self._multipart_conn()
+        data = b'abcdefghijklmnopqrstuvwxyz'
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, data)
+            os.close(fd)
+
+            mp = conn.initiate_multipart_upload(self.test_key,
+                                                self.test_bucket)
+            parts = mp.upload_file(path, part_size=10, workers=2)
+            mp.complete_upload()
+        finally:
+            os.remove(path)
+
+        self.assertEqual([p['part_number'] for p in parts], [1, 2, 3])
+        self.assertEqual(
+            conn.session.objects[(self.test_bucket, self.test_key)], data)
+
+    def test_upload_file_from_position(self):
+        """Test that file objects are uploaded from their position"""
+        conn = self._multipart_conn()
+        f = BytesIO(b'0123456789')
+        f.seek(2)
+
+        mp = conn.initiate_multipart_upload(self.test_key, self.test_bucket)
+        mp.upload_file(f, part_size=5)
+
+        upload = conn.session.uploads[mp.uploadId]
+        self.assertEqual(upload['parts'], {1: b'23456', 2: b'789'})
+
+    def test_complete_upload_with_recorded_parts(self):
+        """Test completing an upload without listing its parts"""
+        conn = self._multipart_conn()
+
+        mp = conn.initiate_multipart_upload(self.test_key, self.test_bucket)
+        mp.upload_part_from_file(BytesIO(b'first'), 1)
+        mp.upload_part_from_file(BytesIO(b'second'), 2)
+        self.assertEqual(sorted(mp.parts), [1, 2])
+        mp.complete_upload()
+
+        methods = [c[0] for c in conn.session.calls]
+        self.assertEqual(methods, ['POST', 'PUT', 'PUT', 'POST'])
+        self.assertEqual(
+            conn.session.objects[(self.test_bucket, self.test_key)],
+            b'firstsecond')
+
+        # Uploads found by listing fall back to listing their parts
+        mp = conn.initiate_multipart_upload(self.test_key, self.test_bucket)
+        conn.session.uploads[mp.uploadId]['parts'][1] = b'listed'
+        mp.complete_upload()
+        self.assertEqual(conn.session.calls[-2][0], 'GET')
+
+    def test_resume_upload_from_journal(self):
+        """Test resuming an upload, uploading only the missing parts"""
+        conn = self._multipart_conn()
+        s3 = conn.session
+        data = b'abcdefghijklmnopqrstuvwxyz'
+        fd, journal = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(journal)
+        put = s3._put
+
+        def failing_put(bucket, key, query, headers, body):
+            if query.get('partNumber') == '2':
+                raise IOError('Connection reset')
+            return put(bucket, key, query, headers, body)
+
+        s3._put = failing_put
+        mp = conn.initiate_multipart_upload(self.test_key, self.test_bucket,
+                                            journal=journal)
+        self.assertRaises(IOError, mp.upload_file, BytesIO(data),
+                          part_size=10, workers=1)
+        self.assertTrue(os.path.exists(journal))
+        s3._put = put
+        # A part that S3 doesn't know about is uploaded again
+        with open(journal, 'a') as f:
+            f.write('{"part_number": 3, "etag": "lost"}\n')
+
+        mp = conn.resume_multipart_upload(journal)
+        self.assertEqual(mp.uploadId, 'upload-1')
+        self.assertEqual(mp.part_size, 10)
+        self.assertEqual(sorted(mp.parts), [1])
+
+        calls = len(s3.calls)
+        mp.upload_file(BytesIO(data))
+        uploaded = [c[3]['partNumber'] for c in s3.calls[calls:]]
+        self.assertEqual(sorted(uploaded), ['2', '3'])
+
+        mp.complete_upload()
+        self.assertEqual(s3.objects[(self.test_bucket, self.test_key)], data)
+        self.assertFalse(os.path.exists(journal))
+
+    def test_failed_completion_keeps_journal(self):
+        """Test that a pool removes the journal only once completed"""
+        pool = Pool("TEST_ACCESS_KEY", "TEST_SECRET_KEY", tls=True)
+        s3 = pool.session = FakeS3Adapter()
+        fd, journal = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(journal)
+        post = s3._post
+
+        def failing_post(bucket, key, query, headers, body):
+            if 'uploadId' in query:
+                return FakeResponse(500)
+            return post(bucket, key, query, headers, body)
+
+        with pool:
+            mp = pool.initiate_multipart_upload(self.test_key,
+                                                self.test_bucket,
+                                                journal=journal)
+            mp.upload_part_from_file(BytesIO(b'data'), 1).result()
+            s3._post = failing_post
+            self.assertRaises(HTTPError, mp.complete_upload().result)
+            self.assertTrue(os.path.exists(journal))
+
+            s3._post = post
+            mp = pool.resume_multipart_upload(journal)
+            mp.complete_upload().result()
+        self.assertFalse(os.path.exists(journal))
+        self.assertEqual(s3.objects[(self.test_bucket, self.test_key)],
+                         b'data')
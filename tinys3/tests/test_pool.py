@@ -2,11 +2,13 @@
 
 import threading
 import unittest
+from io import BytesIO
 from flexmock import flexmock
 from nose.tools import raises
 import time
 from tinys3.auth import S3Auth
 from tinys3.pool import Pool
+from .fake_adapter import FakeS3Adapter
 from .test_conn import TEST_SECRET_KEY, TEST_ACCESS_KEY
 from concurrent.futures import ThreadPoolExecutor, Future
 import concurrent.futures
@@ -32,6 +34,11 @@ class TestPool(unittest.TestCase):
         pool = Pool(TEST_ACCESS_KEY, TEST_SECRET_KEY, size=25)
         self.assertEquals(pool.executor._max_workers, 25)
 
+        # The keep-alive pool is sized after the workers by default
+        self.assertEquals(pool.pool_size, 25)
+        pool = Pool(TEST_ACCESS_KEY, TEST_SECRET_KEY, size=25, pool_size=50)
+        self.assertEquals(pool.pool_size, 50)
+
 
     def test_as_completed(self):
         """
@@ -81,4 +88,73 @@ class TestPool(unittest.TestCase):
 
         with pool as p:
             # do nothing
-            pass
\ No newline at end of file
+            pass
+
+    def test_single_flight(self):
+        """
+        Test that identical gets in flight share a single request
+        """
+        pool = Pool(TEST_ACCESS_KEY, TEST_SECRET_KEY, default_bucket='bucket',
+                    size=1)
+        pool.session = FakeS3Adapter()
+        pool.session.objects[('bucket', 'key')] = b'DUMMY'
+
+        # Block the worker until all the gets are submitted
+        release = threading.Event()
+        pool.executor.submit(release.wait)
+
+        with pool:
+            futures = [pool.get('key') for i in range(10)]
+            heads = [pool.head_object('key') for i in range(10)]
+            other = pool.get('key', headers={'Range': 'bytes=0-1'})
+            release.set()
+
+            self.assertEqual(len(set(futures)), 1)
+            self.assertEqual(len(set(heads)), 1)
+            self.assertTrue(other is not futures[0])
+            self.assertEqual(futures[-1].result().content, b'DUMMY')
+            other.result()
+            self.assertEqual(len(pool.session.calls), 3)
+
+            # Completed requests aren't shared, once their done callback
+            # forgot them
+            deadline = time.time() + 5
+            while pool._in_flight and time.time() < deadline:
+                time.sleep(0.001)
+            self.assertEqual(pool._in_flight, {})
+            self.assertTrue(pool.get('key') is not futures[0])
+
+        pool = Pool(TEST_ACCESS_KEY, TEST_SECRET_KEY, coalesce=False)
+        self.assertTrue(pool.get('key', 'bucket') is not
+                        pool.get('key', 'bucket'))
+        pool.close()
+
+    def test_get_after_write(self):
+        """
+        Test that a get submitted after a write doesn't share the get of the
+        old body that was in flight during the write
+        """
+        s3 = FakeS3Adapter()
+        s3.objects[('bucket', 'key')] = b'OLD'
+        started, release = threading.Event(), threading.Event()
+        read = s3._get
+
+        def slow_get(bucket, key, query, headers, body):
+            r = read(bucket, key, query, headers, body)
+            started.set()
+            release.wait()
+            return r
+        s3._get = slow_get
+
+        with Pool(TEST_ACCESS_KEY, TEST_SECRET_KEY, default_bucket='bucket',
+                  size=2) as pool:
+            pool.session = s3
+            old = pool.get('key')
+            started.wait()
+            pool.upload('key', BytesIO(b'NEW')).result()
+            new = pool.get('key')
+            release.set()
+
+            self.assertTrue(new is not old)
+            self.assertEqual(old.result().content, b'OLD')
+            self.assertEqual(new.result().content, b'NEW')
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import Future
+from tinys3.util import (FileSliceStream, LenWrapperStream, iter_windowed,
+                         iter_prefetched)
+
+
+class TestFileSliceStream(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, b'0123456789')
+        os.close(fd)
+        self.f = open(self.path, 'rb')
+
+    def tearDown(self):
+        self.f.close()
+        os.remove(self.path)
+
+    def test_read_slice(self):
+        """
+        Test reading a range of a file
+        """
+        s = FileSliceStream(self.f, 2, 5)
+
+        self.assertEqual(len(s), 5)
+        self.assertEqual(s.read(2), b'23')
+        self.assertEqual(s.tell(), 2)
+        self.assertEqual(s.read(), b'456')
+        self.assertEqual(s.read(), b'')
+
+        # Slices don't move the position of the file
+        self.assertEqual(self.f.tell(), 0)
+
+    def test_seek(self):
+        """
+        Test seeking inside a slice
+        """
+        s = FileSliceStream(self.f, 2, 5)
+
+        s.read()
+        s.seek(0)
+        self.assertEqual(s.read(1), b'2')
+        s.seek(-2, os.SEEK_END)
+        self.assertEqual(s.read(), b'56')
+        self.assertEqual(len(LenWrapperStream(s)), 5)
+
+    def test_slice_past_the_end(self):
+        """
+        Test that slices are shortened at the end of the file
+        """
+        s = FileSliceStream(self.f.fileno(), 8, 5)
+
+        self.assertEqual(len(s), 2)
+        self.assertEqual(b''.join(s), b'89')
+
+
+class TestIterWindowed(unittest.TestCase):
+    def test_byte_budget(self):
+        """
+        Test that the items in flight fit in the weight budget
+        """
+        submitted = []
+
+        def submit(request):
+            submitted.append(request)
+            future = Future()
+            future.set_result(request)
+            return future
+
+        items = [(i, size) for i, size in enumerate([60, 30, 20, 200, 5])]
+        results = iter_windowed(submit, items, 10, ordered=True,
+                                weight=lambda size: size, max_weight=100)
+
+        self.assertEqual(next(results), (0, 60))
+        # 60 + 30 fit, 20 more didn't
+        self.assertEqual(submitted, [60, 30])
+        self.assertEqual(next(results), (1, 30))
+        self.assertEqual(submitted, [60, 30, 20])
+        self.assertEqual(next(results), (2, 20))
+        # Heavier than the budget, sent alone
+        self.assertEqual(next(results), (3, 200))
+        self.assertEqual(submitted, [60, 30, 20, 200])
+        self.assertEqual(list(results), [(4, 5)])
+
+
+class TestIterPrefetched(unittest.TestCase):
+    def test_read_ahead(self):
+        """
+        Test that the items are produced ahead of the consumer
+        """
+        produced = []
+
+        def pages():
+            for i in range(5):
+                produced.append(i)
+                yield i
+
+        items = iter_prefetched(pages(), 2)
+        self.assertEqual(next(items), 0)
+        # Wait for the producer to fill the queue
+        for i in range(100):
+            if len(produced) == 4:
+                break
+            time.sleep(0.01)
+        # 2 items in the queue, and one waiting for room
+        self.assertEqual(produced, [0, 1, 2, 3])
+        self.assertEqual(list(items), [1, 2, 3, 4])
+
+    def test_errors(self):
+        """
+        Test that the errors of the producer are raised to the consumer
+        """
+        def pages():
+            yield 1
+            raise ValueError('oops')
+
+        items = iter_prefetched(pages(), 1)
+        self.assertEqual(next(items), 1)
+        self.assertRaises(ValueError, next, items)
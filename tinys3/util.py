@@ -1,4 +1,14 @@
+import collections
 import os
+import threading
+
+from concurrent.futures import wait, FIRST_COMPLETED
+
+# Python 2/3 compatibility
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 
 def stringify(s):
@@ -118,3 +128,246 @@ class LenWrapperStream(object):
         Proxy for the repr of the stream
         """
         return repr(self.stream)
+
+
+# Serializes the positional reads/writes on platforms without os.pread/pwrite
+_seek_lock = threading.Lock()
+
+
+def pread(fd, length, offset):
+    """
+    Reads `length` bytes from the given offset of a file descriptor, without
+    moving the file position (when os.pread is available).
+    """
+    if hasattr(os, 'pread'):
+        return os.pread(fd, length, offset)
+    with _seek_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, length)
+
+
+def pwrite(fd, data, offset):
+    """
+    Writes data at the given offset of a file descriptor, without moving the
+    file position (when os.pwrite is available).
+    """
+    if hasattr(os, 'pwrite'):
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data = data[written:]
+            offset += written
+        return
+    with _seek_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        while data:
+            data = data[os.write(fd, data):]
+
+
+class FileSliceStream(object):
+    """
+    A read only stream exposing a byte range of an open file.
+
+    Reads go straight to the file descriptor with positional reads, so many
+    slices of the same file can be read concurrently (e.g. by the parts of a
+    multipart upload), without copying the file or reopening it per slice.
+    The underlying file is never closed by the slice.
+    """
+
+    def __init__(self, fp, offset, length):
+        """
+        Creates a new slice
+
+        Params:
+            - fp        An open file object, or a file descriptor
+            - offset    The offset of the slice in the file
+            - length    The length of the slice (shortened if the file ends
+                        before it)
+        """
+        self.fd = fp if isinstance(fp, int) else fp.fileno()
+        self.offset = offset
+        size = os.fstat(self.fd).st_size
+        self.length = max(0, min(length, size - offset))
+        self.pos = 0
+
+    def read(self, n=-1):
+        """
+        Reads up to n bytes from the current position of the slice
+        """
+        remaining = self.length - self.pos
+        if n is None or n < 0 or n > remaining:
+            n = remaining
+        if n <= 0:
+            return b''
+        data = pread(self.fd, n, self.offset + self.pos)
+        self.pos += len(data)
+        return data
+
+    def __iter__(self):
+        """
+        Iterates over the slice in 64KB blocks
+        """
+        while True:
+            block = self.read(64 * 1024)
+            if not block:
+                break
+            yield block
+
+    def seek(self, pos, mode=0):
+        """
+        Moves the position inside the slice
+        """
+        if mode == os.SEEK_CUR:
+            pos += self.pos
+        elif mode == os.SEEK_END:
+            pos += self.length
+        self.pos = max(0, pos)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def __len__(self):
+        """
+        The length of the slice, from its start
+        """
+        return self.length
+
+    def close(self):
+        """
+        The underlying file is owned by the caller, so nothing is closed
+        """
+        pass
+
+    @property
+    def closed(self):
+        return False
+
+    def __repr__(self):
+        return '<FileSliceStream fd={0} offset={1} length={2}>'.format(
+            self.fd, self.offset, self.length)
+
+
+def iter_windowed(submit, items, max_in_flight, ordered=False, weight=None,
+                  max_weight=None):
+    """
+    Submits the items of an iterable, keeping at most max_in_flight of them
+    in flight at a time, and yields a (tag, result) tuple for every item as
+    it completes. Failed items yield the exception as their result.
+
+    Params:
+        - submit        A callable, submitting a request and returning a
+                        Future
+        - items         An iterable of (tag, request) tuples, consumed
+                        lazily
+        - max_in_flight The maximum number of items in flight
+        - ordered       (Optional) Yield the results in the order of the
+                        items, instead of as soon as they complete
+        - weight        (Optional) A callable returning the weight (e.g. the
+                        size in bytes) of a request
+        - max_weight    (Optional) The maximum total weight of the items in
+                        flight. An item heavier than max_weight is still
+                        sent, alone.
+    """
+    items = iter(items)
+    # (tag, future, weight) entries, every submission has its own entry, as
+    # identical requests may share a future (single flight)
+    pending = collections.deque()
+    in_flight = [0]
+    next_item = [None]
+
+    def fill():
+        while len(pending) < max_in_flight:
+            if next_item[0] is None:
+                item = next(items, None)
+                if item is None:
+                    return
+                w = weight(item[1]) if weight is not None else 0
+                next_item[0] = item + (w,)
+            tag, request, w = next_item[0]
+            if max_weight is not None and pending and \
+                    in_flight[0] + w > max_weight:
+                return
+            next_item[0] = None
+            pending.append((tag, submit(request), w))
+            in_flight[0] += w
+
+    try:
+        while True:
+            fill()
+            if not pending:
+                return
+
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                finished = wait(set(f for t, f, w in pending),
+                                return_when=FIRST_COMPLETED)[0]
+                done = [e for e in pending if e[1] in finished]
+                for entry in done:
+                    pending.remove(entry)
+            for tag, future, w in done:
+                in_flight[0] -= w
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = e
+                yield tag, result
+    finally:
+        # The consumer stopped early, don't send the remaining requests
+        for tag, future, w in pending:
+            future.cancel()
+
+
+def queue_put(q, item, stop):
+    """
+    Puts an item in a bounded queue, unless stop is set while waiting for
+    room in the queue
+
+    Returns:
+        True if the item was put, False if stopped
+    """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def iter_prefetched(iterable, depth):
+    """
+    Iterates over an iterable on a background thread, up to depth items
+    ahead of the consumer, so producing the next items (e.g. fetching the next
+    pages of a listing) overlaps with consuming the current one.
+
+    Exceptions raised by the iterable are raised to the consumer.
+    """
+    q = queue.Queue(depth)
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                if not queue_put(q, (item, None), stop):
+                    return
+        except Exception as e:
+            queue_put(q, (done, e), stop)
+            return
+        queue_put(q, (done, None), stop)
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, error = q.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        # The consumer may have stopped early
+        stop.set()